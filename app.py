@@ -1,25 +1,115 @@
-from flask import Flask, request, jsonify, abort
+from flask import Flask, request, jsonify, abort, g, has_app_context, stream_with_context, render_template
 from flask_sqlalchemy import SQLAlchemy
 from flask_caching import Cache
 from flask_cors import CORS
 from sqlalchemy import text
+from sqlalchemy.exc import DataError, IntegrityError, InterfaceError, OperationalError, ProgrammingError
+from sqlalchemy.orm import Session
+from werkzeug.exceptions import ServiceUnavailable
 import os
-from datetime import datetime
+import gzip
+import zlib
+import csv
+import json
+import hashlib
+import hmac
+import threading
+import cProfile
+import io
+import pstats
+import sqlite3
+from bisect import bisect_left, bisect_right
+from datetime import datetime, date
+from ranking import ScoreTable, RankingEngine, RankingHistory, one_year_before
+from columnar_ranking import ColumnarRankingEngine, numpy
+from player_search import PlayerSearchIndex
+from leaderboard_events import LeaderboardBroadcaster, BUSY_RETRY_SECONDS
+from records import PlayerRecord, TournamentRecord, index_player_results, index_tournament_results, intern_string
+from schema import (ALL_AGE_GROUPS, ALL_EVENT_TYPES, DATE_PATTERN, MAX_SQLITE_INTEGER, MIN_SQLITE_INTEGER, REFRESH_TOURNAMENT_SCORE_SQLS,
+                    database_write_lock, ensure_migrated)
+from snapshots import SnapshotManager
+from metrics import Metrics, cache_key_family, start_request_timing, timed_phase, finish_request_timing
+
+# Optional faster JSON encoder and brotli compression
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 basedir = os.path.abspath(os.path.dirname(__file__))
+DATABASE_PATH = os.environ.get('TOURNAMENT_DB', os.path.join(basedir, 'tournament.db'))
 
 app = Flask(__name__)
 CORS(app)  # Apply CORS to your Flask app
 
 # Configuration for Flask-SQLAlchemy
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'tournament.db')
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + DATABASE_PATH
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app)
 
-# Configuration for Flask-Caching
-app.config['CACHE_TYPE'] = 'simple'
+# Read endpoints use a pool of read-only connections shared by the worker threads,
+# SQLAlchemy is only used to write
+app.config['SQLITE_POOL_SIZE'] = int(os.environ.get('SQLITE_POOL_SIZE', 8))
+
+# Serve the snapshot named by SNAPSHOT_DIR/CURRENT once one is published (see snapshots.py), DATABASE_PATH until then.
+# Every request runs on the snapshot that was current when it started
+app.config['SNAPSHOT_DIR'] = os.environ.get('SNAPSHOT_DIR')
+snapshot_manager = SnapshotManager(DATABASE_PATH, app.config['SNAPSHOT_DIR'], app.config['SQLITE_POOL_SIZE'],
+                                   warm=lambda snapshot: warm_snapshot(snapshot))
+
+def get_snapshot():
+    if has_app_context() and g.get('snapshot') != None:
+        return g.snapshot
+    return snapshot_manager.current
+
+def is_draining():
+    # The request started on a snapshot that has been replaced since, or warms one not served yet:
+    # what it builds must not replace the state of the current snapshot
+    return get_snapshot() is not snapshot_manager.current
+
+# Configuration for Flask-Caching: a bounded LRU cache per worker, or a file system cache
+# shared by all workers (CACHE_BACKEND=filesystem), flushed everywhere when the generation file changes
+app.config['CACHE_TYPE'] = 'cache_backend.GenerationalCache'
+app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'lru')
+app.config['CACHE_DIR'] = os.environ.get('CACHE_DIR', os.path.join(basedir, 'cache'))
+app.config['CACHE_THRESHOLD'] = int(os.environ.get('CACHE_THRESHOLD', 5000))
+app.config['CACHE_DEFAULT_TIMEOUT'] = int(os.environ.get('CACHE_DEFAULT_TIMEOUT', 3600))
+app.config['CACHE_IGNORE_ERRORS'] = True
+app.config['CACHE_GENERATION_FILE'] = DATABASE_PATH + '.generation'
 cache = Cache(app)
 
+def get_cache_namespace():
+    # Each snapshot has its own cache keys and generation file
+    snapshot = get_snapshot()
+    return ('' if snapshot.version == None else f'{snapshot.version}:', snapshot.generation_file)
+
+cache.cache.get_namespace = get_cache_namespace
+
+# Token required to ingest tournament results, ingestion is disabled when it is not set
+app.config['INGEST_TOKEN'] = os.environ.get('INGEST_TOKEN')
+
+# Allow ?profile=1 to return a cProfile dump of the request instead of its response
+app.config['PROFILING_ENABLED'] = os.environ.get('PROFILING_ENABLED') == '1'
+
+# Build the current leaderboards with NumPy when it is installed (COLUMNAR_RANKING=0 to use the Python engine)
+app.config['COLUMNAR_RANKING'] = numpy != None and os.environ.get('COLUMNAR_RANKING', '1') == '1'
+
+# Live leaderboard streams open at once in a worker. Under gthread (gunicorn.conf.py) each holds one of its
+# threads, so half of THREADS by default and the other requests always have threads left. The gevent workers
+# of gunicorn_stream.conf.py hold them in greenlets and set it to about their worker_connections
+app.config['MAX_LEADERBOARD_STREAMS'] = int(os.environ.get('MAX_LEADERBOARD_STREAMS', max(1, int(os.environ.get('THREADS', 8)) // 2)))
+
+# Request and cache metrics of this process, served by /metrics
+metrics = Metrics()
+metrics.describe('http_requests_total', 'counter', 'Requests by route, method and status')
+metrics.describe('http_request_duration_seconds', 'histogram', 'Request latency by route')
+metrics.describe('http_request_phase_seconds_total', 'counter', 'Request time by route and phase (cache, db, serialize, processing)')
+metrics.describe('cache_requests_total', 'counter', 'Cache lookups by key family and result (hit or miss)')
+
 # Define the Score model
 class Score(db.Model):
     __tablename__ = 'score'
@@ -78,408 +168,732 @@ TOURNAMENT_DICT_CACHE_KEY = 'tournament_dict'
 TOURNAMENT_LIST_CACHE_KEY = 'tournament_list'
 SCORES_DICT_CACHE_KEY = 'score_dict'
 CURRENT_SCORES_DICT_CACHE_KEY = "score_dict_current"
+SCORE_TABLE_CACHE_KEY = 'score_table'
 
-RANKING_SQL = """
-    WITH player_ranked_score AS (
-        SELECT
-        usab_id, player_name, tournament_name, end_date, event_u_age, event_type, standing_level, ranking_points, player_age,
-        ROW_NUMBER() OVER (PARTITION BY usab_id, event_type ORDER BY ranking_points DESC) AS rank
-        FROM
-        usab_player_tournament_score
-        WHERE event_u_age <= :event_u_age
-    )
-    SELECT usab_id, player_name, SUM(ranking_points) AS total_score
-    FROM player_ranked_score
-    WHERE player_age < :event_u_age AND event_type=:event_type AND rank <=4
-    GROUP BY usab_id
-    ORDER BY total_score DESC
+SCORES_SQL = "SELECT version, tournament_type, age_group, standing_level, ranking_points FROM score"
+
+USAB_PLAYERS_SQL = "SELECT usab_id, player_name, birth_year, gender FROM usab_player WHERE usab_id != 0"
+
+# Names players were entered under in tournaments, searched along with their USAB names
+PLAYER_ALIASES_SQL = "SELECT DISTINCT usab_id, player_name FROM tournament_player WHERE usab_id != 0"
+
+TOURNAMENTS_SQL = """
+    SELECT tournament_id, tournament_name, tournament_type, description, location, start_date, end_date
+    FROM tournament
 """
 
-ALL_EVENT_TYPES = {'BS', 'GS', 'BD', 'GD', 'XD'}
-ALL_AGE_GROUPS = {'U11', 'U13', 'U15', 'U17', 'U19'}
+TOURNAMENT_PLAYERS_SQL = """
+    SELECT tournament_player_id, usab_id, player_name
+    FROM tournament_player
+    WHERE tournament_id = :tournament_id
+"""
 
-def get_all_version_score_dict():
-    score_dict = cache.get(SCORES_DICT_CACHE_KEY)
+TOURNAMENT_PERFORMANCE_SQL = """
+    SELECT tournament_player_performance.age_group, tournament_player_performance.event_type,
+    tournament_player.usab_id, tournament_player.player_name, tournament_player_performance.standing_level
+    FROM tournament_player_performance
+    JOIN tournament_player ON tournament_player_performance.tournament_id = tournament_player.tournament_id
+    AND tournament_player_performance.tournament_player_id = tournament_player.tournament_player_id
+    JOIN usab_player ON tournament_player.usab_id = usab_player.usab_id
+    WHERE tournament_player_performance.tournament_id = :tournament_id
+"""
 
-    if score_dict is None:
-        # If not in cache, fetch from database
-        scores = Score.query.all()
+# Every result of the last year, loaded once to build all leaderboards in memory
+RANKING_RESULTS_SQL = """
+    SELECT usab_id, tournament_id, end_date, tournament_type, age_group, event_type, standing_level
+    FROM player_tournament_score
+    WHERE end_date >= :min_end_date
+"""
+
+# Every result, for the rankings of past days
+RANKING_HISTORY_RESULTS_SQL = """
+    SELECT usab_id, tournament_id, end_date, tournament_type, age_group, event_type, standing_level
+    FROM player_tournament_score
+"""
+
+# Ranking rows of one tournament, applied to the leaderboards after an ingest
+TOURNAMENT_RANKING_RESULTS_SQL = """
+    SELECT usab_id, tournament_id, end_date, tournament_type, age_group, event_type, standing_level
+    FROM player_tournament_score
+    WHERE tournament_id = :tournament_id
+"""
+
+# Names players were entered under in one tournament, added to the search index after an ingest
+TOURNAMENT_ALIASES_SQL = "SELECT DISTINCT usab_id, player_name FROM tournament_player WHERE tournament_id = :tournament_id AND usab_id != 0"
+
+# Ingests logged by every worker (see schema.py), the last one and those after a seq
+INGEST_LOG_SEQ_SQL = "SELECT COALESCE(MAX(seq), 0) AS seq FROM ingest_log"
+INGEST_LOG_SQL = "SELECT seq, tournament_id, usab_ids FROM ingest_log WHERE seq > :seq ORDER BY seq"
 
-        # Format the results as a list of dictionaries
-        score_dict = {}
-        for score in scores:
-            if score.version not in score_dict:
-                score_dict[score.version] = {}
-            score_dict[score.version][(score.tournament_type, score.age_group, score.standing_level)] = score.ranking_points
+# Current results of a tournament, to find out which players an ingest actually changes
+TOURNAMENT_RESULTS_SQL = """
+    SELECT usab_id, player_name, age_group, event_type, standing_level
+    FROM player_tournament_score
+    WHERE tournament_id = :tournament_id
+"""
+
+# Tournament names, descriptions and types are looked up in the tournaments dictionary
+PLAYER_PERFORMANCE_SQL = """
+    SELECT tournament_id, end_date, event_type, age_group, player_name, standing_level
+    FROM player_tournament_score
+    WHERE usab_id = :usab_id
+"""
 
-        # Cache the result for subsequent requests
-        cache.set(SCORES_DICT_CACHE_KEY, score_dict)
+# Same for many players at once, {usab_ids} is replaced by the placeholders of a chunk of ids
+PLAYERS_PERFORMANCE_SQL = """
+    SELECT usab_id, tournament_id, end_date, event_type, age_group, player_name, standing_level
+    FROM player_tournament_score
+    WHERE usab_id IN ({usab_ids})
+"""
+
+# Every result for the performance export, filters are appended as AND clauses
+EXPORT_PERFORMANCES_SQL = """
+    SELECT usab_id, player_name, tournament_id, tournament_name, tournament_description, tournament_type,
+    end_date, event_type, age_group, standing_level
+    FROM player_tournament_score
+    WHERE usab_id != 0
+"""
+EXPORT_PERFORMANCES_ORDER_SQL = " ORDER BY usab_id, end_date, tournament_id, event_type, age_group"
+
+# Fields that can be selected with the fields= query parameter of the list endpoints
+PLAYER_FIELDS = ('usab_id', 'player_name', 'birth_year', 'gender')
+TOURNAMENT_FIELDS = ('tournament_id', 'tournament_name', 'tournament_type', 'description', 'location', 'start_date', 'end_date')
+TOURNAMENT_PERFORMANCE_FIELDS = ('age_group', 'event_type', 'usab_id', 'player_name', 'standing_level')
+RANK_FIELDS = ('usab_id', 'player_name', 'scores', 'rank')
+RANK_HISTORY_FIELDS = ('as_of', 'event_type', 'age_group', 'scores', 'rank')
+PLAYER_SEARCH_FIELDS = ('usab_id', 'player_name', 'birth_year', 'gender', 'matched_name', 'match', 'score')
+EXPORT_PERFORMANCE_FIELDS = ('usab_id', 'player_name', 'tournament_id', 'tournament_name', 'tournament_description', 'tournament_type',
+                             'end_date', 'event_type', 'age_group', 'standing_level', 'score')
+EXPORT_RANK_FIELDS = ('event_type', 'age_group', 'rank', 'usab_id', 'player_name', 'scores')
+
+# Most players a batch request can ask for
+MAX_BATCH_SIZE = 1000
+# Most ids bound in one query, below the 999 variables of SQLite builds older than 3.32
+MAX_QUERY_IDS = 500
+
+# Default and largest number of players returned by a player search
+DEFAULT_SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 100
+
+# Rows fetched from the cursor (or leaderboard entries) per chunk of an export response
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+# Retry-After of the requests that found the database locked by a writer for longer than the busy timeout
+DATABASE_BUSY_RETRY_SECONDS = 5
+
+# Most days a ranking history request can ask for, and the default number of days between them
+MAX_RANK_HISTORY_DAYS = 400
+DEFAULT_RANK_HISTORY_INTERVAL = 7
+
+# One lock per cache key being loaded, so concurrent misses wait on a single computation
+cache_load_locks = {}
+cache_load_locks_guard = threading.Lock()
+
+def count_cache_lookup(cache_key, value):
+    result = 'miss' if value is None else 'hit'
+    metrics.inc('cache_requests_total', (('family', cache_key_family(cache_key)), ('result', result)))
+
+def get_or_load(cache_key, load):
+    with timed_phase('cache'):
+        value = cache.get(cache_key)
+    count_cache_lookup(cache_key, value)
+
+    if value is None:
+        with cache_load_locks_guard:
+            lock = cache_load_locks.setdefault(cache_key, threading.Lock())
+        with lock:
+            # Another request may have loaded it while we were waiting
+            with timed_phase('cache'):
+                value = cache.get(cache_key)
+            if value is None:
+                value = load()
+                # Cache the result for subsequent requests
+                with timed_phase('cache'):
+                    cache.set(cache_key, value)
+            with cache_load_locks_guard:
+                cache_load_locks.pop(cache_key, None)
+    return value
+
+def load_all_version_score_dict():
+    # If not in cache, fetch from database
+    scores = execute_sql_query(SCORES_SQL)
+
+    # Format the results as a list of dictionaries
+    score_dict = {}
+    for score in scores:
+        if score['version'] not in score_dict:
+            score_dict[score['version']] = {}
+        score_dict[score['version']][(score['tournament_type'], score['age_group'], score['standing_level'])] = score['ranking_points']
     return score_dict
 
+def get_all_version_score_dict():
+    return get_or_load(SCORES_DICT_CACHE_KEY, load_all_version_score_dict)
+
 def get_score_dict(version):
-    cache_key = f'score_dict_v{version}'
-    versioned_score_dict = cache.get(cache_key)
-
-    if versioned_score_dict is None:
-        all_version_score_dict = get_all_version_score_dict()
-        if version in all_version_score_dict:
-            versioned_score_dict = all_version_score_dict[version]
-            # Cache the result for subsequent requests
-            cache.set(cache_key, versioned_score_dict)
-        else:
-            abort(400, 'Bad Request: invalid version parameter')
-    return versioned_score_dict
+    all_version_score_dict = get_all_version_score_dict()
+    if version not in all_version_score_dict:
+        abort(400, 'Bad Request: invalid version parameter')
+    return get_or_load(f'score_dict_v{version}', lambda: all_version_score_dict[version])
+
+def get_current_score_version():
+    return max(get_all_version_score_dict().keys())
 
 def get_current_score_dict():
-    current_score_dict = cache.get(CURRENT_SCORES_DICT_CACHE_KEY)
+    all_version_score_dict = get_all_version_score_dict()
+    return get_or_load(CURRENT_SCORES_DICT_CACHE_KEY, lambda: all_version_score_dict[get_current_score_version()])
 
-    if current_score_dict is None:
-        all_version_score_dict = get_all_version_score_dict()
-        current_version = max(all_version_score_dict.keys())
-        current_score_dict = all_version_score_dict[current_version]
-        # Cache the result for subsequent requests
-        cache.set(CURRENT_SCORES_DICT_CACHE_KEY, current_score_dict)
-    return current_score_dict
+def get_score_table():
+    # Ranking points of every version in dense arrays, see ranking.ScoreTable
+    return get_or_load(SCORE_TABLE_CACHE_KEY, lambda: ScoreTable(get_all_version_score_dict()))
 
-def get_usab_players_dict():
-    # Try to get player list from cache
-    usab_player_dict = cache.get(PLAYER_DICT_CACHE_KEY)
-
-    if usab_player_dict is None:
-        # If not in cache, fetch from database
-        usab_players = USABPlayer.query.filter(USABPlayer.usab_id != 0).all()
-
-        usab_player_dict = {}
-        # Format the results as a list of dictionaries
-        for player in usab_players:
-            usab_player_dict[player.usab_id] = {'player_name': player.player_name,
-                                           'birth_year': player.birth_year,
-                                           'gender': player.gender}
-
-        # Cache the result for subsequent requests
-        cache.set(PLAYER_DICT_CACHE_KEY, usab_player_dict)
+def get_score_version(score_version):
+    # Validated score version of a query parameter or JSON value, the current version when not given
+    if score_version == None:
+        return get_current_score_version()
+    if isinstance(score_version, str) and score_version.isdigit():
+        score_version = int(score_version)
+    if not isinstance(score_version, int) or isinstance(score_version, bool) or score_version not in get_all_version_score_dict():
+        abort(400, 'Bad Request: invalid score_version parameter')
+    return score_version
+
+def load_usab_players_dict():
+    # If not in cache, fetch from database
+    usab_players = execute_sql_query(USAB_PLAYERS_SQL)
+
+    usab_player_dict = {}
+    for player in usab_players:
+        usab_player_dict[player['usab_id']] = PlayerRecord(player['player_name'], player['birth_year'], player['gender'])
     return usab_player_dict
 
-def get_tournaments_dict():
-    # Try to get tournament list from cache
-    tournament_dict = cache.get(TOURNAMENT_DICT_CACHE_KEY)
-
-    if tournament_dict is None:
-        # If not in cache, fetch from database
-        tournaments = Tournament.query.all()
-
-        tournament_dict = {}
-        # Format the results as a list of dictionaries
-        for tournament in tournaments:
-            tournament_dict[tournament.tournament_id] = {
-                            'tournament_name': tournament.tournament_name,
-                            'tournament_type': tournament.tournament_type,
-                            'description': tournament.description,
-                            'location': tournament.location,
-                            'start_date': str(tournament.start_date),
-                            'end_date': str(tournament.end_date)}
-
-        # Cache the result for subsequent requests
-        cache.set(TOURNAMENT_DICT_CACHE_KEY, tournament_dict)
-
-    return tournament_dict
+def get_usab_players_dict():
+    return get_or_load(PLAYER_DICT_CACHE_KEY, load_usab_players_dict)
 
-# Custom key function to extract the first number before '-'
-def sort_by_standing_level(item):
-    return int(item['standing_level'].split('-')[0])
+def load_tournaments_dict():
+    # If not in cache, fetch from database
+    tournaments = execute_sql_query(TOURNAMENTS_SQL)
 
-def sort_by_end_date(item):
-    return item['end_date']
+    tournament_dict = {}
+    for tournament in tournaments:
+        tournament_dict[intern_string(tournament['tournament_id'])] = TournamentRecord(
+            tournament['tournament_name'], tournament['tournament_type'], tournament['description'],
+            tournament['location'], tournament['start_date'], tournament['end_date'])
+    return tournament_dict
 
-def sort_by_usab_id(item):
-    return item['usab_id']
+def get_tournaments_dict():
+    return get_or_load(TOURNAMENT_DICT_CACHE_KEY, load_tournaments_dict)
 
-def sort_by_tournament_player_id(item):
-    return item['tournament_player_id']
+def get_tournament_record(tournament_id):
+    tournament = get_tournaments_dict().get(tournament_id)
+    if tournament == None:
+        # Results of a tournament ingested by another worker after this one cached the tournaments
+        cache.delete_many(TOURNAMENT_DICT_CACHE_KEY, TOURNAMENT_LIST_CACHE_KEY)
+        tournament = get_tournaments_dict().get(tournament_id)
+    return tournament
 
 def sort_by_score(item):
     return item['score']
 
 def is_valid_date(date_string):
+    if not isinstance(date_string, str) or not DATE_PATTERN.fullmatch(date_string):
+        return False
     try:
         # Attempt to parse the date string
         datetime.strptime(date_string, '%Y-%m-%d')
         return True
     except ValueError:
-        # Raised if the format is incorrect
+        # Raised if the date does not exist
         return False
 
-def filter_performance(performance, request_args):
-    min_date_filter = request_args.get('min_date')
-    max_date_filter = request_args.get('max_date')
-    event_type_filter = request_args.get('event_type')
-    age_group_filter = request_args.get('age_group')
-    if event_type_filter != None and event_type_filter.upper() != performance['event_type']:
-        return False
-    if age_group_filter != None and age_group_filter.upper() != performance['age_group']:
-        return False
-    if min_date_filter != None and min_date_filter > performance['end_date']:
-        return False
-    if max_date_filter != None and max_date_filter < performance['end_date']:
-        return False
-    return True
+def get_sqlite_integer(value):
+    # The value (an int or a string of digits) as an int, None when it is not an SQLite INTEGER
+    if isinstance(value, str) and value.isascii() and value.isdigit():
+        value = int(value)
+    if not isinstance(value, int) or isinstance(value, bool) or not MIN_SQLITE_INTEGER <= value <= MAX_SQLITE_INTEGER:
+        return None
+    return value
+
+def get_performance_filters(request_args):
+    # Validated event_type, age_group, min_date and max_date filters, None when not given
+    filters = {'min_date': request_args.get('min_date'), 'max_date': request_args.get('max_date')}
+
+    for date_filter in ('min_date', 'max_date'):
+        if filters[date_filter] != None and not is_valid_date(filters[date_filter]):
+            abort(400, f'Bad Request: invalid {date_filter} query parameter')
+    filters.update(get_event_filters(request_args))
+    return filters
+
+def get_event_filters(request_args):
+    # Validated event_type and age_group filters, None when not given, where date filters do not apply
+    filters = {'event_type': request_args.get('event_type'), 'age_group': request_args.get('age_group')}
+
+    if filters['event_type'] != None:
+        filters['event_type'] = filters['event_type'].upper()
+        if not filters['event_type'] in ALL_EVENT_TYPES:
+            abort(400, 'Bad Request: invalid event_type query parameter')
 
-def filter_tournament_event_performance(performance, request_args):
-    event_type_filter = request_args.get('event_type')
-    age_group_filter = request_args.get('age_group')
-    if event_type_filter != None and event_type_filter.upper() != performance['event_type']:
-        return False
-    if age_group_filter != None and age_group_filter.upper() != performance['age_group']:
-        return False
-    return True
+    if filters['age_group'] != None:
+        filters['age_group'] = filters['age_group'].upper()
+        if not filters['age_group'] in ALL_AGE_GROUPS:
+            abort(400, 'Bad Request: invalid age_group query parameter')
+    return filters
+
+def select_performance_groups(performance_index, filters):
+    # Keys of the (event_type, age_group) groups matching the filters, a dict lookup when both are given
+    event_type = filters['event_type']
+    age_group = filters['age_group']
+    if event_type != None and age_group != None:
+        keys = [(event_type, age_group)] if (event_type, age_group) in performance_index else []
+    else:
+        keys = [key for key in performance_index
+                if (event_type == None or key[0] == event_type) and (age_group == None or key[1] == age_group)]
+    return keys
+
+def get_pagination():
+    offset = request.args.get('offset', '0')
+    if not offset.isdigit():
+        abort(400, 'Bad Request: invalid offset query parameter')
+    limit = request.args.get('limit')
+    if limit != None and not limit.isdigit():
+        abort(400, 'Bad Request: invalid limit query parameter')
+    return int(offset), None if limit == None else int(limit)
+
+def get_projection(all_fields):
+    fields = request.args.get('fields')
+    if fields == None:
+        return None
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    if not fields or any(field not in all_fields for field in fields):
+        abort(400, 'Bad Request: invalid fields query parameter')
+    return fields
+
+def project(items, fields):
+    if fields == None:
+        return items
+    return [{field: item[field] for field in fields} for item in items]
+
+def paginate(items, offset, limit):
+    return items[offset:] if limit == None else items[offset:offset + limit]
+
+# Responses smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+def dumps_json(payload):
+    if orjson != None:
+        return orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(payload, sort_keys=True, separators=(',', ':')).encode()
+
+def get_response_encoding():
+    accept_encoding = request.accept_encodings
+    if brotli != None and accept_encoding['br']:
+        return 'br'
+    if accept_encoding['gzip']:
+        return 'gzip'
+    return 'identity'
+
+def encode_body(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=6)
+    return body
+
+def get_request_etag(encoding, ingest_key=None):
+    # Same data (snapshot, generation, day and last ingest of the player or tournament the response is about,
+    # or of any one), URL (with sorted query parameters) and encoding means the same response body
+    query = sorted(request.args.items(multi=True))
+    data_version = repr((get_data_base(), date.today(), get_ingest_seq(ingest_key), request.path, query, encoding))
+    return hashlib.sha1(data_version.encode()).hexdigest()
+
+def cached_json_response(build, ingest_key=None):
+    # build() returns (payload, response headers), its encoded body is cached until the data changes.
+    # ingest_key ('player', usab_id) or ('tournament', tournament_id) when only its ingests change the response
+    encoding = get_response_encoding()
+    etag = get_request_etag(encoding, ingest_key)
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        cache_key = f'response_{etag}'
+        with timed_phase('cache'):
+            cached_response = cache.get(cache_key)
+        count_cache_lookup(cache_key, cached_response)
+        if cached_response is None:
+            payload, headers = build()
+            with timed_phase('serialize'):
+                body = dumps_json(payload)
+                if len(body) < MIN_COMPRESS_SIZE:
+                    encoding = 'identity'
+                cached_response = (encode_body(body, encoding), encoding, headers)
+            with timed_phase('cache'):
+                cache.set(cache_key, cached_response)
+        body, body_encoding, headers = cached_response
+        response = app.response_class(body, mimetype='application/json', headers=headers)
+        if body_encoding != 'identity':
+            response.headers['Content-Encoding'] = body_encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(etag)
+    return response
+
+def json_response(payload):
+    with timed_phase('serialize'):
+        body = dumps_json(payload)
+    return app.response_class(body, mimetype='application/json')
+
+def list_response(build_page, ingest_key=None):
+    # build_page() returns (items of the requested page, total number of items)
+    def build():
+        items, total = build_page()
+        return items, {'X-Total-Count': str(total)}
+    return cached_json_response(build, ingest_key)
 
 # Endpoint to fetch all USAB players
 @app.route('/api/v1/scores', methods=['GET'])
 def get_scores():
     version = request.args.get('version')
-    if version == None:
-        # Try to get player list from cache
-        score_dict = get_current_score_dict()
-    else:
-        if not version.isdigit():
-            abort(400, 'Bad Request: invalid version query parameter')
+    if version != None and not version.isdigit():
+        abort(400, 'Bad Request: invalid version query parameter')
+
+    def build():
+        if version == None:
+            score_dict = get_current_score_dict()
         else:
             score_dict = get_score_dict(int(version))
 
-    score_list = [{'tournament_type': tournament_type, 'age_group': age_group,
-                    'standing_level': standing_level, 'ranking_points': ranking_points} for (tournament_type, age_group, standing_level), ranking_points in score_dict.items()]
+        score_list = [{'tournament_type': tournament_type, 'age_group': age_group,
+                        'standing_level': standing_level, 'ranking_points': ranking_points} for (tournament_type, age_group, standing_level), ranking_points in score_dict.items()]
+        return score_list, {}
 
-    return jsonify(score_list)
+    return cached_json_response(build)
+
+def load_usab_players_list():
+    # Sorted usab_ids, the players themselves are in the players dictionary
+    return sorted(get_usab_players_dict())
+
+def get_usab_players_list():
+    return get_or_load(PLAYER_LIST_CACHE_KEY, load_usab_players_list)
 
 # Endpoint to fetch all USAB players
 @app.route('/api/v1/players', methods=['GET'])
 def get_usab_players():
-    # Try to get player list from cache
-    usab_player_list = cache.get(PLAYER_LIST_CACHE_KEY)
+    offset, limit = get_pagination()
+    fields = get_projection(PLAYER_FIELDS)
 
-    if usab_player_list is None:
+    def build_page():
         usab_player_dict = get_usab_players_dict()
+        usab_player_list = get_usab_players_list()
+        page = [dict(usab_player_dict[usab_id].to_dict(), usab_id=usab_id) for usab_id in paginate(usab_player_list, offset, limit)]
+        return project(page, fields), len(usab_player_list)
 
-        # Format the results as a list of dictionaries
-        usab_player_list = [{'usab_id': usab_id,
-                             'player_name': player['player_name'],
-                             'birth_year': player['birth_year'],
-                             'gender': player['gender']} for usab_id, player in usab_player_dict.items()]
-
-        usab_player_list = sorted(usab_player_list, key=sort_by_usab_id)
-
-        # Cache the result for subsequent requests
-        cache.set(PLAYER_LIST_CACHE_KEY, usab_player_list)
-
-    return jsonify(usab_player_list)
+    return list_response(build_page)
 
 # Endpoint to fetch all USAB players
 @app.route('/api/v1/player/<usab_id>', methods=['GET'])
 def get_usab_player(usab_id):
     if not usab_id.isdigit():
         abort(400, "Bad request: invalid player id")
-    usab_player_dict = get_usab_players_dict()
-    usab_id_int = int(usab_id)
-    if usab_id_int in usab_player_dict:
-        return jsonify(usab_player_dict[usab_id_int])
-    else:
-        abort(404, 'Not found')
+
+    def build():
+        usab_player_dict = get_usab_players_dict()
+        usab_id_int = int(usab_id)
+        if usab_id_int not in usab_player_dict:
+            abort(404, 'Not found')
+        return usab_player_dict[usab_id_int].to_dict(), {}
+
+    return cached_json_response(build)
+
+def load_tournaments_list():
+    # tournament_ids, latest first, the tournaments themselves are in the tournaments dictionary
+    tournament_dict = get_tournaments_dict()
+    return sorted(tournament_dict, key=lambda tournament_id: tournament_dict[tournament_id].end_date, reverse=True)
+
+def get_tournaments_list():
+    return get_or_load(TOURNAMENT_LIST_CACHE_KEY, load_tournaments_list)
 
 # Endpoint to fetch all tournaments
 @app.route('/api/v1/tournaments', methods=['GET'])
 def get_all_tournaments():
-    # Try to get tournament list from cache
-    # Try to get tournament list from cache
-    tournament_list = cache.get(TOURNAMENT_LIST_CACHE_KEY)
+    offset, limit = get_pagination()
+    fields = get_projection(TOURNAMENT_FIELDS)
 
-    if tournament_list is None:
-        # If not in cache, fetch from database
+    def build_page():
         tournament_dict = get_tournaments_dict()
+        tournament_list = get_tournaments_list()
+        page = [dict(tournament_id=tournament_id, **tournament_dict[tournament_id].to_dict())
+                for tournament_id in paginate(tournament_list, offset, limit)]
+        return project(page, fields), len(tournament_list)
 
-        # Format the results as a list of dictionaries
-        tournament_list = [{'tournament_id': tournament_id,
-                            'tournament_name': tournament['tournament_name'],
-                            'tournament_type': tournament['tournament_type'],
-                            'description': tournament['description'],
-                            'location': tournament['location'],
-                            'start_date': tournament['start_date'],
-                            'end_date': tournament['end_date']} for tournament_id, tournament in tournament_dict.items()]
-
-        tournament_list = sorted(tournament_list, key=sort_by_end_date, reverse=True)
-
-        # Cache the result for subsequent requests
-        cache.set(TOURNAMENT_LIST_CACHE_KEY, tournament_list)
-
-    return jsonify(tournament_list)
+    return list_response(build_page)
 
 # Endpoint to fetch all tournaments
 @app.route('/api/v1/tournament/<tournament_id>', methods=['GET'])
 def get_tournament(tournament_id):
-    # Try to get tournament list from cache
-    tournament_dict = get_tournaments_dict()
-    if tournament_id in tournament_dict:
-        return jsonify(tournament_dict[tournament_id])
-    else:
-        abort(404, 'Not found')
+    def build():
+        tournament_dict = get_tournaments_dict()
+        if tournament_id not in tournament_dict:
+            abort(404, 'Not found')
+        return tournament_dict[tournament_id].to_dict(), {}
+
+    return cached_json_response(build, ('tournament', tournament_id))
+
+def load_tournament_players_list(tournament_id):
+    # If not in cache, fetch from database
+    tournament_players = execute_sql_query(TOURNAMENT_PLAYERS_SQL, {'tournament_id': tournament_id})
+
+    # (tournament_player_id, usab_id, player_name) tuples
+    tournament_players_list = [(player['tournament_player_id'], player['usab_id'], intern_string(player['player_name']))
+                               for player in tournament_players]
+    return sorted(tournament_players_list)
 
 # Endpoint to fetch all players in a specific tournament
 @app.route('/api/v1/tournament/<tournament_id>/players', methods=['GET'])
 def get_tournament_players(tournament_id):
-    # Try to get player list from cache
-    cache_key = f'tournament_{tournament_id}_players_list'
-    tournament_players_list = cache.get(cache_key)
-
-    if tournament_players_list is None:
-        # If not in cache, fetch from database
-        tournament_players = TournamentPlayer.query.filter_by(tournament_id=tournament_id).all()
-
-        # Format the results as a list of dictionaries
-        tournament_players_list = [{'tournament_player_id': player.tournament_player_id,
-                                    'usab_id': player.usab_id, 'player_name': player.player_name} for player in tournament_players]
+    def build():
+        cache_key = f'tournament_{tournament_id}_players_list'
+        tournament_players_list = get_or_load(cache_key, lambda: load_tournament_players_list(tournament_id))
+        return [{'tournament_player_id': tournament_player_id, 'usab_id': usab_id, 'player_name': player_name}
+                for tournament_player_id, usab_id, player_name in tournament_players_list], {}
 
-        tournament_players_list = sorted(tournament_players_list, key=sort_by_tournament_player_id)
+    return cached_json_response(build, ('tournament', tournament_id))
 
-        # Cache the result for subsequent requests
-        cache.set(cache_key, tournament_players_list)
+def load_tournament_performance_list(tournament_id):
+    # If not in cache, fetch from database
+    tournament_event_performance = execute_sql_query(TOURNAMENT_PERFORMANCE_SQL, {'tournament_id': tournament_id})
 
-    return jsonify(tournament_players_list)
+    # Group by event and age group, each group sorted by standing level
+    return index_tournament_results((performance['event_type'], performance['age_group'], performance['usab_id'],
+                                     performance['player_name'], performance['standing_level']) for performance in tournament_event_performance)
 
 # Endpoint to fetch all players in a specific tournament
 @app.route('/api/v1/tournament/<tournament_id>/performance', methods=['GET'])
 def get_tournament_event_performance(tournament_id):
-    event_type = request.args.get('event_type')
-    if event_type != None:
-        event_type = event_type.upper()
-        if not event_type in ALL_EVENT_TYPES:
-            abort(400, 'Bad Request: invalid event_type query parameter')
-
-    age_group = request.args.get('age_group')
-    if age_group != None:
-        age_group = age_group.upper()
-        if not age_group in ALL_AGE_GROUPS:
-            abort(400, 'Bad Request: invalid age_group query parameter')
-
-    # Try to get player list from cache
-    cache_key = f'tournament_{tournament_id}_performance_list'
-    tournament_event_performance_list = cache.get(cache_key)
-
-    if tournament_event_performance_list is None:
-        # If not in cache, fetch from database
-        tournament_event_performance = (TournamentPlayerPerformance.query
-                                             .join(TournamentPlayer, (
-                                                 (TournamentPlayerPerformance.tournament_id == TournamentPlayer.tournament_id) &
-                                                 (TournamentPlayerPerformance.tournament_player_id == TournamentPlayer.tournament_player_id)
-                                             ))
-                                             .join(USABPlayer, (
-                                                 (TournamentPlayer.usab_id == USABPlayer.usab_id)
-                                             ))
-                                             .filter(TournamentPlayerPerformance.tournament_id == tournament_id)
-                                             .all())
-
-        # Format the results as a list of dictionaries
-        tournament_event_performance_list = [{'age_group': performance.age_group,
-                                              'event_type': performance.event_type,
-                                              'usab_id': performance.tournament_player.usab_id,
-                                              'player_name': performance.tournament_player.player_name,
-                                              'standing_level': performance.standing_level} for performance in tournament_event_performance]
-        # Sort the list using the custom key function
-        tournament_event_performance_list = sorted(tournament_event_performance_list, key=sort_by_standing_level)
-
-        # Cache the result for subsequent requests
-        cache.set(cache_key, tournament_event_performance_list)
-
+    # All the results of a tournament share its end date, there is no date to filter on
+    filters = get_event_filters(request.args)
+    offset, limit = get_pagination()
+    fields = get_projection(TOURNAMENT_PERFORMANCE_FIELDS)
+
+    def build_page():
+        cache_key = f'tournament_{tournament_id}_performance_list'
+        performance_index = get_or_load(cache_key, lambda: load_tournament_performance_list(tournament_id))
+
+        # Groups are already sorted by standing level, only the groups need ordering
+        filtered_performance_list = []
+        for event_type, age_group in sorted(select_performance_groups(performance_index, filters), key=lambda key: (key[1], key[0])):
+            results = performance_index[(event_type, age_group)]
+            filtered_performance_list.extend((results, index, event_type, age_group) for index in range(len(results)))
+        page = [results.to_dict(index, event_type, age_group) for results, index, event_type, age_group
+                in paginate(filtered_performance_list, offset, limit)]
+        return project(page, fields), len(filtered_performance_list)
+
+    return list_response(build_page, ('tournament', tournament_id))
+
+def index_usab_player_performance(usab_id, performance_rows):
+    # Group by event and age group, sorted by end date for date range lookups
+    return index_player_results(int(usab_id), ((row['tournament_id'], row['end_date'], row['event_type'], row['age_group'],
+                                                row['player_name'], row['standing_level']) for row in performance_rows))
+
+def load_usab_player_performance_list(usab_id):
+    # If not in cache, fetch from database
+    return index_usab_player_performance(usab_id, execute_sql_query(PLAYER_PERFORMANCE_SQL, {'usab_id': usab_id}))
+
+def get_usab_players_performance_lists(usab_ids):
+    # usab_id -> performance list of many players: the cached ones, and the others read with one query
+    # per chunk of ids and cached like those of single players
+    performance_lists = {}
+    missing_usab_ids = []
+    for usab_id in usab_ids:
+        cache_key = f'usab_player_{usab_id}_performance_list'
+        with timed_phase('cache'):
+            performance_lists[usab_id] = cache.get(cache_key)
+        count_cache_lookup(cache_key, performance_lists[usab_id])
+        if performance_lists[usab_id] is None:
+            missing_usab_ids.append(usab_id)
+
+    for start in range(0, len(missing_usab_ids), MAX_QUERY_IDS):
+        chunk = missing_usab_ids[start:start + MAX_QUERY_IDS]
+        params = {f'usab_id_{index}': usab_id for index, usab_id in enumerate(chunk)}
+        performance_rows = {}
+        for row in execute_sql_query(PLAYERS_PERFORMANCE_SQL.format(usab_ids=', '.join(f':{name}' for name in params)), params):
+            performance_rows.setdefault(row['usab_id'], []).append(row)
+        for usab_id in chunk:
+            performance_lists[usab_id] = index_usab_player_performance(usab_id, performance_rows.get(usab_id, []))
+            with timed_phase('cache'):
+                cache.set(f'usab_player_{usab_id}_performance_list', performance_lists[usab_id])
+    return performance_lists
+
+def filter_usab_player_performance(performance_index, filters, score_dict):
     filtered_performance_list = []
-    for performance in tournament_event_performance_list:
-        if filter_tournament_event_performance(performance, request.args):
-            new_perf = performance.copy()
-            filtered_performance_list.append(new_perf)
-    filtered_performance_list = sorted(filtered_performance_list, key=lambda x: (x['age_group'], x['event_type'], sort_by_standing_level(x)))
-
-    return jsonify(filtered_performance_list)
+    for key in select_performance_groups(performance_index, filters):
+        event_type, age_group = key
+        results = performance_index[key]
+        # Groups are sorted by end date, so the date filters are a range of the group
+        start = 0 if filters['min_date'] == None else bisect_left(results.end_dates, filters['min_date'])
+        end = len(results.end_dates) if filters['max_date'] == None else bisect_right(results.end_dates, filters['max_date'])
+        for index in range(start, end):
+            tournament = get_tournament_record(results.tournament_ids[index])
+            # Standing levels missing from the score table are worth no ranking points
+            score = score_dict.get((tournament.tournament_type, age_group, results.standing_levels[index]), 0)
+            filtered_performance_list.append(dict(results.to_dict(index, event_type, age_group, tournament), score=score))
+    return sorted(filtered_performance_list, key=sort_by_score, reverse=True)
 
 # Endpoint to fetch all players in a specific tournament
 @app.route('/api/v1/player/<usab_id>/performance', methods=['GET'])
 def get_usab_player_performance(usab_id):
-    min_date_filter = request.args.get('min_date')
-    max_date_filter = request.args.get('max_date')
-    event_type_filter = request.args.get('event_type')
-    age_group_filter = request.args.get('age_group')
-
-    if min_date_filter != None:
-        if not is_valid_date(min_date_filter):
-            abort(400, 'Bad Request: invalid min_date query parameter')
-
-    if max_date_filter != None:
-        if not is_valid_date(max_date_filter):
-            abort(400, 'Bad Request: invalid max_date query parameter')
-
-    if event_type_filter != None:
-        event_type_filter = event_type_filter.upper()
-        if not event_type_filter in ALL_EVENT_TYPES:
-            abort(400, 'Bad Request: invalid event_type query parameter')
+    if not usab_id.isdigit():
+        abort(400, "Bad request: invalid player id")
+    filters = get_performance_filters(request.args)
+
+    def build():
+        cache_key = f'usab_player_{int(usab_id)}_performance_list'
+        performance_index = get_or_load(cache_key, lambda: load_usab_player_performance_list(usab_id))
+
+        score_dict = get_score_dict(get_score_version(request.args.get('score_version')))
+        return filter_usab_player_performance(performance_index, filters, score_dict), {}
+
+    return cached_json_response(build, ('player', int(usab_id)))
+
+def get_batch_request():
+    # JSON body with a list of usab_ids and optional filters, returns (usab_ids, filters, score_version)
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('usab_ids'), list):
+        abort(400, 'Bad Request: missing usab_ids list')
+    if len(data['usab_ids']) > MAX_BATCH_SIZE:
+        abort(400, f'Bad Request: at most {MAX_BATCH_SIZE} usab_ids per request')
+
+    usab_ids = []
+    for usab_id in data['usab_ids']:
+        usab_id = get_sqlite_integer(usab_id)
+        if usab_id == None:
+            abort(400, 'Bad Request: invalid usab_id in usab_ids')
+        usab_ids.append(usab_id)
+
+    for name in ('min_date', 'max_date', 'event_type', 'age_group'):
+        if data.get(name) != None and not isinstance(data[name], str):
+            abort(400, f'Bad Request: invalid {name}')
+    # Duplicates are returned once, in the order they were first asked for
+    return list(dict.fromkeys(usab_ids)), get_performance_filters(data), data.get('score_version')
+
+# Endpoint to fetch many USAB players at once
+@app.route('/api/v1/players:batch', methods=['POST'])
+def post_usab_players_batch():
+    usab_ids, _, _ = get_batch_request()
+    usab_player_dict = get_usab_players_dict()
 
-    if age_group_filter != None:
-        age_group_filter = age_group_filter.upper()
-        if not age_group_filter in ALL_AGE_GROUPS:
-            abort(400, 'Bad Request: invalid age_group query parameter')
+    players = []
+    not_found = []
+    for usab_id in usab_ids:
+        player = usab_player_dict.get(usab_id)
+        if player == None:
+            not_found.append(usab_id)
+        else:
+            players.append(dict(player.to_dict(), usab_id=usab_id))
 
-    # Try to get player list from cache
-    cache_key = f'usab_player_{usab_id}_performance_list'
-    performance_list = cache.get(cache_key)
-
-    if performance_list is None:
-        # If not in cache, fetch from database
-        tournament_players_performances = (TournamentPlayerPerformance.query
-                                           .join(TournamentPlayer, (
-                                                (TournamentPlayerPerformance.tournament_id == TournamentPlayer.tournament_id) &
-                                                (TournamentPlayerPerformance.tournament_player_id == TournamentPlayer.tournament_player_id)
-                                            ))
-                                           .filter(TournamentPlayer.usab_id == usab_id)
-                                           .all())
-
-        # Format the results as a list of dictionaries
-        performance_list = [{'tournament_id': performance.tournament_player.tournament.tournament_id,
-                             'tournament_name': performance.tournament_player.tournament.tournament_name,
-                             'tournament_description': performance.tournament_player.tournament.description,
-                             'tournament_type': performance.tournament_player.tournament.tournament_type,
-                             'end_date': str(performance.tournament_player.tournament.end_date),
-                             'event_type': performance.event_type,
-                             'age_group': performance.age_group,
-                             'player_name': performance.tournament_player.player_name,
-                             'usab_id': performance.tournament_player.usab_id,
-                             'standing_level': performance.standing_level} for performance in tournament_players_performances]
-
-        # Cache the result for subsequent requests
-        cache.set(cache_key, performance_list)
-
-    score_version = request.args.get('score_version')
-    if score_version == None:
-        # Try to get player list from cache
-        score_dict = get_current_score_dict()
-    else:
-        score_dict = get_score_dict(score_version)
+    return json_response({'players': players, 'not_found': not_found})
 
-    filtered_performance_list = []
-    for performance in performance_list:
-        if filter_performance(performance, request.args):
-            new_perf = performance.copy()
-            new_perf['score'] = score_dict[(new_perf['tournament_type'], new_perf['age_group'], new_perf['standing_level'])]
-            filtered_performance_list.append(new_perf)
-    filtered_performance_list = sorted(filtered_performance_list, key=sort_by_score, reverse=True)
+# Endpoint to fetch the performance of many USAB players at once
+@app.route('/api/v1/performance:batch', methods=['POST'])
+def post_usab_players_performance_batch():
+    usab_ids, filters, score_version = get_batch_request()
+    score_dict = get_score_dict(get_score_version(score_version))
 
-    return jsonify(filtered_performance_list)
+    performance_lists = get_usab_players_performance_lists(usab_ids)
+    performances = [{'usab_id': usab_id, 'performances': filter_usab_player_performance(performance_lists[usab_id], filters, score_dict)}
+                    for usab_id in usab_ids]
+
+    return json_response({'performances': performances})
 
 # Function to execute a SQL query and return the result
 def execute_sql_query(query, params=None):
-    result = db.session.execute(text(query), params)
-    rows = result.fetchall()
-    return rows
-
-# Endpoint to fetch data from a complicated SQL query
-@app.route('/api/v1/ranks', methods=['GET'])
-def get_current_ranks():
-    # Try to get player list from cache
-    # Execute the SQL query using the function
+    with timed_phase('db'):
+        return get_snapshot().read_pool.execute(query, params)
+
+def get_data_base():
+    # Data the caches and in-memory structures are built from: the snapshot and its cache generation (bumped by
+    # full loads). Ingests are applied on top of it from the ingest log, see sync_ingests
+    return (get_snapshot().path, cache.cache.generation)
+
+def get_data_signature():
+    # Changes whenever the database file is written, so that the ingest log is only read after a write
+    database_path = get_snapshot().path
+    signature = []
+    for path in (database_path, database_path + '-wal'):
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+def get_ingest_log_seq():
+    return execute_sql_query(INGEST_LOG_SEQ_SQL)[0]['seq']
+
+# Leaderboards of each score version, rebuilt only when the data base changes (or the one year window moves),
+# ingests are applied to them. score version -> ((day, data base), seq of the last ingest applied)
+ranking_engines = {}
+ranking_engine_versions = {}
+ranking_engine_lock = threading.Lock()
+
+def load_ranking_engine(score_version):
+    score_table = get_score_table()
+    players = [(usab_id, player.player_name, player.birth_year) for usab_id, player in get_usab_players_dict().items()]
+    if app.config['COLUMNAR_RANKING']:
+        engine = ColumnarRankingEngine(score_table, score_version, ALL_AGE_GROUPS, ALL_EVENT_TYPES)
+        # The results are read as integer columns, see ColumnarRankingEngine.load
+        with timed_phase('db'), get_snapshot().read_pool.connection() as connection:
+            return engine.load(players, connection)
+    engine = RankingEngine(score_table, score_version, ALL_AGE_GROUPS, ALL_EVENT_TYPES)
+    performances = execute_sql_query(RANKING_RESULTS_SQL, {'min_end_date': str(one_year_before(engine.as_of))})
+    return engine.build(players, score_table.encode(performances))
+
+def get_ranking_engine(score_version):
+    base = (date.today(), get_data_base())
+    if ranking_engine_versions.get(score_version, (None,))[0] != base and is_draining():
+        return load_ranking_engine(score_version)
+    if ranking_engine_versions.get(score_version, (None,))[0] != base:
+        with ranking_engine_lock:
+            # Another thread may have rebuilt it while we were waiting
+            if ranking_engine_versions.get(score_version, (None,))[0] != base:
+                # Read first: ingests logged while it is built are applied to it again, which changes nothing
+                seq = get_ingest_log_seq()
+                ranking_engines[score_version] = load_ranking_engine(score_version)
+                ranking_engine_versions[score_version] = (base, seq)
+    return ranking_engines[score_version]
+
+# Rankings of past days, loaded on first use and rebuilt when the data base changes, ingests are applied to them
+ranking_history = None
+ranking_history_version = None
+ranking_history_lock = threading.Lock()
+
+def load_ranking_history():
+    score_table = get_score_table()
+    history = RankingHistory(score_table, ALL_AGE_GROUPS, ALL_EVENT_TYPES)
+    players = [(usab_id, player.player_name, player.birth_year) for usab_id, player in get_usab_players_dict().items()]
+    return history.build(players, score_table.encode(execute_sql_query(RANKING_HISTORY_RESULTS_SQL)))
+
+def get_ranking_history():
+    global ranking_history, ranking_history_version
+    # The date is not part of the version, past rankings do not change with it
+    base = get_data_base()
+    if (ranking_history is None or ranking_history_version[0] != base) and is_draining():
+        return load_ranking_history()
+    if ranking_history is None or ranking_history_version[0] != base:
+        with ranking_history_lock:
+            if ranking_history is None or ranking_history_version[0] != base:
+                seq = get_ingest_log_seq()
+                ranking_history = load_ranking_history()
+                ranking_history_version = (base, seq)
+    return ranking_history
+
+def get_date_arg(request_args, name):
+    # datetime.date of a YYYY-MM-DD query parameter, None when not given
+    value = request_args.get(name)
+    if value == None:
+        return None
+    if not is_valid_date(value) or int(value[:4]) < 1900:
+        abort(400, f'Bad Request: invalid {name} query parameter')
+    return date.fromisoformat(value)
+
+def get_leaderboard_args():
+    # Validated (event_type, age_group) of a leaderboard, both required
     event_type = request.args.get('event_type')
     if event_type == None:
         abort(400, 'Bad Request: missing event_type query parameter')
@@ -487,26 +901,599 @@ def get_current_ranks():
         abort(400, 'Bad Request: invalid event_type query parameter')
 
     age_group = request.args.get('age_group')
-    if event_type == None:
+    if age_group == None:
         abort(400, 'Bad Request: missing age_group query parameter')
     elif not age_group.upper() in ALL_AGE_GROUPS:
         abort(400, 'Bad Request: invalid age_group query parameter')
 
-    event_type = event_type.upper()
-    age_group = age_group.upper()
-
-    cache_key = f'tournament_{event_type}_{age_group}_ranks_list'
-    ranks_list = cache.get(cache_key)
-    if ranks_list is None:
-        event_u_age = int(age_group[1:])
-        parameter_values = {'event_u_age': event_u_age, 'event_type': event_type}  # Replace with actual parameter values
-        result_rows = execute_sql_query(RANKING_SQL, parameter_values)
-
-        # Format the results as a list of dictionaries
-        results_list = [{'usab_id': row[0], 'player_name': row[1], 'scores': row[2], 'rank': index+1} for index, row in enumerate(result_rows)]
-        cache.set(cache_key, ranks_list)
+    return event_type.upper(), age_group.upper()
 
-    return jsonify(results_list)
+# Endpoint to fetch the current ranking of an event type and age group
+@app.route('/api/v1/ranks', methods=['GET'])
+def get_current_ranks():
+    event_type, age_group = get_leaderboard_args()
+    as_of = get_date_arg(request.args, 'as_of')
+    offset, limit = get_pagination()
+    fields = get_projection(RANK_FIELDS)
+
+    def build_page():
+        # Leaderboards are precomputed, so a page is only a slice of a sorted list
+        score_version = get_score_version(request.args.get('score_version'))
+        if as_of == None:
+            ranking_engine = get_ranking_engine(score_version)
+        else:
+            ranking_engine = get_ranking_history().get_engine(as_of, score_version)
+        ranks_list, size = ranking_engine.get_page_and_size(event_type, age_group, offset, limit)
+        return project(ranks_list, fields), size
+
+    return list_response(build_page)
+
+def load_live_leaderboard(key):
+    # (signature, entries) of a current leaderboard for the broadcaster, read on the current snapshot
+    score_version, event_type, age_group = key
+    with app.app_context():
+        g.snapshot = snapshot_manager.acquire()
+        try:
+            sync_ingests()
+            ranking_engine = get_ranking_engine(score_version)
+            # Ingests reposition players under this lock, so a leaderboard is never read half updated
+            with ranking_engine_lock:
+                return ranking_engine_versions.get(score_version), ranking_engine.get_page(event_type, age_group)
+        finally:
+            g.pop('snapshot').release()
+
+# Viewers of the live leaderboards of this worker
+leaderboard_broadcaster = LeaderboardBroadcaster(load_live_leaderboard, max_subscribers=app.config['MAX_LEADERBOARD_STREAMS'])
+
+# Server-sent events of the current ranking of an event type and age group: the whole leaderboard, then the
+# players whose scores changed after every ingest (see leaderboard_events.py)
+@app.route('/api/v1/ranks/stream', methods=['GET'])
+def stream_current_ranks():
+    event_type, age_group = get_leaderboard_args()
+    key = (get_score_version(request.args.get('score_version')), event_type, age_group)
+    subscriber = leaderboard_broadcaster.subscribe(key)
+    if subscriber == None:
+        abort(503, 'Service Unavailable: too many live leaderboard streams, retry later', retry_after=BUSY_RETRY_SECONDS)
+    # Not stream_with_context: the stream outlives snapshots, it must not keep the one of its request open
+    response = app.response_class(leaderboard_broadcaster.stream(subscriber), mimetype='text/event-stream',
+                                  headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Also runs when the client is gone before the stream started
+    response.call_on_close(lambda: leaderboard_broadcaster.unsubscribe(key, subscriber))
+    return response
+
+# Live leaderboard page
+@app.route('/rankings', methods=['GET'])
+def get_rankings_page():
+    return render_template('rankings.html')
+
+# Endpoint to fetch the ranks of a player over time, one point every interval days between min_date and max_date
+@app.route('/api/v1/player/<usab_id>/ranks', methods=['GET'])
+def get_usab_player_rank_history(usab_id):
+    if not usab_id.isdigit():
+        abort(400, "Bad request: invalid player id")
+    filters = get_performance_filters(request.args)
+    max_date = get_date_arg(request.args, 'max_date') or date.today()
+    min_date = get_date_arg(request.args, 'min_date') or one_year_before(max_date)
+    if min_date > max_date:
+        abort(400, 'Bad Request: min_date is after max_date')
+
+    interval = request.args.get('interval', str(DEFAULT_RANK_HISTORY_INTERVAL))
+    if not interval.isdigit() or int(interval) == 0:
+        abort(400, 'Bad Request: invalid interval query parameter')
+    interval = int(interval)
+    if (max_date - min_date).days // interval + 1 > MAX_RANK_HISTORY_DAYS:
+        abort(400, f'Bad Request: at most {MAX_RANK_HISTORY_DAYS} days per request, increase interval')
+    fields = get_projection(RANK_HISTORY_FIELDS)
+
+    def build():
+        score_version = get_score_version(request.args.get('score_version'))
+        days = [date.fromordinal(day) for day in range(min_date.toordinal(), max_date.toordinal() + 1, interval)]
+        keys = [(event_type, age_group) for event_type in sorted(ALL_EVENT_TYPES) for age_group in sorted(ALL_AGE_GROUPS)
+                if filters['event_type'] in (None, event_type) and filters['age_group'] in (None, age_group)]
+        history = get_ranking_history().get_player_history(int(usab_id), days, keys, score_version)
+        rank_history = [{'as_of': str(day), 'event_type': event_type, 'age_group': age_group, 'scores': scores, 'rank': rank}
+                        for day, event_type, age_group, scores, rank in history]
+        return project(rank_history, fields), {}
+
+    return cached_json_response(build)
+
+# Index of player names, loaded on first use and rebuilt when the data base changes, names of ingested tournaments are added
+player_search_index = None
+player_search_index_version = None
+player_search_index_lock = threading.Lock()
+
+def load_player_search_index():
+    usab_player_dict = get_usab_players_dict()
+    names = [(usab_id, player.player_name) for usab_id, player in usab_player_dict.items()]
+    names.extend((row['usab_id'], row['player_name']) for row in execute_sql_query(PLAYER_ALIASES_SQL) if row['usab_id'] in usab_player_dict)
+    return PlayerSearchIndex().build(names)
+
+def get_player_search_index():
+    global player_search_index, player_search_index_version
+    base = get_data_base()
+    if (player_search_index is None or player_search_index_version[0] != base) and is_draining():
+        return load_player_search_index()
+    if player_search_index is None or player_search_index_version[0] != base:
+        with player_search_index_lock:
+            if player_search_index is None or player_search_index_version[0] != base:
+                seq = get_ingest_log_seq()
+                player_search_index = load_player_search_index()
+                player_search_index_version = (base, seq)
+    return player_search_index
+
+# Endpoint to find players by name, best matches first
+@app.route('/api/v1/players/search', methods=['GET'])
+def search_usab_players():
+    query = request.args.get('q')
+    if query == None or not query.strip():
+        abort(400, 'Bad Request: missing q query parameter')
+    limit = request.args.get('limit', str(DEFAULT_SEARCH_LIMIT))
+    if not limit.isdigit() or int(limit) > MAX_SEARCH_LIMIT:
+        abort(400, 'Bad Request: invalid limit query parameter')
+    limit = int(limit)
+    fields = get_projection(PLAYER_SEARCH_FIELDS)
+
+    def build():
+        usab_player_dict = get_usab_players_dict()
+        players = [dict(usab_player_dict[usab_id].to_dict(), usab_id=usab_id, matched_name=matched_name, match=match, score=score)
+                   for usab_id, matched_name, match, score in get_player_search_index().search(query, limit)]
+        return project(players, fields), {}
+
+    return cached_json_response(build)
+
+def get_export_format():
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format not in EXPORT_FORMATS:
+        abort(400, 'Bad Request: invalid format query parameter')
+    return export_format
+
+def encode_export(chunks, fields, export_format, encoding):
+    # Lists of row dicts to NDJSON or CSV bytes, one piece per chunk, gzipped as a single stream when asked
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if encoding == 'gzip' else None
+    def encode(body):
+        # A sync flush sends every chunk to the client as soon as it is encoded
+        return compressor.compress(body) + compressor.flush(zlib.Z_SYNC_FLUSH) if compressor != None else body
+
+    if export_format == 'csv':
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fields, extrasaction='ignore', lineterminator='\n')
+        writer.writeheader()
+        yield encode(output.getvalue().encode())
+    for rows in chunks:
+        if export_format == 'csv':
+            output.seek(0)
+            output.truncate()
+            writer.writerows(rows)
+            body = output.getvalue().encode()
+        else:
+            body = b''.join(dumps_json({field: row[field] for field in fields}) + b'\n' for row in rows)
+        if body:
+            yield encode(body)
+    if compressor != None:
+        yield compressor.flush()
+
+def export_response(chunks, all_fields, name):
+    # Streamed (chunked) response of an export, the request and its snapshot are held until the last chunk is sent
+    export_format = get_export_format()
+    fields = get_projection(all_fields) or list(all_fields)
+    encoding = 'gzip' if request.accept_encodings['gzip'] else 'identity'
+    response = app.response_class(stream_with_context(encode_export(chunks, fields, export_format, encoding)),
+                                  mimetype=EXPORT_FORMATS[export_format],
+                                  headers={'Content-Disposition': f'attachment; filename={name}.{export_format}'})
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+def iter_performance_export(read_pool, filters, score_dict):
+    # Chunks of scored results straight from a cursor, so memory does not grow with the number of rows
+    sql = EXPORT_PERFORMANCES_SQL
+    params = {}
+    for name, clause in (('min_date', 'end_date >= :min_date'), ('max_date', 'end_date <= :max_date'),
+                         ('event_type', 'event_type = :event_type'), ('age_group', 'age_group = :age_group')):
+        if filters[name] != None:
+            sql += f' AND {clause}'
+            params[name] = filters[name]
+    with read_pool.connection() as connection:
+        cursor = connection.execute(sql + EXPORT_PERFORMANCES_ORDER_SQL, params)
+        while True:
+            rows = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+            if not rows:
+                return
+            # Standing levels missing from the score table are worth no ranking points
+            yield [dict(row, end_date=str(row['end_date']),
+                        score=score_dict.get((row['tournament_type'], row['age_group'], row['standing_level']), 0)) for row in rows]
+
+# Endpoint to export the results of every player, the same filters as /api/v1/player/<usab_id>/performance
+@app.route('/api/v1/export/performances', methods=['GET'])
+def export_performances():
+    filters = get_performance_filters(request.args)
+    score_dict = get_score_dict(get_score_version(request.args.get('score_version')))
+    chunks = iter_performance_export(get_snapshot().read_pool, filters, score_dict)
+    return export_response(chunks, EXPORT_PERFORMANCE_FIELDS, 'performances')
+
+def iter_rank_export(ranking_engine, keys):
+    for event_type, age_group in keys:
+        for page in ranking_engine.iter_pages(event_type, age_group, EXPORT_CHUNK_SIZE):
+            yield [dict(entry, event_type=event_type, age_group=age_group) for entry in page]
+
+# Endpoint to export every leaderboard, or those of an event_type and/or age_group
+@app.route('/api/v1/export/ranks', methods=['GET'])
+def export_ranks():
+    filters = get_event_filters(request.args)
+    as_of = get_date_arg(request.args, 'as_of')
+    score_version = get_score_version(request.args.get('score_version'))
+    if as_of == None:
+        ranking_engine = get_ranking_engine(score_version)
+    else:
+        ranking_engine = get_ranking_history().get_engine(as_of, score_version)
+    keys = [(event_type, age_group) for event_type in sorted(ALL_EVENT_TYPES) for age_group in sorted(ALL_AGE_GROUPS)
+            if filters['event_type'] in (None, event_type) and filters['age_group'] in (None, age_group)]
+    return export_response(iter_rank_export(ranking_engine, keys), EXPORT_RANK_FIELDS, 'ranks')
+
+def group_results_by_player(rows):
+    results = {}
+    for usab_id, player_name, age_group, event_type, standing_level in rows:
+        results.setdefault(usab_id, set()).add((player_name, age_group, event_type, standing_level))
+    return results
+
+# The ingest log as last read by this worker: (data base, database file signature) and its last seq.
+# The caches of the data base follow the ingests applied to them: (data base, seq of the last one), and
+# ('player', usab_id) or ('tournament', tournament_id) -> seq of the last ingest that changed it
+ingest_log_signature = None
+ingest_log_seq = 0
+ingest_cache_version = None
+ingest_seqs = {}
+ingest_sync_lock = threading.Lock()
+
+def get_ingest_seq(ingest_key=None):
+    # Last ingest applied to the caches that changed the player or tournament, of any ingest when ingest_key is None
+    if ingest_cache_version == None or ingest_cache_version[0] != get_data_base():
+        return None
+    if ingest_key == None:
+        return ingest_cache_version[1]
+    return ingest_seqs.get(ingest_key, 0)
+
+def get_applied_ingest_seq(base):
+    # Oldest last ingest applied to the caches and in-memory structures of base, -1 when the caches have not started
+    seqs = [ingest_cache_version[1] if ingest_cache_version != None and ingest_cache_version[0] == base else -1]
+    seqs.extend(seq for (day, engine_base), seq in list(ranking_engine_versions.values()) if engine_base == base)
+    for version in (ranking_history_version, player_search_index_version):
+        if version != None and version[0] == base:
+            seqs.append(version[1])
+    return min(seqs)
+
+def sync_ingests():
+    # Apply the ingests logged (by any worker) since this worker last read the ingest log: only the changed
+    # players and tournaments are dropped from the caches and repositioned in the in-memory structures
+    global ingest_log_signature, ingest_log_seq
+    if is_draining():
+        return
+    base = get_data_base()
+    signature = (base, get_data_signature())
+    if signature == ingest_log_signature and get_applied_ingest_seq(base) >= ingest_log_seq:
+        return
+    with ingest_sync_lock:
+        if signature != ingest_log_signature:
+            ingest_log_seq = get_ingest_log_seq()
+            ingest_log_signature = signature
+        applied_seq = get_applied_ingest_seq(base)
+        if applied_seq >= ingest_log_seq:
+            return
+        entries = [(row['seq'], row['tournament_id'], json.loads(row['usab_ids'])) for row in execute_sql_query(INGEST_LOG_SQL, {'seq': applied_seq})]
+        apply_ingests(base, entries, max([ingest_log_seq] + [entry[0] for entry in entries]))
+
+def apply_ingests(base, entries, seq):
+    # entries: (seq, tournament_id, changed usab_ids) of the ingests logged after the oldest one applied, up to seq.
+    # Each cache and structure gets those after its own last one. Results are read as they are now: applying
+    # an ingest that is already in them changes nothing
+    global ingest_cache_version, ingest_seqs, ranking_history_version, player_search_index_version
+    tournament_rows = {}
+
+    def get_changes(applied_seq):
+        # tournament_id -> usab_ids changed there by the ingests after applied_seq
+        changes = {}
+        for entry_seq, tournament_id, usab_ids in entries:
+            if entry_seq > applied_seq:
+                changes.setdefault(tournament_id, set()).update(usab_ids)
+        return changes
+
+    def get_rows(tournament_id):
+        if tournament_id not in tournament_rows:
+            tournament_rows[tournament_id] = [tuple(row) for row in execute_sql_query(TOURNAMENT_RANKING_RESULTS_SQL, {'tournament_id': tournament_id})]
+        return tournament_rows[tournament_id]
+
+    if ingest_cache_version == None or ingest_cache_version[0] != base:
+        # Caches of a new data base were filled after these ingests, only the seqs are needed
+        ingest_seqs = {}
+        for entry_seq, tournament_id, usab_ids in entries:
+            ingest_seqs[('tournament', tournament_id)] = entry_seq
+            ingest_seqs.update((('player', usab_id), entry_seq) for usab_id in usab_ids)
+    elif ingest_cache_version[1] < seq:
+        for entry_seq, tournament_id, usab_ids in entries:
+            if entry_seq <= ingest_cache_version[1]:
+                continue
+            cache.delete_many(f'tournament_{tournament_id}_players_list', f'tournament_{tournament_id}_performance_list',
+                              TOURNAMENT_DICT_CACHE_KEY, TOURNAMENT_LIST_CACHE_KEY,
+                              *[f'usab_player_{usab_id}_performance_list' for usab_id in usab_ids])
+            ingest_seqs[('tournament', tournament_id)] = entry_seq
+            ingest_seqs.update((('player', usab_id), entry_seq) for usab_id in usab_ids)
+    ingest_cache_version = (base, seq)
+
+    # Reposition the changed players on the current leaderboards of every score version
+    with ranking_engine_lock:
+        for score_version, ranking_engine in ranking_engines.items():
+            engine_base, applied_seq = ranking_engine_versions[score_version]
+            if engine_base[1] != base or applied_seq >= seq:
+                continue
+            for tournament_id, usab_ids in get_changes(applied_seq).items():
+                for usab_id in usab_ids:
+                    ranking_engine.remove_results(usab_id, tournament_id)
+                for row in get_rows(tournament_id):
+                    if row[0] in usab_ids:
+                        ranking_engine.add_result(*row)
+                ranking_engine.update_players(usab_ids)
+            ranking_engine_versions[score_version] = (engine_base, seq)
+
+    with ranking_history_lock:
+        if ranking_history is not None and ranking_history_version[0] == base and ranking_history_version[1] < seq:
+            for tournament_id, usab_ids in get_changes(ranking_history_version[1]).items():
+                ranking_history.replace_results(tournament_id, usab_ids, get_score_table().encode(get_rows(tournament_id)))
+            ranking_history_version = (base, seq)
+
+    # Add the names the players were entered under to the search index
+    with player_search_index_lock:
+        if player_search_index is not None and player_search_index_version[0] == base and player_search_index_version[1] < seq:
+            usab_player_dict = get_usab_players_dict()
+            for tournament_id in get_changes(player_search_index_version[1]):
+                for row in execute_sql_query(TOURNAMENT_ALIASES_SQL, {'tournament_id': tournament_id}):
+                    if row['usab_id'] in usab_player_dict:
+                        player_search_index.add(row['usab_id'], row['player_name'])
+            player_search_index_version = (base, seq)
+
+# Ingests run one at a time in a worker, and hold the write lock of the database between workers
+ingest_lock = threading.Lock()
+
+def ingest_tournament_results(tournament_id, tournament, tournament_players, performances):
+    snapshot = get_snapshot()
+    players_by_id = {player['tournament_player_id']: player for player in tournament_players}
+    new_results = group_results_by_player(
+        (players_by_id[performance['tournament_player_id']]['usab_id'], players_by_id[performance['tournament_player_id']]['player_name'],
+         performance['age_group'], performance['event_type'], performance['standing_level']) for performance in performances)
+
+    # Serialized with the other ingests and loads of the database
+    with ingest_lock, database_write_lock(snapshot.path):
+        # Replace the tournament results in one transaction, in the snapshot being served
+        try:
+            with Session(snapshot.get_write_engine()) as session:
+                # Take SQLite's write lock first, so what is compared below is what gets replaced
+                session.execute(text('BEGIN IMMEDIATE'))
+                old_tournament = session.execute(text("""SELECT tournament_name, tournament_type, description, location, start_date, end_date
+                                                         FROM tournament WHERE tournament_id = :tournament_id"""),
+                                                 {'tournament_id': tournament_id}).mappings().first()
+                old_results = group_results_by_player(session.execute(text(TOURNAMENT_RESULTS_SQL), {'tournament_id': tournament_id}))
+
+                tournament_changed = old_tournament == None or dict(old_tournament) != tournament
+                changed_usab_ids = {usab_id for usab_id in old_results.keys() | new_results.keys()
+                                    if tournament_changed or old_results.get(usab_id) != new_results.get(usab_id)}
+
+                session.execute(text("""INSERT OR REPLACE INTO tournament (tournament_id, tournament_name, tournament_type, description, location, start_date, end_date)
+                                        VALUES (:tournament_id, :tournament_name, :tournament_type, :description, :location, :start_date, :end_date)"""),
+                                dict(tournament, tournament_id=tournament_id))
+                session.execute(text('DELETE FROM tournament_player_performance WHERE tournament_id = :tournament_id'), {'tournament_id': tournament_id})
+                session.execute(text('DELETE FROM tournament_player WHERE tournament_id = :tournament_id'), {'tournament_id': tournament_id})
+                if tournament_players:
+                    session.execute(text("""INSERT INTO tournament_player (tournament_id, tournament_player_id, usab_id, player_name)
+                                            VALUES (:tournament_id, :tournament_player_id, :usab_id, :player_name)"""),
+                                    [dict(player, tournament_id=tournament_id) for player in tournament_players])
+                if performances:
+                    session.execute(text("""INSERT INTO tournament_player_performance (tournament_id, tournament_player_id, age_group, event_type, standing_level)
+                                            VALUES (:tournament_id, :tournament_player_id, :age_group, :event_type, :standing_level)"""),
+                                    [dict(performance, tournament_id=tournament_id) for performance in performances])
+                for sql in REFRESH_TOURNAMENT_SCORE_SQLS:
+                    session.execute(text(sql), {'tournament_id': tournament_id})
+                # Every worker (this one included) applies the change from the log, see sync_ingests
+                if tournament_changed or changed_usab_ids:
+                    session.execute(text('INSERT INTO ingest_log (tournament_id, usab_ids) VALUES (:tournament_id, :usab_ids)'),
+                                    {'tournament_id': tournament_id, 'usab_ids': json.dumps(sorted(changed_usab_ids))})
+                session.commit()
+        except (IntegrityError, DataError, ProgrammingError, InterfaceError):
+            # Results the validation let through but the database refused, nothing was written
+            abort(400, 'Bad Request: tournament results rejected by the database')
+
+    sync_ingests()
+    # Viewers of the live leaderboards of this worker get the changes now, other workers find them when they poll
+    if changed_usab_ids:
+        leaderboard_broadcaster.publish()
+
+    return sorted(changed_usab_ids)
+
+def validate_tournament_results(data):
+    # Every value is checked before anything is written, the database must not be the one rejecting the results
+    if not isinstance(data, dict) or not isinstance(data.get('tournament'), dict):
+        abort(400, 'Bad Request: invalid JSON body')
+    players = data.get('players', [])
+    performances = data.get('performances', [])
+    if not isinstance(players, list) or not isinstance(performances, list):
+        abort(400, 'Bad Request: players and performances must be lists')
+
+    tournament = {}
+    for field in ('tournament_name', 'tournament_type', 'description', 'location', 'start_date', 'end_date'):
+        tournament[field] = data['tournament'].get(field)
+        # Descriptions and locations are optional
+        if not isinstance(tournament[field], str) and not (field in ('description', 'location') and tournament[field] == None):
+            abort(400, f'Bad Request: invalid {field} in tournament')
+    if not is_valid_date(tournament['start_date']) or not is_valid_date(tournament['end_date']):
+        abort(400, 'Bad Request: invalid tournament dates, expected YYYY-MM-DD')
+
+    tournament_players = []
+    usab_ids_by_id = {}
+    for player in players:
+        if not isinstance(player, dict):
+            abort(400, 'Bad Request: invalid player in players')
+        tournament_player = {'tournament_player_id': get_sqlite_integer(player.get('tournament_player_id')),
+                             'usab_id': get_sqlite_integer(player.get('usab_id')),
+                             'player_name': player.get('player_name')}
+        for field in ('tournament_player_id', 'usab_id'):
+            if tournament_player[field] == None:
+                abort(400, f'Bad Request: invalid {field} in players')
+        if not isinstance(tournament_player['player_name'], str):
+            abort(400, 'Bad Request: invalid player_name in players')
+        if tournament_player['tournament_player_id'] in usab_ids_by_id:
+            abort(400, 'Bad Request: duplicate tournament_player_id')
+        usab_ids_by_id[tournament_player['tournament_player_id']] = tournament_player['usab_id']
+        tournament_players.append(tournament_player)
+
+    tournament_performances = []
+    tournament_player_keys = set()
+    usab_player_keys = set()
+    score_dict = get_current_score_dict()
+    for performance in performances:
+        if not isinstance(performance, dict):
+            abort(400, 'Bad Request: invalid performance in performances')
+        tournament_player_id = get_sqlite_integer(performance.get('tournament_player_id'))
+        if tournament_player_id not in usab_ids_by_id:
+            abort(400, 'Bad Request: performance of an unknown tournament_player_id')
+        for field in ('age_group', 'event_type', 'standing_level'):
+            if not isinstance(performance.get(field), str):
+                abort(400, f'Bad Request: invalid {field} in performances')
+        tournament_performance = {'tournament_player_id': tournament_player_id,
+                                  'age_group': performance['age_group'].upper(),
+                                  'event_type': performance['event_type'].upper(),
+                                  'standing_level': performance['standing_level']}
+        if tournament_performance['event_type'] not in ALL_EVENT_TYPES:
+            abort(400, 'Bad Request: invalid event_type in performances')
+        if tournament_performance['age_group'] not in ALL_AGE_GROUPS:
+            abort(400, 'Bad Request: invalid age_group in performances')
+        if (tournament['tournament_type'], tournament_performance['age_group'], tournament_performance['standing_level']) not in score_dict:
+            abort(400, 'Bad Request: invalid standing_level in performances')
+
+        # One result per entry and event, and per known player and event (usab_id 0 is any unknown player)
+        event = (tournament_performance['age_group'], tournament_performance['event_type'])
+        usab_id = usab_ids_by_id[tournament_player_id]
+        if (tournament_player_id,) + event in tournament_player_keys or (usab_id != 0 and (usab_id,) + event in usab_player_keys):
+            abort(400, 'Bad Request: duplicate performance of a player in an event')
+        tournament_player_keys.add((tournament_player_id,) + event)
+        usab_player_keys.add((usab_id,) + event)
+        tournament_performances.append(tournament_performance)
+    return tournament, tournament_players, tournament_performances
+
+# Endpoint to ingest (or replace) the results of one tournament
+@app.route('/api/v1/tournament/<tournament_id>/results', methods=['POST'])
+def post_tournament_results(tournament_id):
+    ingest_token = app.config['INGEST_TOKEN']
+    # Constant time comparison, the time taken must not tell how much of a guessed token is right
+    if not ingest_token or not hmac.compare_digest(request.headers.get('X-Ingest-Token', '').encode(), ingest_token.encode()):
+        abort(403, 'Forbidden')
+
+    tournament, tournament_players, performances = validate_tournament_results(request.get_json(silent=True))
+    changed_usab_ids = ingest_tournament_results(tournament_id, tournament, tournament_players, performances)
+
+    return jsonify({'tournament_id': tournament_id, 'players': len(tournament_players),
+                    'performances': len(performances), 'changed_usab_ids': changed_usab_ids})
+
+def profile_request():
+    # Run the view under cProfile and return the profile, sorted by cumulative time, as text
+    profiler = cProfile.Profile()
+    response = profiler.runcall(lambda: app.make_response(app.dispatch_request()))
+    output = io.StringIO()
+    output.write(f'{request.method} {request.full_path} -> {response.status}\n\n')
+    pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(50)
+    return app.response_class(output.getvalue(), mimetype='text/plain')
+
+@app.before_request
+def before_request():
+    g.snapshot = snapshot_manager.acquire()
+    start_request_timing()
+    # Ingests of other workers, before anything is read from the caches
+    sync_ingests()
+    if app.config['PROFILING_ENABLED'] and request.args.get('profile') == '1':
+        return profile_request()
+
+@app.after_request
+def after_request(response):
+    timing = finish_request_timing()
+    if timing is None:
+        return response
+    total, phase_seconds = timing
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    metrics.inc('http_requests_total', (('method', request.method), ('route', route), ('status', str(response.status_code))))
+    metrics.observe('http_request_duration_seconds', (('route', route),), total)
+    for phase, seconds in phase_seconds.items():
+        metrics.inc('http_request_phase_seconds_total', (('phase', phase), ('route', route)), seconds)
+    response.headers['Server-Timing'] = ', '.join(f'{phase};dur={seconds * 1000:.2f}' for phase, seconds in phase_seconds.items())
+    if g.snapshot.version != None:
+        response.headers['X-Data-Snapshot'] = g.snapshot.version
+    return response
+
+def is_database_busy(error):
+    # SQLITE_BUSY or SQLITE_LOCKED (or one of their extended codes), SQLAlchemy errors wrap the sqlite3 one
+    error = getattr(error, 'orig', error)
+    return (getattr(error, 'sqlite_errorcode', 0) & 0xff) in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+
+@app.errorhandler(sqlite3.OperationalError)
+@app.errorhandler(OperationalError)
+def handle_database_error(error):
+    # A locked database is temporary, the client can retry. Any other database error is a server error
+    if not is_database_busy(error):
+        raise error
+    return ServiceUnavailable('Service Unavailable: the database is busy, retry later', retry_after=DATABASE_BUSY_RETRY_SECONDS)
+
+@app.teardown_request
+def teardown_request(exception):
+    # An old snapshot is closed once its last request is done
+    snapshot = g.pop('snapshot', None)
+    if snapshot != None:
+        snapshot.release()
+
+# Prometheus metrics of this worker process
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def warm_snapshot(snapshot):
+    # Fill the caches and build the leaderboards of a new snapshot while the current one is still served,
+    # returns the function that swaps them in when the snapshot becomes current
+    with app.app_context():
+        g.snapshot = snapshot
+        get_current_score_dict()
+        get_usab_players_list()
+        get_tournaments_list()
+        score_version = get_current_score_version()
+        base = get_data_base()
+        seq = get_ingest_log_seq()
+        ranking_engine = load_ranking_engine(score_version)
+        search_index = load_player_search_index()
+
+    def activate():
+        global ranking_history, player_search_index, player_search_index_version
+        with ranking_engine_lock:
+            ranking_engines.clear()
+            ranking_engine_versions.clear()
+            ranking_engines[score_version] = ranking_engine
+            ranking_engine_versions[score_version] = ((ranking_engine.as_of, base), seq)
+        with player_search_index_lock:
+            player_search_index = search_index
+            player_search_index_version = (base, seq)
+        # Past rankings are rebuilt on first use, as after any data change
+        with ranking_history_lock:
+            ranking_history = None
+        # Viewers of the live leaderboards get the changes of the new snapshot
+        leaderboard_broadcaster.publish()
+    return activate
+
+def warm_up():
+    # Migrate the database when it predates the current schema, then preload the shared dictionaries
+    # and all the leaderboards before the worker accepts traffic
+    with app.app_context():
+        ensure_migrated(get_snapshot().path)
+        get_current_score_dict()
+        get_usab_players_list()
+        get_tournaments_list()
+        get_ranking_engine(get_current_score_version())
+        get_player_search_index()
+        sync_ingests()
 
 if __name__ == '__main__':
+    warm_up()
     app.run(debug=True)
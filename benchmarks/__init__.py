@@ -0,0 +1 @@
+# Benchmarks for the tournament API: synthetic datasets, endpoint latency and HTTP load.
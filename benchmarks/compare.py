@@ -0,0 +1,63 @@
+# benchmarks/compare.py
+#
+# Compare two result files of benchmarks/run.py, route by route.
+# A ratio above 1 means the new run is slower (latency) or serves fewer requests per second.
+#
+# Usage: python -m benchmarks.compare before.json after.json [--threshold 1.1]
+import argparse
+import json
+import sys
+
+# (section, metric, higher is better)
+METRICS = [
+    ('test_client', ('cold', 'p50'), False),
+    ('test_client', ('cold', 'p99'), False),
+    ('test_client', ('warm', 'p50'), False),
+    ('test_client', ('warm', 'p99'), False),
+    ('http', ('p50',), False),
+    ('http', ('p99',), False),
+    ('http', ('requests_per_second',), True),
+]
+
+def get_metric(route_results, path):
+    for name in path:
+        if not isinstance(route_results, dict) or name not in route_results:
+            return None
+        route_results = route_results[name]
+    return route_results
+
+def compare(before, after):
+    # Yields (route, metric name, before value, after value, slowdown ratio)
+    for section, path, higher_is_better in METRICS:
+        for route, after_results in after.get(section, {}).items():
+            old = get_metric(before.get(section, {}).get(route), path)
+            new = get_metric(after_results, path)
+            if not old or not new:
+                continue
+            ratio = old / new if higher_is_better else new / old
+            yield route, f"{section} {' '.join(path)}", old, new, ratio
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files')
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=1.1, help='slowdown ratio reported as a regression')
+    args = parser.parse_args(argv)
+
+    with open(args.before) as file:
+        before = json.load(file)
+    with open(args.after) as file:
+        after = json.load(file)
+
+    regressions = 0
+    for route, metric, old, new, ratio in compare(before, after):
+        flag = ''
+        if ratio > args.threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print(f'{route:50} {metric:30} {old:10.2f} -> {new:10.2f}  x{ratio:5.2f}{flag}')
+    # Non-zero exit status so the comparison can gate a CI job
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+# benchmarks/generate_data.py
+#
+# Generate a synthetic tournament.db at a multiple of the shipped data size
+# (--scale 1 is about 1,900 players, 21 tournaments and 16k performance rows).
+# Tournaments end within the two years before today, so current rankings are populated.
+#
+# Usage: python -m benchmarks.generate_data --scale 10 --output /tmp/tournament_10x.db
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import date, timedelta
+
+from schema import migrate
+
+SHIPPED_DATABASE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tournament.db')
+
+# Shipped data size, multiplied by the scale
+PLAYERS = 1900
+TOURNAMENTS = 21
+PLAYERS_PER_TOURNAMENT = 300
+
+TOURNAMENT_TYPES = ['OLC'] * 9 + ['ORC'] * 9 + ['CRC'] * 2 + ['JN']
+AGE_LIMITS = [11, 13, 15, 17, 19]
+# About 2.5 events per player and tournament, like the shipped data
+EVENTS_PER_PLAYER = (1, 2, 3, 3, 3, 3)
+EVENT_TYPES = {'M': ['BS', 'BD', 'XD'], 'F': ['GS', 'GD', 'XD']}
+BATCH_SIZE = 50000
+
+def copy_schema(source, target):
+    # Tables first, then the view that depends on them
+    for (sql,) in source.execute("SELECT sql FROM sqlite_master WHERE type IN ('table', 'view') AND name != 'player_tournament_score' "
+                                 "AND name NOT LIKE 'sqlite_%' ORDER BY type = 'view'"):
+        target.execute(sql)
+    target.executemany('INSERT INTO score VALUES (?, ?, ?, ?, ?)', source.execute('SELECT * FROM score'))
+
+def generate(output, scale, seed=0):
+    # With the WAL of the database being replaced, if any
+    for path in (output, output + '-wal', output + '-shm'):
+        if os.path.exists(path):
+            os.remove(path)
+    rng = random.Random(seed)
+    today = date.today()
+    source = sqlite3.connect(SHIPPED_DATABASE_PATH)
+    target = sqlite3.connect(output)
+    target.execute('PRAGMA journal_mode=WAL')
+    target.execute('PRAGMA synchronous=OFF')
+    copy_schema(source, target)
+
+    standing_levels = {}
+    for tournament_type, age_group, standing_level in source.execute('SELECT DISTINCT tournament_type, age_group, standing_level FROM score'):
+        standing_levels.setdefault((tournament_type, age_group), []).append(standing_level)
+    source.close()
+
+    players = []
+    for index in range(int(PLAYERS * scale)):
+        players.append((100000 + index, f'Player {index}', today.year - rng.randint(8, 18), rng.choice('MF')))
+    target.executemany('INSERT INTO usab_player VALUES (?, ?, ?, ?)', players)
+
+    tournament_players = []
+    performances = []
+    for index in range(int(TOURNAMENTS * scale)):
+        tournament_id = f'T{index:07d}'
+        tournament_type = rng.choice(TOURNAMENT_TYPES)
+        end_date = today - timedelta(days=rng.randrange(730))
+        target.execute('INSERT INTO tournament VALUES (?, ?, ?, ?, ?, ?, ?)',
+                       (tournament_id, f'Tournament {index}', tournament_type, f'SYNTHETIC TOURNAMENT {index}', 'Somewhere',
+                        str(end_date - timedelta(days=2)), str(end_date)))
+        for tournament_player_id, (usab_id, player_name, birth_year, gender) in enumerate(rng.sample(players, PLAYERS_PER_TOURNAMENT), start=1):
+            tournament_players.append((tournament_id, tournament_player_id, player_name, usab_id))
+            player_age = end_date.year - birth_year
+            age_group = f'U{min(limit for limit in AGE_LIMITS if limit > player_age)}' if player_age < 19 else 'U19'
+            for event_type in rng.sample(EVENT_TYPES[gender], rng.choice(EVENTS_PER_PLAYER)):
+                standing_level = rng.choice(standing_levels[(tournament_type, age_group)])
+                performances.append((tournament_id, tournament_player_id, age_group, event_type, standing_level))
+        if len(performances) >= BATCH_SIZE:
+            target.executemany('INSERT INTO tournament_player VALUES (?, ?, ?, ?)', tournament_players)
+            target.executemany('INSERT INTO tournament_player_performance VALUES (?, ?, ?, ?, ?)', performances)
+            tournament_players = []
+            performances = []
+    target.executemany('INSERT INTO tournament_player VALUES (?, ?, ?, ?)', tournament_players)
+    target.executemany('INSERT INTO tournament_player_performance VALUES (?, ?, ?, ?, ?)', performances)
+    target.commit()
+
+    with target:
+        migrate(target)
+    row_count = target.execute('SELECT COUNT(*) FROM tournament_player_performance').fetchone()[0]
+    target.close()
+    return row_count
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic tournament.db')
+    parser.add_argument('--scale', type=float, default=1, help='multiple of the shipped data size')
+    parser.add_argument('--output', required=True, help='database file to create (replaced if it exists)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    row_count = generate(args.output, args.scale, args.seed)
+    print(f'Generated {args.output}: {row_count} performance rows in {time.perf_counter() - start:.1f}s')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
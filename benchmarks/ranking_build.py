@@ -0,0 +1,84 @@
+# benchmarks/ranking_build.py
+#
+# Time a build of every current leaderboard with the Python RankingEngine and with the
+# NumPy ColumnarRankingEngine on the same tournament.db, and check both give the same ranks.
+# Both timings include reading the results: rows of strings for RankingEngine.build,
+# integer columns for ColumnarRankingEngine.load.
+#
+# Usage: python -m benchmarks.ranking_build --db /tmp/tournament_100x.db
+import argparse
+import sqlite3
+import sys
+import time
+from datetime import date
+
+from columnar_ranking import ColumnarRankingEngine, numpy
+from ranking import ScoreTable, RankingEngine, one_year_before
+
+AGE_GROUPS = {'U11', 'U13', 'U15', 'U17', 'U19'}
+EVENT_TYPES = {'BS', 'GS', 'BD', 'GD', 'XD'}
+
+RESULTS_SQL = '''
+    SELECT usab_id, tournament_id, end_date, tournament_type, age_group, event_type, standing_level
+    FROM player_tournament_score
+    WHERE end_date >= ?
+'''
+
+def load_scores_and_players(connection):
+    all_version_score_dict = {}
+    for version, tournament_type, age_group, standing_level, ranking_points in connection.execute(
+            'SELECT version, tournament_type, age_group, standing_level, ranking_points FROM score'):
+        all_version_score_dict.setdefault(version, {})[(tournament_type, age_group, standing_level)] = ranking_points
+    players = connection.execute('SELECT usab_id, player_name, birth_year FROM usab_player WHERE usab_id != 0').fetchall()
+    return ScoreTable(all_version_score_dict), players
+
+def build_python(connection, score_table, score_version, as_of, players):
+    engine = RankingEngine(score_table, score_version, AGE_GROUPS, EVENT_TYPES, as_of)
+    performances = connection.execute(RESULTS_SQL, (str(one_year_before(as_of)),)).fetchall()
+    return engine.build(players, score_table.encode(performances))
+
+def build_columnar(connection, score_table, score_version, as_of, players):
+    engine = ColumnarRankingEngine(score_table, score_version, AGE_GROUPS, EVENT_TYPES, as_of).load(players, connection)
+    connection.rollback()
+    return engine
+
+def time_build(build, connection, score_table, score_version, as_of, players, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        engine = build(connection, score_table, score_version, as_of, players)
+        timings.append(time.perf_counter() - start)
+    return engine, min(timings)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare the Python and NumPy leaderboard builds')
+    parser.add_argument('--db', required=True, help='tournament.db to rank, see benchmarks/generate_data.py')
+    parser.add_argument('--as-of', type=date.fromisoformat, default=date.today(), help='day to rank players on')
+    parser.add_argument('--repeat', type=int, default=3, help='builds per engine, the fastest is reported')
+    args = parser.parse_args(argv)
+
+    if numpy == None:
+        print('numpy is not installed', file=sys.stderr)
+        return 1
+
+    connection = sqlite3.connect(f'file:{args.db}?mode=ro', uri=True)
+    try:
+        score_table, players = load_scores_and_players(connection)
+        score_version = max(score_table.points)
+        count = connection.execute('SELECT COUNT(*) FROM player_tournament_score WHERE end_date >= ?', (str(one_year_before(args.as_of)),)).fetchone()[0]
+        print(f'{count} results in the window, {len(players)} players')
+
+        python_engine, python_seconds = time_build(build_python, connection, score_table, score_version, args.as_of, players, args.repeat)
+        print(f'RankingEngine          {python_seconds:8.3f} s')
+        columnar_engine, columnar_seconds = time_build(build_columnar, connection, score_table, score_version, args.as_of, players, args.repeat)
+        print(f'ColumnarRankingEngine  {columnar_seconds:8.3f} s  x{python_seconds / columnar_seconds:.2f}')
+    finally:
+        connection.close()
+
+    if python_engine.leaderboards != columnar_engine.leaderboards or python_engine.totals != columnar_engine.totals:
+        print('leaderboards differ', file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
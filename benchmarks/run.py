@@ -0,0 +1,234 @@
+# benchmarks/run.py
+#
+# Drive every route of app.py against a tournament.db, first through the Flask test
+# client (cold-miss and warm-hit latency) and then through a local threaded HTTP server
+# with concurrent keep-alive clients (requests per second and latency under load).
+# Results are written as JSON, compare two runs with benchmarks/compare.py.
+#
+# Usage: python -m benchmarks.run --db /tmp/tournament_10x.db --output results.json
+import argparse
+import http.client
+import json
+import logging
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from urllib.parse import urlencode
+
+# Routes that write to the database are not benchmarked
+SKIPPED_ROUTES = {'/api/v1/tournament/<tournament_id>/results'}
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def summarize(timings):
+    # Latencies in milliseconds
+    timings = sorted(timing * 1000 for timing in timings)
+    if not timings:
+        return {'count': 0}
+    return {'count': len(timings), 'mean': sum(timings) / len(timings), 'p50': percentile(timings, 0.5),
+            'p90': percentile(timings, 0.9), 'p99': percentile(timings, 0.99), 'max': timings[-1]}
+
+def get_samples(database_path, count):
+    # Up to count distinct requests per route, so every cold request misses on its own ids
+    connection = sqlite3.connect(database_path)
+    try:
+        usab_ids = [row[0] for row in connection.execute(
+            'SELECT usab_id FROM player_tournament_score WHERE usab_id != 0 GROUP BY usab_id ORDER BY COUNT(*) DESC LIMIT ?', (count,))]
+        tournament_ids = [row[0] for row in connection.execute(
+            'SELECT tournament_id FROM tournament ORDER BY end_date DESC LIMIT ?', (count,))]
+        player_names = [row[0] for row in connection.execute(
+            'SELECT player_name FROM usab_player WHERE usab_id != 0 ORDER BY usab_id LIMIT ?', (count,))]
+    finally:
+        connection.close()
+    # Past days spread over the last year, for the historical rankings
+    as_of_dates = [date.today() - timedelta(days=index * 365 // count) for index in range(count)]
+    boards = [(event_type, age_group) for age_group in ('U11', 'U13', 'U15', 'U17', 'U19') for event_type in ('BS', 'GS', 'BD', 'GD', 'XD')]
+    batch_usab_ids = usab_ids[:100]
+    # Type-ahead queries: the start of a name, as typed so far
+    search_queries = [player_name[:length] for player_name in player_names for length in (2, 5, len(player_name))]
+
+    return {
+        '/api/v1/scores': [('GET', '/api/v1/scores', None)],
+        '/api/v1/players': [('GET', '/api/v1/players', None), ('GET', '/api/v1/players?offset=100&limit=100', None)],
+        '/api/v1/players/search': [('GET', '/api/v1/players/search?' + urlencode({'q': query}), None) for query in search_queries],
+        '/api/v1/player/<usab_id>': [('GET', f'/api/v1/player/{usab_id}', None) for usab_id in usab_ids],
+        '/api/v1/tournaments': [('GET', '/api/v1/tournaments', None)],
+        '/api/v1/tournament/<tournament_id>': [('GET', f'/api/v1/tournament/{tournament_id}', None) for tournament_id in tournament_ids],
+        '/api/v1/tournament/<tournament_id>/players': [
+            ('GET', f'/api/v1/tournament/{tournament_id}/players', None) for tournament_id in tournament_ids],
+        '/api/v1/tournament/<tournament_id>/performance': [
+            ('GET', f'/api/v1/tournament/{tournament_id}/performance', None) for tournament_id in tournament_ids],
+        '/api/v1/player/<usab_id>/performance': [('GET', f'/api/v1/player/{usab_id}/performance', None) for usab_id in usab_ids],
+        '/api/v1/ranks': [('GET', f'/api/v1/ranks?event_type={event_type}&age_group={age_group}', None)
+                          for event_type, age_group in boards[:count]] +
+                         [('GET', f'/api/v1/ranks?event_type={event_type}&age_group={age_group}&as_of={as_of}', None)
+                          for (event_type, age_group), as_of in zip(boards[:count], as_of_dates)],
+        '/api/v1/player/<usab_id>/ranks': [('GET', f'/api/v1/player/{usab_id}/ranks', None) for usab_id in usab_ids],
+        '/api/v1/players:batch': [('POST', '/api/v1/players:batch', {'usab_ids': batch_usab_ids})],
+        '/api/v1/performance:batch': [('POST', '/api/v1/performance:batch', {'usab_ids': batch_usab_ids})],
+        # Exports are streamed, their timings include reading the whole body
+        '/api/v1/export/performances': [('GET', '/api/v1/export/performances', None),
+                                        ('GET', '/api/v1/export/performances?format=csv', None)] +
+                                       [('GET', f'/api/v1/export/performances?event_type={event_type}&age_group={age_group}', None)
+                                        for event_type, age_group in boards[:count]],
+        '/api/v1/export/ranks': [('GET', '/api/v1/export/ranks', None), ('GET', '/api/v1/export/ranks?format=csv', None)] +
+                                [('GET', f'/api/v1/export/ranks?age_group={age_group}&as_of={as_of}', None)
+                                 for (event_type, age_group), as_of in zip(boards[:count], as_of_dates)],
+        '/metrics': [('GET', '/metrics', None)],
+    }
+
+def get_routes(app, samples):
+    routes = {}
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint == 'static' or rule.rule in SKIPPED_ROUTES:
+            continue
+        if rule.rule in samples:
+            routes[rule.rule] = samples[rule.rule]
+        else:
+            print(f'warning: no sample request for {rule.rule}, not benchmarked', file=sys.stderr)
+    return routes
+
+def reset_caches(app_module):
+    app_module.cache.clear()
+    app_module.ranking_engines.clear()
+    app_module.ranking_engine_versions.clear()
+    app_module.ranking_history = None
+    app_module.player_search_index = None
+
+def test_client_request(client, method, url, body):
+    start = time.perf_counter()
+    response = client.open(url, method=method, json=body, headers={'Accept-Encoding': 'gzip'})
+    # Streamed bodies are only produced as they are read
+    response.get_data()
+    elapsed = time.perf_counter() - start
+    response.close()
+    if response.status_code >= 400:
+        raise RuntimeError(f'{method} {url} returned {response.status_code}')
+    return elapsed
+
+def run_test_client(app_module, routes, warm_repeat):
+    client = app_module.app.test_client()
+    results = {}
+    for route, route_samples in routes.items():
+        # Cold: every request starts from empty caches and no leaderboards
+        cold = []
+        for method, url, body in route_samples:
+            reset_caches(app_module)
+            cold.append(test_client_request(client, method, url, body))
+        # Warm: the same requests again, served from the caches
+        warm = []
+        for index in range(warm_repeat):
+            method, url, body = route_samples[index % len(route_samples)]
+            warm.append(test_client_request(client, method, url, body))
+        results[route] = {'cold': summarize(cold), 'warm': summarize(warm)}
+        print(f"{route:50} cold p50 {results[route]['cold']['p50']:8.2f} ms  warm p50 {results[route]['warm']['p50']:8.2f} ms")
+    return results
+
+def load_client(port, requests, deadline, timings, errors):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    index = 0
+    while time.perf_counter() < deadline:
+        method, url, body = requests[index % len(requests)]
+        index += 1
+        headers = {'Accept-Encoding': 'gzip'}
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        start = time.perf_counter()
+        try:
+            connection.request(method, url, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 400:
+                errors.append(response.status)
+                continue
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(str(e))
+            connection.close()
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            continue
+        timings.append(time.perf_counter() - start)
+    connection.close()
+
+def run_http(app_module, routes, concurrency, duration):
+    from werkzeug.serving import make_server
+
+    # One access log line per request would slow the server down
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    results = {}
+    try:
+        app_module.warm_up()
+        for route, route_samples in routes.items():
+            timings = []
+            errors = []
+            deadline = time.perf_counter() + duration
+            clients = [threading.Thread(target=load_client, args=(server.server_port, route_samples[index:] + route_samples[:index],
+                                                                   deadline, timings, errors))
+                       for index in range(concurrency)]
+            start = time.perf_counter()
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+            elapsed = time.perf_counter() - start
+            results[route] = dict(summarize(timings), requests_per_second=len(timings) / elapsed, errors=len(errors))
+            print(f"{route:50} {results[route]['requests_per_second']:8.0f} req/s  p99 {results[route]['p99'] or 0:8.2f} ms  errors {len(errors)}")
+    finally:
+        server.shutdown()
+    return results
+
+def get_git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark every API route')
+    parser.add_argument('--db', required=True, help='tournament.db to serve, see benchmarks/generate_data.py')
+    parser.add_argument('--output', help='JSON file to write the results to')
+    parser.add_argument('--samples', type=int, default=20, help='distinct cold requests per route')
+    parser.add_argument('--warm-repeat', type=int, default=200, help='warm requests per route')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent HTTP clients')
+    parser.add_argument('--duration', type=float, default=5, help='seconds of HTTP load per route')
+    parser.add_argument('--skip-http', action='store_true', help='only run the test client benchmark')
+    args = parser.parse_args(argv)
+
+    # app.py opens the database at import time
+    os.environ['TOURNAMENT_DB'] = os.path.abspath(args.db)
+    import app as app_module
+
+    connection = sqlite3.connect(args.db)
+    row_count = connection.execute('SELECT COUNT(*) FROM tournament_player_performance').fetchone()[0]
+    connection.close()
+
+    routes = get_routes(app_module.app, get_samples(args.db, args.samples))
+    results = {'meta': {'db': os.path.abspath(args.db), 'performance_rows': row_count, 'git_commit': get_git_commit(),
+                        'timestamp': datetime.now(timezone.utc).isoformat(), 'python': sys.version.split()[0],
+                        'samples': args.samples, 'warm_repeat': args.warm_repeat,
+                        'concurrency': args.concurrency, 'duration': args.duration}}
+
+    print('Test client latency')
+    results['test_client'] = run_test_client(app_module, routes, args.warm_repeat)
+    if not args.skip_http:
+        print(f'HTTP load, {args.concurrency} clients for {args.duration:g}s per route')
+        results['http'] = run_http(app_module, routes, args.concurrency, args.duration)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f'Wrote {args.output}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,155 @@
+# cache_backend.py
+#
+# Flask-Caching backends: a bounded in-process LRU cache and a generational wrapper that
+# lets every worker drop all its entries at once when the data is reloaded.
+import os
+import threading
+from collections import OrderedDict
+from time import time
+
+from flask_caching.backends.base import BaseCache
+from flask_caching.backends.filesystemcache import FileSystemCache
+
+def read_generation(generation_file):
+    try:
+        with open(generation_file) as file:
+            return int(file.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+def bump_generation(generation_file):
+    # Write to a temporary file and rename it, so readers never see a partial number
+    generation = read_generation(generation_file) + 1
+    temporary_file = f'{generation_file}.{os.getpid()}.tmp'
+    with open(temporary_file, 'w') as file:
+        file.write(str(generation))
+    os.replace(temporary_file, generation_file)
+    return generation
+
+class LRUCache(BaseCache):
+    """In-process cache holding at most ``threshold`` entries.
+
+    The least recently used entry is evicted first and entries expire after their
+    timeout. Values are stored as they are (not pickled), so callers must not
+    mutate what they get back.
+    """
+
+    def __init__(self, threshold=500, default_timeout=300):
+        BaseCache.__init__(self, default_timeout=default_timeout)
+        self._threshold = threshold
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        kwargs.update(threshold=config['CACHE_THRESHOLD'])
+        return cls(*args, **kwargs)
+
+    def _expires(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        return time() + timeout if timeout > 0 else 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._cache.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires and expires <= time():
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            self._cache[key] = (self._expires(timeout), value)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._threshold:
+                self._cache.popitem(last=False)
+        return True
+
+    def add(self, key, value, timeout=None):
+        with self._lock:
+            if key in self._cache:
+                return False
+        return self.set(key, value, timeout)
+
+    def delete(self, key):
+        with self._lock:
+            return self._cache.pop(key, None) is not None
+
+    def has(self, key):
+        return self.get(key) is not None
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+        return True
+
+class GenerationalCache(BaseCache):
+    """Wraps another cache and prefixes every key with the current data generation.
+
+    The generation is a counter kept in a file shared by all workers: bumping it
+    (see ``bump_generation``) makes every worker miss on all the old entries, which
+    then age out of the wrapped cache. ``get_namespace`` returns the key prefix and
+    generation file of the data being served; app.py replaces it to give every
+    database snapshot its own keys.
+    """
+
+    def __init__(self, cache, generation_file, default_timeout=300):
+        BaseCache.__init__(self, default_timeout=default_timeout)
+        self.cache = cache
+        self.generation_file = generation_file
+        self.get_namespace = lambda: ('', self.generation_file)
+        # generation file -> (mtime, generation)
+        self._generations = {}
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        threshold = config['CACHE_THRESHOLD']
+        if config['CACHE_BACKEND'] == 'filesystem':
+            # Shared by all the workers of the host
+            cache = FileSystemCache(config['CACHE_DIR'], threshold=threshold, **kwargs)
+        else:
+            cache = LRUCache(threshold=threshold, **kwargs)
+        generational_cache = cls(cache, config['CACHE_GENERATION_FILE'], **kwargs)
+        # Deleting a key that is not cached must not stop delete_many
+        generational_cache.ignore_errors = config['CACHE_IGNORE_ERRORS']
+        return generational_cache
+
+    def get_generation(self, generation_file):
+        try:
+            mtime = os.stat(generation_file).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        cached = self._generations.get(generation_file)
+        if cached is None or cached[0] != mtime:
+            cached = self._generations[generation_file] = (mtime, read_generation(generation_file))
+        return cached[1]
+
+    @property
+    def generation(self):
+        return self.get_generation(self.get_namespace()[1])
+
+    def _key(self, key):
+        prefix, generation_file = self.get_namespace()
+        return f'{prefix}g{self.get_generation(generation_file)}:{key}'
+
+    def get(self, key):
+        return self.cache.get(self._key(key))
+
+    def set(self, key, value, timeout=None):
+        return self.cache.set(self._key(key), value, timeout)
+
+    def add(self, key, value, timeout=None):
+        return self.cache.add(self._key(key), value, timeout)
+
+    def delete(self, key):
+        return self.cache.delete(self._key(key))
+
+    def has(self, key):
+        return self.cache.has(self._key(key))
+
+    def clear(self):
+        return self.cache.clear()
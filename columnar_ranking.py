@@ -0,0 +1,323 @@
+# columnar_ranking.py
+#
+# Optional NumPy build of the leaderboards: the results of the ranking window are read
+# from the database as integer codes straight into an array, every leaderboard is
+# computed with sorts and segment operations and kept as arrays. Entries only become
+# Python tuples for the pages that are served. Used by app.py when numpy is installed.
+from collections.abc import MutableMapping, Sequence
+
+from ranking import TOP_RESULTS_PER_EVENT, MISSING_POINTS, RankingEngine, age_group_limit
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Tournaments of a ranking window, their results are read one tournament at a time
+WINDOW_TOURNAMENTS_SQL = """
+    SELECT tournament_id, tournament_type
+    FROM tournament
+    WHERE end_date >= :min_end_date AND (:max_end_date IS NULL OR end_date <= :max_end_date)
+    ORDER BY tournament_id
+"""
+
+# Results of one tournament as integers: usab_id and the codes of the age group, standing level and
+# event type. {age_group}, {standing_level} and {event_type} are CASE expressions, see case_sql
+TOURNAMENT_COLUMNS_SQL = """
+    SELECT usab_id, {age_group}, {standing_level}, {event_type}
+    FROM player_tournament_score
+    WHERE tournament_id = :tournament_id
+"""
+
+def case_sql(column, codes, params):
+    # CASE expression giving the code of a value of column, -1 for values missing from codes. The values
+    # are bound as parameters
+    whens = []
+    for value, code in codes.items():
+        params[f'{column}_{code}'] = value
+        whens.append(f'WHEN :{column}_{code} THEN {code}')
+    return f"CASE {column} {' '.join(whens)} ELSE -1 END"
+
+def index_in(sorted_ids, values):
+    # Index of every value in sorted_ids, -1 for values missing from it. Small non-negative ids (like
+    # usab_ids) go through a table indexed by id, others are binary searched
+    if not len(sorted_ids):
+        return numpy.full(len(values), -1, dtype=numpy.int64)
+    if sorted_ids[0] >= 0 and sorted_ids[-1] < 4 * len(sorted_ids) + 1024:
+        table = numpy.full(int(sorted_ids[-1]) + 1, -1, dtype=numpy.int64)
+        table[sorted_ids] = numpy.arange(len(sorted_ids))
+        inside = (values >= 0) & (values < len(table))
+        return numpy.where(inside, table[numpy.where(inside, values, 0)], -1)
+    index = numpy.minimum(numpy.searchsorted(sorted_ids, values), len(sorted_ids) - 1)
+    return numpy.where(sorted_ids[index] == values, index, -1)
+
+def group_starts(sorted_keys):
+    # Index of the first row of every run of equal keys
+    return numpy.flatnonzero(numpy.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+
+class ArrayLeaderboard(Sequence):
+    """Leaderboard of a build: the sorted (-total_score, usab_id) entries of RankingEngine as two arrays.
+
+    Entries are made into tuples only for the slices that are read. update_players swaps
+    in a list when it edits the leaderboard, like for the Python engine.
+    """
+
+    def __init__(self, negative_totals, usab_ids):
+        self.negative_totals = negative_totals
+        self.usab_ids = usab_ids
+
+    def __len__(self):
+        return len(self.usab_ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(zip(self.negative_totals[index].tolist(), self.usab_ids[index].tolist()))
+        return int(self.negative_totals[index]), int(self.usab_ids[index])
+
+    def __iter__(self):
+        return zip(self.negative_totals.tolist(), self.usab_ids.tolist())
+
+    def __eq__(self, other):
+        if isinstance(other, (list, ArrayLeaderboard)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+class ColumnarTotals(MutableMapping):
+    """(usab_id, event_type, age_group) -> total score, like RankingEngine.totals.
+
+    The totals of the build stay in one array per leaderboard ordered by usab_id and are
+    found by binary search, the changes of update_players are kept in a dict over them.
+    """
+
+    def __init__(self, boards):
+        # (event_type, age_group) -> (usab_ids, totals)
+        self.boards = boards
+        # key -> total, None once removed
+        self.changes = {}
+
+    def get_built(self, key):
+        usab_id, event_type, age_group = key
+        board = self.boards.get((event_type, age_group))
+        if board is None:
+            return None
+        usab_ids, totals = board
+        index = int(numpy.searchsorted(usab_ids, usab_id))
+        if index < len(usab_ids) and usab_ids[index] == usab_id:
+            return int(totals[index])
+        return None
+
+    def __getitem__(self, key):
+        total = self.changes[key] if key in self.changes else self.get_built(key)
+        if total is None:
+            raise KeyError(key)
+        return total
+
+    def __setitem__(self, key, total):
+        self.changes[key] = total
+
+    def __delitem__(self, key):
+        self[key]
+        self.changes[key] = None
+
+    def __iter__(self):
+        for (event_type, age_group), (usab_ids, _) in self.boards.items():
+            for usab_id in usab_ids.tolist():
+                if (usab_id, event_type, age_group) not in self.changes:
+                    yield usab_id, event_type, age_group
+        for key, total in list(self.changes.items()):
+            if total is not None:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+class ColumnarRankingEngine(RankingEngine):
+    """RankingEngine whose leaderboards are built from NumPy columns and kept as arrays.
+
+    The per-player results that incremental updates need are only materialized, from
+    the columns kept by the build, for the players that are updated.
+    """
+
+    def __init__(self, *args, **kwargs):
+        if numpy is None:
+            raise RuntimeError('ColumnarRankingEngine requires numpy')
+        RankingEngine.__init__(self, *args, **kwargs)
+        self.totals = ColumnarTotals({})
+        self.materialized = set()
+        self.player_ids = numpy.zeros(0, dtype=numpy.int64)
+        # Results of the window sorted by player: player index, tournament code, age group code, event code,
+        # age limit, points. Codes index tournament_ids and age_group_values
+        self.columns = None
+        self.tournament_ids = []
+        self.age_group_values = []
+
+    def load(self, players, connection):
+        # Build from a connection to the database (players as for build). The results are read as integer
+        # codes one tournament at a time, straight into an array, in a read transaction left for the caller to end
+        score_table = self.score_table
+        params = {'min_end_date': self.min_end_date, 'max_end_date': self.max_end_date}
+        columns_sql = TOURNAMENT_COLUMNS_SQL.format(age_group=case_sql('age_group', score_table.age_group_codes, params),
+                                                    standing_level=case_sql('standing_level', score_table.standing_level_codes, params),
+                                                    event_type=case_sql('event_type', {event_type: code for code, event_type in enumerate(self.event_types)}, params))
+        cursor = connection.cursor()
+        cursor.row_factory = None
+        if not connection.in_transaction:
+            cursor.execute('BEGIN')
+        tournament_ids = []
+        tournament_type_codes = []
+        parts = []
+        for tournament_id, tournament_type in cursor.execute(WINDOW_TOURNAMENTS_SQL, params).fetchall():
+            # No version scores the results of other tournament types
+            if tournament_type not in score_table.tournament_type_codes:
+                continue
+            part = numpy.fromiter(cursor.execute(columns_sql, dict(params, tournament_id=tournament_id)), dtype=numpy.dtype((numpy.int64, 4)))
+            tournament_ids.append(tournament_id)
+            tournament_type_codes.append(score_table.tournament_type_codes[tournament_type])
+            parts.append(part)
+        if not parts:
+            return self.build_columns(players, numpy.zeros((0, 5), dtype=numpy.int64), [], [])
+        counts = [len(part) for part in parts]
+        usab_ids, age_groups, standing_levels, events = numpy.concatenate(parts).T
+        tournaments = numpy.repeat(numpy.arange(len(parts)), counts)
+
+        # Score codes as in ScoreTable, the age group codes are the ones of the score table
+        scored = (age_groups >= 0) & (standing_levels >= 0)
+        score_codes = ((numpy.repeat(tournament_type_codes, counts) * len(score_table.age_group_codes) + age_groups)
+                       * len(score_table.standing_level_codes) + standing_levels)
+        points = numpy.where(scored, numpy.asarray(self.points, dtype=numpy.int64)[numpy.where(scored, score_codes, 0)], MISSING_POINTS)
+        age_group_values = sorted(score_table.age_group_codes, key=score_table.age_group_codes.get)
+        return self.build_columns(players, numpy.stack((usab_ids, tournaments, age_groups, events, points), axis=1),
+                                  tournament_ids, age_group_values)
+
+    def build(self, players, coded_performances):
+        # Same arguments as RankingEngine.build. The rows are coded here in Python, load reads them coded
+        event_codes = {event_type: code for code, event_type in enumerate(self.event_types)}
+        tournament_codes = {}
+        age_group_codes = {}
+        rows = []
+        for usab_id, tournament_id, end_date, score_code, age_group, event_type in coded_performances:
+            end_date = str(end_date)
+            if end_date < self.min_end_date or (self.max_end_date is not None and end_date > self.max_end_date):
+                continue
+            rows.append((usab_id, tournament_codes.setdefault(tournament_id, len(tournament_codes)),
+                         age_group_codes.setdefault(age_group, len(age_group_codes)), event_codes.get(event_type, -1),
+                         MISSING_POINTS if score_code is None else self.points[score_code]))
+        columns = numpy.array(rows, dtype=numpy.int64).reshape(-1, 5)
+        return self.build_columns(players, columns, list(tournament_codes), list(age_group_codes))
+
+    def build_columns(self, players, columns, tournament_ids, age_group_values):
+        # columns: rows of the window of (usab_id, tournament code, age group code, event code, points), codes
+        # index tournament_ids, age_group_values and self.event_types (-1 for other event types)
+        for usab_id, player_name, birth_year in players:
+            self.players[usab_id] = (player_name, birth_year)
+        self.player_ids = numpy.array(sorted(self.players), dtype=numpy.int64)
+        self.tournament_ids = tournament_ids
+        self.age_group_values = age_group_values
+        if not len(columns) or not len(self.player_ids):
+            return self
+        usab_ids, tournaments, ages, events, points = columns.T
+
+        # Same rows as add_coded_result: known players and scored results
+        player_index = index_in(self.player_ids, usab_ids)
+        keep = (player_index >= 0) & (events >= 0) & (points != MISSING_POINTS)
+
+        # A player has one result per (event_type, tournament_id, age_group), the last row wins like in add_coded_result.
+        # Sorted by these keys, which groups the rows of each player
+        rows_kept = numpy.flatnonzero(keep)
+        result_keys = (((player_index[rows_kept] * len(self.event_types) + events[rows_kept]) * len(tournament_ids)
+                        + tournaments[rows_kept]) * len(age_group_values) + ages[rows_kept])
+        order = numpy.argsort(result_keys, kind='stable')
+        result_keys = result_keys[order]
+        last = numpy.flatnonzero(numpy.append(result_keys[1:] != result_keys[:-1], True))
+        rows_kept = rows_kept[order[last]]
+
+        players = player_index[rows_kept]
+        events = events[rows_kept]
+        points = points[rows_kept]
+        ages = ages[rows_kept]
+        limits = numpy.array([age_group_limit(age_group) for age_group in age_group_values], dtype=numpy.int64)[ages]
+        self.columns = (players, tournaments[rows_kept], ages, events, limits, points)
+        self.build_leaderboards(players, events, limits, points)
+        return self
+
+    def build_leaderboards(self, players, events, limits, points):
+        birth_years = numpy.array([birth_year if isinstance(birth_year, int) else 0 for _, birth_year in
+                                   map(self.players.__getitem__, self.player_ids.tolist())], dtype=numpy.int64)
+        # Players without a known birth year are never eligible
+        player_ages = numpy.where(birth_years > 0, self.as_of.year - birth_years, numpy.iinfo(numpy.int64).max)
+
+        # Rows of each (player, event) together, best points first. The rows are already grouped by player
+        # and event, sorting them on a single key is then close to linear
+        groups = players * len(self.event_types) + events
+        span = int(points.max() - points.min()) + 1 if len(points) else 1
+        if len(self.player_ids) * len(self.event_types) * span < 2 ** 62:
+            order = numpy.argsort(groups * span + (points.max() - points), kind='stable')
+        else:
+            order = numpy.lexsort((-points, groups))
+        groups = groups[order]
+        limits = limits[order]
+        points = points[order]
+
+        boards = {}
+        for age_group in self.age_groups:
+            limit = age_group_limit(age_group)
+            # Results played in the age group or younger, still grouped and sorted
+            selected = limits <= limit
+            group_keys = groups[selected]
+            if not len(group_keys):
+                continue
+            starts = group_starts(group_keys)
+            rank_in_group = numpy.arange(len(group_keys)) - numpy.repeat(starts, numpy.diff(numpy.append(starts, len(group_keys))))
+            totals = numpy.add.reduceat(numpy.where(rank_in_group < TOP_RESULTS_PER_EVENT, points[selected], 0), starts)
+            group_players = group_keys[starts] // len(self.event_types)
+            group_events = group_keys[starts] % len(self.event_types)
+            eligible = player_ages[group_players] < limit
+
+            for event_code, event_type in enumerate(self.event_types):
+                on_leaderboard = eligible & (group_events == event_code)
+                # Ordered by player, so by usab_id
+                board_usab_ids = self.player_ids[group_players[on_leaderboard]]
+                board_totals = totals[on_leaderboard]
+                boards[(event_type, age_group)] = (board_usab_ids, board_totals)
+                # Stable, so equal totals stay ordered by usab_id
+                board_order = numpy.argsort(-board_totals, kind='stable')
+                self.leaderboards[(event_type, age_group)] = ArrayLeaderboard(-board_totals[board_order], board_usab_ids[board_order])
+        self.totals = ColumnarTotals(boards)
+
+    def materialize(self, usab_id):
+        # Fill self.results for one player from the columns, once
+        if usab_id in self.materialized:
+            return
+        self.materialized.add(usab_id)
+        if self.columns is None:
+            return
+        players, tournaments, ages, events, limits, points = self.columns
+        index = int(numpy.searchsorted(self.player_ids, usab_id))
+        if index == len(self.player_ids) or self.player_ids[index] != usab_id:
+            return
+        start, end = numpy.searchsorted(players, [index, index + 1])
+        for tournament, age, event, limit, ranking_points in zip(tournaments[start:end].tolist(), ages[start:end].tolist(),
+                                                                   events[start:end].tolist(), limits[start:end].tolist(),
+                                                                   points[start:end].tolist()):
+            player_events = self.results.setdefault(usab_id, {}).setdefault(self.event_types[event], {})
+            player_events[(self.tournament_ids[tournament], self.age_group_values[age])] = (limit, ranking_points)
+
+    def add_coded_result(self, usab_id, *args):
+        self.materialize(usab_id)
+        return RankingEngine.add_coded_result(self, usab_id, *args)
+
+    def remove_results(self, usab_id, tournament_id):
+        self.materialize(usab_id)
+        RankingEngine.remove_results(self, usab_id, tournament_id)
+
+    def remove_result(self, usab_id, *args):
+        self.materialize(usab_id)
+        RankingEngine.remove_result(self, usab_id, *args)
+
+    def update_players(self, usab_ids):
+        usab_ids = list(usab_ids)
+        for usab_id in usab_ids:
+            self.materialize(usab_id)
+        return RankingEngine.update_players(self, usab_ids)
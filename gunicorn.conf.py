@@ -0,0 +1,20 @@
+# gunicorn.conf.py, picked up automatically by: gunicorn app:app
+#
+# One process per core, each serving requests from a pool of threads. Requests spend most
+# of their time in SQLite or waiting on the network, so threads keep the cores busy while
+# the read-only connection pool (SQLITE_POOL_SIZE, one connection per thread) serves them.
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = os.environ.get('WORKER_CLASS', 'gthread')
+# A live leaderboard stream opened here holds a thread, app.py opens at most MAX_LEADERBOARD_STREAMS (half of them
+# by default). Viewers are meant for the gevent workers of gunicorn_stream.conf.py
+threads = int(os.environ.get('THREADS', 8))
+keepalive = 5
+
+def post_worker_init(worker):
+    # Fill the caches and build the leaderboards before the worker accepts requests
+    from app import warm_up
+    warm_up()
@@ -0,0 +1,23 @@
+# gunicorn_stream.conf.py, for the live leaderboard streams: gunicorn -c gunicorn_stream.conf.py app:app
+#
+# Runs next to the server of gunicorn.conf.py, the reverse proxy sends /api/v1/ranks/stream here (see
+# README). gevent workers hold an open stream in a greenlet instead of a thread, so a worker keeps up to
+# worker_connections viewers open while its leaderboards are computed once for all of them.
+import multiprocessing
+import os
+
+bind = os.environ.get('STREAM_BIND', '0.0.0.0:8001')
+workers = int(os.environ.get('STREAM_WORKERS', max(1, multiprocessing.cpu_count() // 2)))
+worker_class = 'gevent'
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 1000))
+keepalive = 5
+# Streams never end on their own: on a restart, their browsers reconnect after a short wait instead of the default 30s
+graceful_timeout = 5
+
+# Read by app.py in the workers: every connection but a few can be a stream
+os.environ.setdefault('MAX_LEADERBOARD_STREAMS', str(max(1, worker_connections - 20)))
+
+def post_worker_init(worker):
+    # Fill the caches and build the leaderboards before the worker accepts requests
+    from app import warm_up
+    warm_up()
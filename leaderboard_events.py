@@ -0,0 +1,154 @@
+# leaderboard_events.py
+#
+# Server-sent events of the current leaderboards. A viewer subscribes to one leaderboard,
+# receives it in full once, then only the players whose scores changed (moved, added or
+# removed) when results are ingested or another snapshot is served. Every change is computed
+# and encoded once per process and the same message is queued for all viewers of the
+# leaderboard, so a viewer costs a queue instead of a query.
+import json
+import logging
+import queue
+import threading
+import time
+
+# Messages waiting for a viewer that does not read them, beyond this it is dropped (its browser reconnects)
+MAX_PENDING_MESSAGES = 100
+# Idle streams get a comment this often, so proxies keep them open and closed connections are noticed
+KEEPALIVE_SECONDS = 15
+# How often watched leaderboards are compared with the data, for ingests and snapshots of other workers
+POLL_SECONDS = 5
+# Browsers reconnect after this many milliseconds when a stream ends
+RETRY_MILLISECONDS = 3000
+# Retry-After of the viewers refused because the process already streams to max_subscribers,
+# streams closed by their viewers are noticed (and unsubscribed) at their next keepalive
+BUSY_RETRY_SECONDS = KEEPALIVE_SECONDS
+
+KEEPALIVE_MESSAGE = b': keepalive\n\n'
+
+logger = logging.getLogger(__name__)
+
+def format_event(event, payload):
+    return f'event: {event}\ndata: {json.dumps(payload, sort_keys=True, separators=(",", ":"))}\n\n'.encode()
+
+class Subscriber:
+    """Messages not yet sent to one viewer."""
+
+    def __init__(self):
+        self.messages = queue.Queue(MAX_PENDING_MESSAGES)
+        self.dropped = False
+
+class WatchedLeaderboard:
+    """Last state of a leaderboard sent to its viewers."""
+
+    def __init__(self):
+        self.signature = None
+        # usab_id -> scores
+        self.scores = {}
+        self.board_message = None
+        self.subscribers = set()
+
+class LeaderboardBroadcaster:
+    """Viewers of the leaderboards of this process, by (score_version, event_type, age_group).
+
+    load(key) returns (signature, entries) of the current leaderboard of key, entries as
+    returned by RankingEngine.get_page and signature changing whenever they may have.
+    A delta lists the players whose scores changed with their new rank: the ranks of the
+    other players shift accordingly, entries are ordered by decreasing scores then usab_id.
+    Every open stream holds a thread of the worker, so at most max_subscribers (None for
+    no limit) are open at once.
+    """
+
+    def __init__(self, load, poll_seconds=POLL_SECONDS, max_subscribers=None):
+        self.load = load
+        self.poll_seconds = poll_seconds
+        self.max_subscribers = max_subscribers
+        self.subscriber_count = 0
+        self.leaderboards = {}
+        self._lock = threading.Lock()
+        self._poller = None
+
+    def subscribe(self, key):
+        # New viewer of key, its first message is the whole leaderboard. None when there are already max_subscribers
+        subscriber = Subscriber()
+        with self._lock:
+            if self.max_subscribers is not None and self.subscriber_count >= self.max_subscribers:
+                return None
+            leaderboard = self.leaderboards.get(key)
+            if leaderboard is None:
+                leaderboard = WatchedLeaderboard()
+                self.refresh(key, leaderboard)
+                self.leaderboards[key] = leaderboard
+            subscriber.messages.put_nowait(leaderboard.board_message)
+            leaderboard.subscribers.add(subscriber)
+            self.subscriber_count += 1
+            # Threads do not survive the fork of gunicorn workers, so the poller starts with the first viewer
+            if self._poller is None:
+                self._poller = threading.Thread(target=self.poll, daemon=True)
+                self._poller.start()
+        return subscriber
+
+    def unsubscribe(self, key, subscriber):
+        # Called once per subscriber, when its stream is closed (also after it was dropped)
+        with self._lock:
+            self.subscriber_count -= 1
+            leaderboard = self.leaderboards.get(key)
+            if leaderboard is None:
+                return
+            leaderboard.subscribers.discard(subscriber)
+            if not leaderboard.subscribers:
+                del self.leaderboards[key]
+
+    def stream(self, subscriber):
+        # Body of the event stream of a viewer, until it is dropped or disconnects
+        yield f'retry: {RETRY_MILLISECONDS}\n\n'.encode()
+        while not subscriber.dropped:
+            try:
+                yield subscriber.messages.get(timeout=KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield KEEPALIVE_MESSAGE
+
+    def refresh(self, key, leaderboard):
+        # Reload a leaderboard whose signature changed, returns the delta message (None when nothing changed)
+        signature, entries = self.load(key)
+        if signature == leaderboard.signature and leaderboard.board_message is not None:
+            return None
+        _, event_type, age_group = key
+        scores = {entry['usab_id']: entry['scores'] for entry in entries}
+        moved = [entry for entry in entries if entry['usab_id'] in leaderboard.scores and leaderboard.scores[entry['usab_id']] != entry['scores']]
+        added = [entry for entry in entries if entry['usab_id'] not in leaderboard.scores]
+        removed = sorted(usab_id for usab_id in leaderboard.scores if usab_id not in scores)
+        first_load = leaderboard.board_message is None
+
+        leaderboard.signature = signature
+        if not first_load and not (moved or added or removed):
+            return None
+        leaderboard.scores = scores
+        leaderboard.board_message = format_event('leaderboard', {'event_type': event_type, 'age_group': age_group, 'leaderboard': entries})
+        if first_load:
+            return None
+        return format_event('delta', {'event_type': event_type, 'age_group': age_group, 'size': len(entries),
+                                      'moved': moved, 'added': added, 'removed': removed})
+
+    def publish(self):
+        # Send the changes of every watched leaderboard since they were last sent
+        with self._lock:
+            for key, leaderboard in self.leaderboards.items():
+                try:
+                    message = self.refresh(key, leaderboard)
+                except Exception:
+                    logger.exception('could not refresh leaderboard %s', key)
+                    continue
+                if message is None:
+                    continue
+                for subscriber in list(leaderboard.subscribers):
+                    try:
+                        subscriber.messages.put_nowait(message)
+                    except queue.Full:
+                        subscriber.dropped = True
+                        leaderboard.subscribers.discard(subscriber)
+
+    def poll(self):
+        while True:
+            time.sleep(self.poll_seconds)
+            if self.leaderboards:
+                self.publish()
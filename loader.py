@@ -0,0 +1,240 @@
+# loader.py
+#
+# Bulk import of tournament result exports into tournament.db.
+#
+# Every input row is one performance of one player, with the tournament and the
+# player repeated on each row:
+#   tournament_id, tournament_name, tournament_type, description, location, start_date, end_date,
+#   tournament_player_id, usab_id, player_name, age_group, event_type, standing_level[, birth_year, gender]
+#
+# Usage: python loader.py [--db tournament.db] [--batch-size N] [--strict] results.csv more_results.ndjson ...
+import argparse
+import csv
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+from datetime import date
+from itertools import islice
+
+from cache_backend import bump_generation
+from schema import (ALL_AGE_GROUPS, ALL_EVENT_TYPES, DATE_PATTERN, MAX_SQLITE_INTEGER, MIN_SQLITE_INTEGER, database_write_lock,
+                    has_player_tournament_score, refresh_tournament_scores)
+
+DEFAULT_DATABASE_PATH = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'tournament.db')
+DEFAULT_BATCH_SIZE = 50000
+
+TOURNAMENT_FIELDS = ('tournament_id', 'tournament_name', 'tournament_type', 'description', 'location', 'start_date', 'end_date')
+
+INSERT_TOURNAMENT_SQL = """
+    INSERT OR REPLACE INTO tournament (tournament_id, tournament_name, tournament_type, description, location, start_date, end_date)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+INSERT_USAB_PLAYER_SQL = """
+    INSERT INTO usab_player (usab_id, player_name, birth_year, gender) VALUES (?, ?, ?, ?)
+    ON CONFLICT(usab_id) DO UPDATE SET player_name = excluded.player_name,
+    birth_year = COALESCE(excluded.birth_year, usab_player.birth_year), gender = COALESCE(excluded.gender, usab_player.gender)
+"""
+INSERT_TOURNAMENT_PLAYER_SQL = """
+    INSERT OR REPLACE INTO tournament_player (tournament_id, tournament_player_id, player_name, usab_id) VALUES (?, ?, ?, ?)
+"""
+INSERT_PERFORMANCE_SQL = """
+    INSERT OR REPLACE INTO tournament_player_performance (tournament_id, tournament_player_id, age_group, event_type, standing_level)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+logger = logging.getLogger(__name__)
+
+class InvalidRowError(ValueError):
+    pass
+
+def read_rows(path):
+    # Yield (path, line number, row dict) without loading the whole file
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, newline='', encoding='utf-8') as file:
+        if extension == '.csv':
+            for line_number, row in enumerate(csv.DictReader(file), start=2):
+                yield path, line_number, row
+        elif extension in ('.ndjson', '.jsonl'):
+            for line_number, line in enumerate(file, start=1):
+                if line.strip():
+                    # A malformed line is one rejected row, not the end of the file
+                    try:
+                        row = json.loads(line)
+                    except ValueError as e:
+                        row = InvalidRowError(f'invalid JSON: {e}')
+                    yield path, line_number, row
+        elif extension == '.json':
+            for index, row in enumerate(json.load(file)):
+                yield path, index + 1, row
+        else:
+            raise ValueError(f'Unsupported file type: {path}')
+
+def read_all_rows(paths):
+    for path in paths:
+        yield from read_rows(path)
+
+def optional_int(value):
+    if value is None or value == '':
+        return None
+    return int(value)
+
+def validate_tournament(tournament, valid_tournaments):
+    # Tournament columns repeat on every row, check each distinct tournament only once
+    try:
+        seen = tournament in valid_tournaments
+    except TypeError:
+        # A list or an object in a JSON row
+        raise InvalidRowError('invalid tournament columns')
+    if not seen:
+        if not all(isinstance(value, str) for value in tournament[:3]):
+            raise InvalidRowError('invalid tournament_id, tournament_name or tournament_type')
+        for day in tournament[5:]:
+            # null (None) in JSON rows
+            if not isinstance(day, str) or not DATE_PATTERN.fullmatch(day):
+                raise InvalidRowError(f'invalid date {day!r}')
+            date.fromisoformat(day)
+        valid_tournaments.add(tournament)
+
+def validate_row(row, score_keys, valid_tournaments):
+    # score_keys: the (tournament_type, age_group, standing_level) of the score table
+    if isinstance(row, InvalidRowError):
+        raise row
+    try:
+        tournament = tuple(row[field] for field in TOURNAMENT_FIELDS)
+        tournament_player_id = int(row['tournament_player_id'])
+        usab_id = int(row['usab_id'] or 0)
+        player_name = row['player_name']
+        age_group = row['age_group'].upper()
+        event_type = row['event_type'].upper()
+        standing_level = row['standing_level']
+        birth_year = optional_int(row.get('birth_year'))
+        gender = row.get('gender') or None
+    except KeyError as e:
+        raise InvalidRowError(f'missing column {e}')
+    except (TypeError, ValueError, AttributeError) as e:
+        raise InvalidRowError(str(e))
+
+    for name, value in (('tournament_player_id', tournament_player_id), ('usab_id', usab_id), ('birth_year', birth_year)):
+        if value is not None and not MIN_SQLITE_INTEGER <= value <= MAX_SQLITE_INTEGER:
+            raise InvalidRowError(f'{name} {value} out of range')
+
+    if not isinstance(player_name, str) or not isinstance(standing_level, str):
+        raise InvalidRowError('player_name and standing_level must be strings')
+    if age_group not in ALL_AGE_GROUPS:
+        raise InvalidRowError(f'invalid age_group {age_group!r}')
+    if event_type not in ALL_EVENT_TYPES:
+        raise InvalidRowError(f'invalid event_type {event_type!r}')
+    validate_tournament(tournament, valid_tournaments)
+    # Same rows as the score table joins: a standing level is only scored for some tournament types and age groups
+    if (tournament[2], age_group, standing_level) not in score_keys:
+        raise InvalidRowError(f'invalid standing_level {standing_level!r} for {tournament[2]!r} {age_group}')
+    if gender not in (None, 'F', 'M'):
+        raise InvalidRowError(f'invalid gender {gender!r}')
+
+    return tournament, (usab_id, player_name, birth_year, gender), tournament_player_id, (age_group, event_type, standing_level)
+
+def validate_rows(rows, score_keys, stats, strict=False):
+    valid_tournaments = set()
+    for path, line_number, row in rows:
+        stats['read'] += 1
+        try:
+            yield validate_row(row, score_keys, valid_tournaments)
+        except (InvalidRowError, ValueError) as e:
+            if strict:
+                raise InvalidRowError(f'{path}:{line_number}: {e}')
+            stats['rejected'] += 1
+            logger.warning('Skipping %s:%d: %s', path, line_number, e)
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def write_batch(connection, batch, seen_tournaments, seen_usab_players):
+    tournaments = []
+    usab_players = []
+    tournament_players = {}
+    performances = []
+    for tournament, usab_player, tournament_player_id, performance in batch:
+        tournament_id = tournament[0]
+        if tournament_id not in seen_tournaments:
+            seen_tournaments.add(tournament_id)
+            tournaments.append(tournament)
+        usab_id = usab_player[0]
+        if usab_id != 0 and usab_id not in seen_usab_players:
+            seen_usab_players.add(usab_id)
+            usab_players.append(usab_player)
+        tournament_players[(tournament_id, tournament_player_id)] = (tournament_id, tournament_player_id, usab_player[1], usab_id)
+        performances.append((tournament_id, tournament_player_id) + performance)
+
+    connection.executemany(INSERT_TOURNAMENT_SQL, tournaments)
+    connection.executemany(INSERT_USAB_PLAYER_SQL, usab_players)
+    connection.executemany(INSERT_TOURNAMENT_PLAYER_SQL, tournament_players.values())
+    connection.executemany(INSERT_PERFORMANCE_SQL, performances)
+
+def load_results(paths, database_path=DEFAULT_DATABASE_PATH, batch_size=DEFAULT_BATCH_SIZE, strict=False):
+    stats = {'read': 0, 'rejected': 0, 'loaded': 0, 'seconds': 0.0}
+    start = time.perf_counter()
+    connection = sqlite3.connect(database_path, isolation_level=None)
+    try:
+        # WAL (kept, the database is served in WAL mode, see schema.migrate) and no fsync while loading,
+        # the whole load is a single transaction anyway
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=OFF')
+        connection.execute('PRAGMA cache_size=-65536')
+        connection.execute('PRAGMA temp_store=MEMORY')
+
+        score_keys = {tuple(row) for row in connection.execute('SELECT DISTINCT tournament_type, age_group, standing_level FROM score')}
+        seen_tournaments = set()
+        seen_usab_players = set()
+
+        # Held until every worker is told to drop its cached data (see schema.py). A load can change any
+        # number of tournaments, so it bumps the generation instead of writing to the ingest log
+        with database_write_lock(database_path):
+            connection.execute('BEGIN')
+            try:
+                for batch in batched(validate_rows(read_all_rows(paths), score_keys, stats, strict), batch_size):
+                    write_batch(connection, batch, seen_tournaments, seen_usab_players)
+                    stats['loaded'] += len(batch)
+                if has_player_tournament_score(connection):
+                    refresh_tournament_scores(connection, seen_tournaments)
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            finally:
+                connection.execute('PRAGMA synchronous=FULL')
+            # Make every worker drop its cached data
+            bump_generation(database_path + '.generation')
+    finally:
+        connection.close()
+    stats['seconds'] = time.perf_counter() - start
+    return stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk load tournament result exports (CSV, JSON or NDJSON) into tournament.db')
+    parser.add_argument('files', nargs='+', help='result files to load')
+    parser.add_argument('--db', default=DEFAULT_DATABASE_PATH, help='SQLite database to load into')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='rows per executemany batch')
+    parser.add_argument('--strict', action='store_true', help='stop at the first invalid row instead of skipping it')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+    try:
+        stats = load_results(args.files, args.db, args.batch_size, args.strict)
+    except (InvalidRowError, OSError, ValueError) as e:
+        print(f'Load failed, nothing was written: {e}', file=sys.stderr)
+        return 1
+
+    rows_per_second = stats['loaded'] / stats['seconds'] if stats['seconds'] else 0
+    print(f"Loaded {stats['loaded']} rows ({stats['rejected']} rejected) in {stats['seconds']:.2f}s, {rows_per_second:,.0f} rows/s")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
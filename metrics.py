@@ -0,0 +1,128 @@
+# metrics.py
+#
+# In-process request metrics rendered in the Prometheus text format: request counts and
+# latency per route, time spent per phase of a request (cache lookups, SQL, serialization
+# and the Python processing in between) and cache hits and misses per cache key family.
+import re
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+from flask import g, has_app_context
+
+# Request latency histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Phases timed explicitly, the rest of the request time is reported as processing
+PHASES = ('cache', 'db', 'serialize')
+
+# Cache keys holding an id and the family they are counted under, ids are any string (tournament ids
+# can hold letters, dashes and underscores). Every other cache key is a fixed name, its own family
+KEY_FAMILIES = [
+    (re.compile(r'usab_player_.+_performance_list'), 'usab_player_{id}_performance_list'),
+    (re.compile(r'tournament_.+_players_list'), 'tournament_{id}_players_list'),
+    (re.compile(r'tournament_.+_performance_list'), 'tournament_{id}_performance_list'),
+    (re.compile(r'score_dict_v.+'), 'score_dict_v{version}'),
+    (re.compile(r'response_.+'), 'response_{etag}'),
+]
+
+def cache_key_family(key):
+    for pattern, family in KEY_FAMILIES:
+        if pattern.fullmatch(key):
+            return family
+    return key
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metrics:
+    """Counters and histograms of one process, keyed by metric name and a tuple of (label, value) pairs.
+
+    Each gunicorn worker keeps its own, so a scrape of /metrics reports the worker that answered it.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._descriptions = {}
+        self._counters = {}
+        self._histograms = {}
+
+    def describe(self, name, metric_type, description):
+        self._descriptions[name] = (metric_type, description)
+
+    def inc(self, name, labels=(), value=1):
+        with self._lock:
+            self._counters[(name, labels)] = self._counters.get((name, labels), 0) + value
+
+    def observe(self, name, labels, value):
+        with self._lock:
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                # One count per bucket, then the sum and the count of all observations
+                histogram = self._histograms[(name, labels)] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[index] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def get(self, name, labels=()):
+        return self._counters.get((name, labels), 0)
+
+    def render(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+
+        lines = []
+        described = set()
+        def describe(name):
+            if name not in described and name in self._descriptions:
+                described.add(name)
+                metric_type, description = self._descriptions[name]
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} {metric_type}')
+
+        for (name, labels), value in counters:
+            describe(name)
+            lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+        for (name, labels), histogram in histograms:
+            describe(name)
+            for bound, count in zip(self.buckets, histogram):
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", bound),))} {count}')
+            lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {histogram[-1]}')
+            lines.append(f'{name}_sum{format_labels(labels)} {format_value(histogram[-2])}')
+            lines.append(f'{name}_count{format_labels(labels)} {histogram[-1]}')
+        return '\n'.join(lines) + '\n'
+
+def start_request_timing():
+    g.request_start = perf_counter()
+    g.phase_seconds = dict.fromkeys(PHASES, 0.0)
+
+@contextmanager
+def timed_phase(phase):
+    # Adds the time spent in the block to the phase of the current request, if there is one
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        phase_seconds = g.get('phase_seconds') if has_app_context() else None
+        if phase_seconds is not None:
+            phase_seconds[phase] += perf_counter() - start
+
+def finish_request_timing():
+    # Returns (total seconds, seconds per phase) of the current request, None if it was not timed
+    request_start = g.get('request_start')
+    if request_start is None:
+        return None
+    total = perf_counter() - request_start
+    phase_seconds = dict(g.phase_seconds)
+    phase_seconds['processing'] = max(0.0, total - sum(phase_seconds.values()))
+    return total, phase_seconds
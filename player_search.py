@@ -0,0 +1,138 @@
+# player_search.py
+#
+# In-memory index of player names for type-ahead search. Every name (the USAB name of a
+# player and the names they were entered under in tournaments) is split into tokens kept
+# in one sorted list for prefix matches, and into trigrams kept in an inverted index for
+# fuzzy matches. Names are added in place, so the index never has to be rebuilt on ingest.
+import unicodedata
+from bisect import bisect_left, insort
+from collections import Counter
+from itertools import chain
+
+# Fuzzy matches share at least this fraction of their trigrams with the query (Jaccard similarity)
+MIN_SIMILARITY = 0.3
+# Shorter queries only match prefixes, they share a trigram with too many names
+MIN_FUZZY_QUERY_LENGTH = 3
+
+# Match kinds, best first
+EXACT_MATCH = 'exact'
+PREFIX_MATCH = 'prefix'
+FUZZY_MATCH = 'fuzzy'
+MATCH_ORDER = {EXACT_MATCH: 0, PREFIX_MATCH: 1, FUZZY_MATCH: 2}
+
+def normalize_name(name):
+    # Lower case letters and digits without accents, anything else separates tokens
+    decomposed = unicodedata.normalize('NFKD', name or '')
+    characters = [character if character.isalnum() else ' ' for character in decomposed.lower() if not unicodedata.combining(character)]
+    return ' '.join(''.join(characters).split())
+
+def get_trigrams(normalized_name):
+    # Trigrams of every token padded like pg_trgm, so the start of a token weighs more than its end
+    trigrams = set()
+    for token in normalized_name.split():
+        padded = f'  {token} '
+        trigrams.update(padded[index:index + 3] for index in range(len(padded) - 2))
+    return trigrams
+
+class PlayerSearchIndex:
+    """Prefix and trigram index of player names, keyed by (usab_id, normalized name)."""
+
+    def __init__(self):
+        # usab_id -> {normalized name: name as given}
+        self.names = {}
+        # Sorted (token, usab_id, normalized name) of every name
+        self.tokens = []
+        # trigram -> set of (usab_id, normalized name)
+        self.trigrams = {}
+        # (usab_id, normalized name) -> trigrams of the name
+        self.name_trigrams = {}
+
+    def index_name(self, usab_id, player_name):
+        # Returns the new token entries of the name, None when it is already indexed or empty
+        normalized = normalize_name(player_name)
+        player_names = self.names.setdefault(usab_id, {})
+        if not normalized or normalized in player_names:
+            return None
+        player_names[normalized] = player_name
+        key = (usab_id, normalized)
+        trigrams = self.name_trigrams[key] = frozenset(get_trigrams(normalized))
+        for trigram in trigrams:
+            self.trigrams.setdefault(trigram, set()).add(key)
+        return [(token, usab_id, normalized) for token in set(normalized.split())]
+
+    def build(self, names):
+        # names: (usab_id, player_name) rows, sorted once at the end
+        for usab_id, player_name in names:
+            self.tokens.extend(self.index_name(usab_id, player_name) or ())
+        self.tokens.sort()
+        return self
+
+    def add(self, usab_id, player_name):
+        # Index one more name of a player, returns whether it was new
+        entries = self.index_name(usab_id, player_name)
+        if entries is None:
+            return False
+        for entry in entries:
+            insort(self.tokens, entry)
+        return True
+
+    def get_prefix_keys(self, prefix):
+        # (usab_id, normalized name) of the names with a token starting with prefix
+        start = bisect_left(self.tokens, (prefix,))
+        keys = set()
+        for index in range(start, len(self.tokens)):
+            token, usab_id, normalized = self.tokens[index]
+            if not token.startswith(prefix):
+                break
+            keys.add((usab_id, normalized))
+        return keys
+
+    def get_similarity(self, query_trigrams, key, shared=None):
+        name_trigrams = self.name_trigrams[key]
+        if shared is None:
+            shared = len(query_trigrams & name_trigrams)
+        return shared / (len(query_trigrams) + len(name_trigrams) - shared)
+
+    def search(self, query, limit):
+        # Best match of each player, as (usab_id, name as given, match kind, similarity): exact matches first,
+        # then names with a token starting with every query token (names starting with the query first),
+        # then fuzzy matches, each by decreasing trigram similarity
+        normalized_query = normalize_name(query)
+        if not normalized_query or limit <= 0:
+            return []
+        query_tokens = normalized_query.split()
+        query_trigrams = get_trigrams(normalized_query)
+
+        best = {}
+        def consider(key, match, similarity):
+            usab_id, normalized = key
+            rank_key = (MATCH_ORDER[match], not normalized.startswith(normalized_query), -similarity, normalized)
+            if usab_id not in best or rank_key < best[usab_id][0]:
+                best[usab_id] = (rank_key, normalized, match, similarity)
+
+        # Candidates from the longest query token, the others only filter them
+        longest = max(query_tokens, key=len)
+        for key in self.get_prefix_keys(longest):
+            if len(query_tokens) > 1:
+                name_tokens = key[1].split()
+                if not all(any(token.startswith(query_token) for token in name_tokens) for query_token in query_tokens):
+                    continue
+            match = EXACT_MATCH if key[1] == normalized_query else PREFIX_MATCH
+            consider(key, match, self.get_similarity(query_trigrams, key))
+
+        # Misspelled names only when there are not enough prefix matches
+        if len(best) < limit and len(normalized_query) >= MIN_FUZZY_QUERY_LENGTH:
+            prefix_usab_ids = set(best)
+            shared_counts = Counter(chain.from_iterable(self.trigrams.get(trigram, ()) for trigram in query_trigrams))
+            # A name sharing fewer trigrams cannot reach MIN_SIMILARITY, however short it is
+            min_shared = MIN_SIMILARITY * len(query_trigrams)
+            for key, shared in shared_counts.items():
+                if shared < min_shared or key[0] in prefix_usab_ids:
+                    continue
+                similarity = self.get_similarity(query_trigrams, key, shared)
+                if similarity >= MIN_SIMILARITY:
+                    consider(key, FUZZY_MATCH, similarity)
+
+        ranked = sorted(best.items(), key=lambda item: (item[1][0], item[0]))[:limit]
+        return [(usab_id, self.names[usab_id][normalized], match, round(similarity, 3))
+                for usab_id, (_, normalized, match, similarity) in ranked]
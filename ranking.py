@@ -0,0 +1,407 @@
+# ranking.py
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from copy import copy
+from datetime import date
+import heapq
+import threading
+
+# Only the best results of a player in an event count towards the ranking
+TOP_RESULTS_PER_EVENT = 4
+
+# Leaderboards with more changes than this are re-sorted instead of edited entry by entry
+MAX_INCREMENTAL_CHANGES = 64
+
+# Ranking points of a standing level that a score version does not score
+MISSING_POINTS = -1
+
+def age_group_limit(age_group):
+    # 'U15' -> 15
+    return int(age_group[1:])
+
+def one_year_before(day):
+    # Same as SQLite Date(day, '-1 year'): Feb 29 rolls over to Mar 1
+    try:
+        return day.replace(year=day.year - 1)
+    except ValueError:
+        return day.replace(year=day.year - 1, month=3, day=1)
+
+class ScoreTable:
+    """Ranking points of every score version, one dense array per version.
+
+    Each (tournament_type, age_group, standing_level) is coded as an integer once,
+    so scoring a result under any version is an index into a flat array, and the
+    same coded results can be ranked under every version.
+    """
+
+    def __init__(self, all_version_score_dict):
+        keys = {key for score_dict in all_version_score_dict.values() for key in score_dict}
+        self.tournament_type_codes = {value: code for code, value in enumerate(sorted({key[0] for key in keys}))}
+        self.age_group_codes = {value: code for code, value in enumerate(sorted({key[1] for key in keys}))}
+        self.standing_level_codes = {value: code for code, value in enumerate(sorted({key[2] for key in keys}))}
+        size = len(self.tournament_type_codes) * len(self.age_group_codes) * len(self.standing_level_codes)
+        # (tournament_type, age_group, standing_level) -> code, for every combination of known values
+        self.codes = {}
+        for tournament_type, tournament_type_code in self.tournament_type_codes.items():
+            for age_group, age_group_code in self.age_group_codes.items():
+                for standing_level, standing_level_code in self.standing_level_codes.items():
+                    self.codes[(tournament_type, age_group, standing_level)] = (
+                        (tournament_type_code * len(self.age_group_codes) + age_group_code) * len(self.standing_level_codes) + standing_level_code)
+        # score version -> ranking points by code
+        self.points = {}
+        for version, score_dict in all_version_score_dict.items():
+            points = array('l', [MISSING_POINTS]) * size
+            for key, ranking_points in score_dict.items():
+                points[self.get_code(*key)] = ranking_points
+            self.points[version] = points
+
+    def get_code(self, tournament_type, age_group, standing_level):
+        # None when no version scores this tournament type, age group or standing level
+        return self.codes.get((tournament_type, age_group, standing_level))
+
+    def encode(self, performances):
+        # (usab_id, tournament_id, end_date, tournament_type, age_group, event_type, standing_level) rows
+        # to (usab_id, tournament_id, end_date, score code, age_group, event_type)
+        codes = self.codes
+        for usab_id, tournament_id, end_date, tournament_type, age_group, event_type, standing_level in performances:
+            yield usab_id, tournament_id, end_date, codes.get((tournament_type, age_group, standing_level)), age_group, event_type
+
+class RankingEngine:
+    """In-memory leaderboards for every event type and age group.
+
+    Each leaderboard is a list of (-total_score, usab_id) tuples kept in sorted
+    order, so a page of rankings is a plain slice and a single player can be
+    repositioned with bisect instead of re-sorting.
+    """
+
+    def __init__(self, score_table, score_version, age_groups, event_types, as_of=None):
+        self.score_table = score_table
+        self.score_version = score_version
+        self.points = score_table.points[score_version]
+        self.age_groups = sorted(age_groups, key=age_group_limit)
+        self.event_types = sorted(event_types)
+        self.as_of = as_of or date.today()
+        self.min_end_date = str(one_year_before(self.as_of))
+        # Rankings of a past day leave out the results that came after it, today's keep them all
+        self.max_end_date = None if as_of is None else str(as_of)
+        # usab_id -> (player_name, birth_year)
+        self.players = {}
+        # usab_id -> event_type -> (tournament_id, age_group) -> (age limit, ranking points)
+        self.results = {}
+        # (usab_id, event_type, age_group) -> total score currently on the leaderboard
+        self.totals = {}
+        self.leaderboards = {(event_type, age_group): [] for event_type in self.event_types for age_group in self.age_groups}
+
+    def build(self, players, coded_performances):
+        # players: iterable of (usab_id, player_name, birth_year)
+        # coded_performances: iterable of (usab_id, tournament_id, end_date, score code, age_group, event_type), see ScoreTable.encode
+        for usab_id, player_name, birth_year in players:
+            self.players[usab_id] = (player_name, birth_year)
+
+        for performance in coded_performances:
+            self.add_coded_result(*performance)
+
+        for usab_id in self.results:
+            for key, total in self.compute_player_totals(usab_id).items():
+                self.totals[(usab_id,) + key] = total
+                self.leaderboards[key].append((-total, usab_id))
+
+        for leaderboard in self.leaderboards.values():
+            leaderboard.sort()
+        return self
+
+    def add_result(self, usab_id, tournament_id, end_date, tournament_type, age_group, event_type, standing_level):
+        score_code = self.score_table.get_code(tournament_type, age_group, standing_level)
+        return self.add_coded_result(usab_id, tournament_id, end_date, score_code, age_group, event_type)
+
+    def add_coded_result(self, usab_id, tournament_id, end_date, score_code, age_group, event_type):
+        # Keep the same rows as the usab_player_tournament_score view
+        end_date = str(end_date)
+        if usab_id not in self.players or end_date < self.min_end_date:
+            return False
+        if self.max_end_date is not None and end_date > self.max_end_date:
+            return False
+        if score_code is None:
+            return False
+        ranking_points = self.points[score_code]
+        if ranking_points == MISSING_POINTS:
+            return False
+        player_events = self.results.setdefault(usab_id, {})
+        player_events.setdefault(event_type, {})[(tournament_id, age_group)] = (age_group_limit(age_group), ranking_points)
+        return True
+
+    def remove_results(self, usab_id, tournament_id):
+        for event_results in self.results.get(usab_id, {}).values():
+            for key in [key for key in event_results if key[0] == tournament_id]:
+                del event_results[key]
+
+    def remove_result(self, usab_id, tournament_id, age_group, event_type):
+        self.results.get(usab_id, {}).get(event_type, {}).pop((tournament_id, age_group), None)
+
+    def compute_player_totals(self, usab_id):
+        # Sum of the best results played in the age group or younger, for every age group the player is eligible for
+        totals = {}
+        birth_year = self.players[usab_id][1]
+        # Players without a known birth year (NULL or '') are never eligible
+        if not isinstance(birth_year, int):
+            return totals
+        player_age = self.as_of.year - birth_year
+        for event_type, event_results in self.results.get(usab_id, {}).items():
+            # Walk the results from the youngest age group up, keeping the best points seen so far in a min-heap
+            results = sorted(event_results.values())
+            best_points = []
+            index = 0
+            for age_group in self.age_groups:
+                limit = age_group_limit(age_group)
+                while index < len(results) and results[index][0] <= limit:
+                    if len(best_points) < TOP_RESULTS_PER_EVENT:
+                        heapq.heappush(best_points, results[index][1])
+                    else:
+                        heapq.heappushpop(best_points, results[index][1])
+                    index += 1
+                if best_points and player_age < limit:
+                    totals[(event_type, age_group)] = sum(best_points)
+        return totals
+
+    def update_player(self, usab_id):
+        # Reposition one player on every leaderboard after their results changed
+        return self.update_players([usab_id])
+
+    def update_players(self, usab_ids):
+        # Reposition players on every leaderboard after their results changed, returns the changed leaderboards
+        removed = {}
+        added = {}
+        for usab_id in usab_ids:
+            new_totals = self.compute_player_totals(usab_id) if usab_id in self.players else {}
+            # A player is only ranked in the events they have results in
+            for key in [(event_type, age_group) for event_type in self.results.get(usab_id, {}) for age_group in self.age_groups]:
+                old_total = self.totals.get((usab_id,) + key)
+                new_total = new_totals.get(key)
+                if old_total == new_total:
+                    continue
+                if old_total is not None:
+                    removed.setdefault(key, set()).add((-old_total, usab_id))
+                    del self.totals[(usab_id,) + key]
+                if new_total is not None:
+                    added.setdefault(key, []).append((-new_total, usab_id))
+                    self.totals[(usab_id,) + key] = new_total
+
+        changed = removed.keys() | added.keys()
+        for key in changed:
+            key_removed = removed.get(key, set())
+            key_added = added.get(key, [])
+            # Leaderboards are never edited in place: an updated copy is swapped in, so readers holding
+            # the previous list keep a consistent one
+            if len(key_removed) + len(key_added) <= MAX_INCREMENTAL_CHANGES:
+                leaderboard = list(self.leaderboards[key])
+                for entry in key_removed:
+                    del leaderboard[bisect_left(leaderboard, entry)]
+                for entry in key_added:
+                    insort(leaderboard, entry)
+            else:
+                # Sorting the still sorted entries followed by the new ones is a single merge
+                leaderboard = sorted([entry for entry in self.leaderboards[key] if entry not in key_removed] + key_added)
+            self.leaderboards[key] = leaderboard
+        return changed
+
+    def get_rank(self, usab_id, event_type, age_group):
+        # (total score, rank) of a player on one leaderboard, None when not ranked
+        total = self.totals.get((usab_id, event_type, age_group))
+        if total is None:
+            return None
+        return total, bisect_left(self.leaderboards[(event_type, age_group)], (-total, usab_id)) + 1
+
+    def copy(self):
+        # Independent engine in the same state, that can be moved without holding up this one
+        engine = RankingEngine(self.score_table, self.score_version, self.age_groups, self.event_types, self.as_of)
+        engine.min_end_date = self.min_end_date
+        engine.max_end_date = self.max_end_date
+        engine.players = self.players
+        engine.results = {usab_id: {event_type: dict(event_results) for event_type, event_results in player_events.items()}
+                          for usab_id, player_events in self.results.items()}
+        engine.totals = dict(self.totals)
+        # Leaderboards are swapped, never edited in place (see update_players), so the lists can be shared
+        engine.leaderboards = dict(self.leaderboards)
+        return engine
+
+    def snapshot(self):
+        # Copy of the leaderboards for reading while this engine keeps changing
+        engine = RankingEngine(self.score_table, self.score_version, self.age_groups, self.event_types, self.as_of)
+        engine.players = self.players
+        engine.leaderboards = {key: list(leaderboard) for key, leaderboard in self.leaderboards.items()}
+        return engine
+
+    def get_size(self, event_type, age_group):
+        return len(self.leaderboards[(event_type, age_group)])
+
+    def get_page(self, event_type, age_group, offset=0, limit=None):
+        return self.get_page_and_size(event_type, age_group, offset, limit)[0]
+
+    def get_page_and_size(self, event_type, age_group, offset=0, limit=None):
+        # A page and the size of the leaderboard it was taken from, consistent with each other during an update
+        leaderboard = self.leaderboards[(event_type, age_group)]
+        end = len(leaderboard) if limit is None else offset + limit
+        return self.get_entries(leaderboard[offset:end], offset), len(leaderboard)
+
+    def get_entries(self, leaderboard_slice, offset):
+        return [{'usab_id': usab_id, 'player_name': self.players[usab_id][0], 'scores': -negative_total, 'rank': offset + index + 1}
+                for index, (negative_total, usab_id) in enumerate(leaderboard_slice)]
+
+    def iter_pages(self, event_type, age_group, page_size):
+        # The whole leaderboard, page by page, as it was when the first page was taken (updates swap in a new list)
+        leaderboard = self.leaderboards[(event_type, age_group)]
+        for offset in range(0, len(leaderboard), page_size):
+            yield self.get_entries(leaderboard[offset:offset + page_size], offset)
+
+def range_difference(first, second):
+    # Parts of the index range first = (start, end) that are not in the range second
+    start, end = first
+    parts = [(start, min(end, second[0])), (max(start, second[1]), end)]
+    return [(part_start, part_end) for part_start, part_end in parts if part_start < part_end]
+
+class RankingHistory:
+    """Every scored result ordered by end date, to rank players as of any day.
+
+    One engine per score version is moved from day to day by sliding its one year
+    window: the results entering and leaving the window are added and removed and
+    only those players are repositioned. Engines handed out are snapshots of them,
+    the most recently used ones are kept. Player histories walk a private copy.
+    Ingested results replace the sorted results (never edited in place) and are
+    applied to the engines like a slide.
+    """
+
+    def __init__(self, score_table, age_groups, event_types, max_snapshots=16):
+        self.score_table = score_table
+        self.age_groups = age_groups
+        self.event_types = event_types
+        self.max_snapshots = max_snapshots
+        self.players = {}
+        # (end_date, usab_id, tournament_id, score code, age_group, event_type) sorted by end date
+        self.results = []
+        self.end_dates = []
+        # score version -> engine, (score version, day) -> snapshot
+        self.engines = {}
+        self.snapshots = OrderedDict()
+        self.lock = threading.Lock()
+
+    def build(self, players, coded_performances):
+        # Same arguments as RankingEngine.build, performances of any date
+        for usab_id, player_name, birth_year in players:
+            self.players[usab_id] = (player_name, birth_year)
+        for usab_id, tournament_id, end_date, score_code, age_group, event_type in coded_performances:
+            # Unknown players and standings that no version scores never count
+            if usab_id in self.players and score_code is not None:
+                self.results.append((str(end_date), usab_id, tournament_id, score_code, age_group, event_type))
+        self.results.sort()
+        self.end_dates = [result[0] for result in self.results]
+        return self
+
+    def replace_results(self, tournament_id, usab_ids, coded_performances):
+        # Replace the results of players at a tournament by their current ones (see RankingEngine.build for
+        # coded_performances). The engines get the same change, snapshots of the days it touches are dropped
+        usab_ids = set(usab_ids)
+        added = [(str(end_date), usab_id, tournament_id, score_code, age_group, event_type)
+                 for usab_id, _, end_date, score_code, age_group, event_type in coded_performances
+                 if usab_id in usab_ids and usab_id in self.players and score_code is not None]
+        with self.lock:
+            removed = [result for result in self.results if result[2] == tournament_id and result[1] in usab_ids]
+            if not removed and not added:
+                return
+            results = [result for result in self.results if result[2] != tournament_id or result[1] not in usab_ids] if removed else list(self.results)
+            results.extend(added)
+            results.sort()
+            self.results, self.end_dates = results, [result[0] for result in results]
+
+            for engine in self.engines.values():
+                for usab_id in usab_ids:
+                    engine.remove_results(usab_id, tournament_id)
+                for end_date, usab_id, _, score_code, age_group, event_type in added:
+                    engine.add_coded_result(usab_id, tournament_id, end_date, score_code, age_group, event_type)
+                engine.update_players(usab_ids)
+            end_dates = {result[0] for result in removed + added}
+            for key in list(self.snapshots):
+                day = key[1]
+                if any(str(one_year_before(day)) <= end_date <= str(day) for end_date in end_dates):
+                    del self.snapshots[key]
+
+    def get_window(self, as_of):
+        # Index range of the results between one year before as_of and as_of
+        return (bisect_left(self.end_dates, str(one_year_before(as_of))), bisect_right(self.end_dates, str(as_of)))
+
+    def build_engine(self, as_of, score_version):
+        start, end = self.get_window(as_of)
+        players = ((usab_id, player_name, birth_year) for usab_id, (player_name, birth_year) in self.players.items())
+        performances = ((usab_id, tournament_id, end_date, score_code, age_group, event_type)
+                        for end_date, usab_id, tournament_id, score_code, age_group, event_type in self.results[start:end])
+        return RankingEngine(self.score_table, score_version, self.age_groups, self.event_types, as_of).build(players, performances)
+
+    def move_to(self, as_of, score_version):
+        # Slide the shared engine of a score version to as_of, must be called with the lock held
+        engine = self.engines.get(score_version)
+        if engine is None:
+            engine = self.engines[score_version] = self.build_engine(as_of, score_version)
+            return engine
+        return self.slide(engine, as_of)
+
+    def slide(self, engine, as_of):
+        # Move an engine to as_of: the results entering and leaving its window are added and removed
+        # and only those players are repositioned
+        if engine.as_of == as_of:
+            return engine
+
+        old_window = self.get_window(engine.as_of)
+        new_window = self.get_window(as_of)
+        year_changed = engine.as_of.year != as_of.year
+        engine.as_of = as_of
+        engine.min_end_date = str(one_year_before(as_of))
+        engine.max_end_date = str(as_of)
+
+        changed_usab_ids = set()
+        for start, end in range_difference(old_window, new_window):
+            for end_date, usab_id, tournament_id, score_code, age_group, event_type in self.results[start:end]:
+                engine.remove_result(usab_id, tournament_id, age_group, event_type)
+                changed_usab_ids.add(usab_id)
+        for start, end in range_difference(new_window, old_window):
+            for end_date, usab_id, tournament_id, score_code, age_group, event_type in self.results[start:end]:
+                engine.add_coded_result(usab_id, tournament_id, end_date, score_code, age_group, event_type)
+                changed_usab_ids.add(usab_id)
+        if year_changed:
+            # Every player is a year older, which changes the age groups they are eligible for
+            changed_usab_ids.update(engine.results)
+        engine.update_players(changed_usab_ids)
+        return engine
+
+    def get_engine(self, as_of, score_version):
+        # Read-only leaderboards as of a day
+        key = (score_version, as_of)
+        with self.lock:
+            engine = self.snapshots.get(key)
+            if engine is None:
+                engine = self.snapshots[key] = self.move_to(as_of, score_version).snapshot()
+                while len(self.snapshots) > self.max_snapshots:
+                    self.snapshots.popitem(last=False)
+            self.snapshots.move_to_end(key)
+            return engine
+
+    def get_player_history(self, usab_id, days, keys, score_version):
+        # [(day, event_type, age_group, total score, rank)] of one player on the given leaderboards, days in ascending order.
+        # The lock is only held to copy the shared engine: the walk over the days moves a private copy, so a long
+        # history does not hold up the other requests of the worker
+        if not days:
+            return []
+        with self.lock:
+            engine = self.engines.get(score_version)
+            if engine is None:
+                engine = self.move_to(days[0], score_version)
+            engine = engine.copy()
+            # Shares the results of the engine's version, an ingest replaces the lists of this history
+            walk = copy(self)
+        history = []
+        for day in days:
+            walk.slide(engine, day)
+            for event_type, age_group in keys:
+                rank = engine.get_rank(usab_id, event_type, age_group)
+                if rank is not None:
+                    history.append((day, event_type, age_group) + rank)
+        return history
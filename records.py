@@ -0,0 +1,119 @@
+# records.py
+#
+# Compact in-memory records of the cached data. Players and tournaments are __slots__
+# objects instead of dicts, the results of a player or a tournament are kept in columns
+# per (event_type, age_group) group, repeated strings (codes, dates, names) are interned
+# so every copy shares one object, and a result refers to its tournament by id instead
+# of repeating its name, description and type. The JSON shape of the API is only built
+# by the to_dict methods, when a response is serialized.
+import sys
+
+def intern_string(value):
+    # One shared copy of each distinct string, None and numbers as they are
+    return sys.intern(value) if isinstance(value, str) else value
+
+def standing_level_order(standing_level):
+    # '1', '3-4', '5-8', ... sorted by their first place
+    return int(standing_level.split('-')[0])
+
+class PlayerRecord:
+    """A row of usab_player, without its usab_id which is the key it is stored under."""
+
+    __slots__ = ('player_name', 'birth_year', 'gender')
+
+    def __init__(self, player_name, birth_year, gender):
+        self.player_name = intern_string(player_name)
+        self.birth_year = birth_year
+        self.gender = intern_string(gender)
+
+    def to_dict(self):
+        return {'player_name': self.player_name, 'birth_year': self.birth_year, 'gender': self.gender}
+
+class TournamentRecord:
+    """A row of tournament, without its tournament_id which is the key it is stored under."""
+
+    __slots__ = ('tournament_name', 'tournament_type', 'description', 'location', 'start_date', 'end_date')
+
+    def __init__(self, tournament_name, tournament_type, description, location, start_date, end_date):
+        self.tournament_name = tournament_name
+        self.tournament_type = intern_string(tournament_type)
+        self.description = description
+        self.location = intern_string(location)
+        self.start_date = intern_string(str(start_date))
+        self.end_date = intern_string(str(end_date))
+
+    def to_dict(self):
+        return {'tournament_name': self.tournament_name, 'tournament_type': self.tournament_type,
+                'description': self.description, 'location': self.location,
+                'start_date': self.start_date, 'end_date': self.end_date}
+
+class PlayerResults:
+    """Results of one player in one (event_type, age_group), in columns sorted by end date and standing level."""
+
+    __slots__ = ('usab_id', 'end_dates', 'tournament_ids', 'player_names', 'standing_levels')
+
+    def __init__(self, usab_id):
+        self.usab_id = usab_id
+        self.end_dates = []
+        self.tournament_ids = []
+        self.player_names = []
+        self.standing_levels = []
+
+    def append(self, tournament_id, end_date, player_name, standing_level):
+        self.tournament_ids.append(intern_string(tournament_id))
+        self.end_dates.append(intern_string(str(end_date)))
+        self.player_names.append(intern_string(player_name))
+        self.standing_levels.append(intern_string(standing_level))
+
+    def to_dict(self, index, event_type, age_group, tournament):
+        return {'tournament_id': self.tournament_ids[index], 'tournament_name': tournament.tournament_name,
+                'tournament_description': tournament.description, 'tournament_type': tournament.tournament_type,
+                'end_date': self.end_dates[index], 'event_type': event_type, 'age_group': age_group,
+                'player_name': self.player_names[index], 'usab_id': self.usab_id, 'standing_level': self.standing_levels[index]}
+
+class TournamentResults:
+    """Results of one tournament in one (event_type, age_group), in columns sorted by standing level."""
+
+    __slots__ = ('usab_ids', 'player_names', 'standing_levels')
+
+    def __init__(self):
+        self.usab_ids = []
+        self.player_names = []
+        self.standing_levels = []
+
+    def append(self, usab_id, player_name, standing_level):
+        self.usab_ids.append(usab_id)
+        self.player_names.append(intern_string(player_name))
+        self.standing_levels.append(intern_string(standing_level))
+
+    def __len__(self):
+        return len(self.usab_ids)
+
+    def to_dict(self, index, event_type, age_group):
+        return {'age_group': age_group, 'event_type': event_type, 'usab_id': self.usab_ids[index],
+                'player_name': self.player_names[index], 'standing_level': self.standing_levels[index]}
+
+def index_player_results(usab_id, rows):
+    # (tournament_id, end_date, event_type, age_group, player_name, standing_level) rows of one player
+    # to {(event_type, age_group): PlayerResults}
+    performance_index = {}
+    for tournament_id, end_date, event_type, age_group, player_name, standing_level in sorted(
+            rows, key=lambda row: (str(row[1]), standing_level_order(row[5]))):
+        key = (intern_string(event_type), intern_string(age_group))
+        results = performance_index.get(key)
+        if results is None:
+            results = performance_index[key] = PlayerResults(usab_id)
+        results.append(tournament_id, end_date, player_name, standing_level)
+    return performance_index
+
+def index_tournament_results(rows):
+    # (event_type, age_group, usab_id, player_name, standing_level) rows of one tournament
+    # to {(event_type, age_group): TournamentResults}
+    performance_index = {}
+    for event_type, age_group, usab_id, player_name, standing_level in sorted(rows, key=lambda row: standing_level_order(row[4])):
+        key = (intern_string(event_type), intern_string(age_group))
+        results = performance_index.get(key)
+        if results is None:
+            results = performance_index[key] = TournamentResults()
+        results.append(usab_id, player_name, standing_level)
+    return performance_index
@@ -0,0 +1,210 @@
+# schema.py
+#
+# Schema migration for tournament.db: secondary indexes for the hot lookups and the
+# materialized player_tournament_score table used by the ranking and player performance
+# endpoints instead of re-joining tournament, tournament_player and tournament_player_performance.
+#
+# The server migrates the database it serves on startup (see warm_up in app.py), this command
+# migrates one ahead of time and times the hot queries.
+#
+# Usage: python schema.py [--db tournament.db] [--timings]
+import argparse
+import fcntl
+import os
+import re
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+
+DEFAULT_DATABASE_PATH = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'tournament.db')
+
+# Written by migrate into PRAGMA user_version, databases below it are migrated before they are served
+# (2: WAL journal mode, 3: ingest_log)
+SCHEMA_VERSION = 3
+
+# Event types and age groups of tournament_player_performance, shared by the server and loader.py
+ALL_EVENT_TYPES = {'BS', 'GS', 'BD', 'GD', 'XD'}
+ALL_AGE_GROUPS = {'U11', 'U13', 'U15', 'U17', 'U19'}
+
+# Dates are stored as text and compared as strings, so only the zero padded form is valid
+DATE_PATTERN = re.compile(r'[0-9]{4}-[0-9]{2}-[0-9]{2}')
+
+# Range of a SQLite INTEGER (and of the 64-bit integers orjson encodes), larger ids cannot exist
+MIN_SQLITE_INTEGER = -2 ** 63
+MAX_SQLITE_INTEGER = 2 ** 63 - 1
+
+CREATE_PLAYER_TOURNAMENT_SCORE_SQL = """
+    CREATE TABLE IF NOT EXISTS player_tournament_score (
+        tournament_id VARCHAR(50),
+        tournament_player_id INTEGER,
+        age_group VARCHAR(10),
+        event_type VARCHAR(20),
+        standing_level VARCHAR(10),
+        usab_id INTEGER,
+        player_name VARCHAR(50),
+        tournament_name VARCHAR(50),
+        tournament_description TEXT,
+        tournament_type VARCHAR(20),
+        end_date DATE,
+        PRIMARY KEY (tournament_id, tournament_player_id, age_group, event_type)
+    )
+"""
+
+# One row per ingest that changed something, written in the ingest's transaction. Every worker applies the
+# rows it has not seen yet to its caches and leaderboards (see sync_ingests in app.py), usab_ids is the
+# JSON list of the players whose results at the tournament changed
+CREATE_INGEST_LOG_SQL = """
+    CREATE TABLE IF NOT EXISTS ingest_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        tournament_id VARCHAR(50),
+        usab_ids TEXT
+    )
+"""
+
+INDEX_SQLS = [
+    'CREATE INDEX IF NOT EXISTS tournament_player_usab_id ON tournament_player (usab_id)',
+    'CREATE INDEX IF NOT EXISTS tournament_player_performance_age_group_standing_level ON tournament_player_performance (age_group, standing_level)',
+    'CREATE INDEX IF NOT EXISTS tournament_end_date ON tournament (end_date)',
+    'CREATE INDEX IF NOT EXISTS player_tournament_score_usab_id ON player_tournament_score (usab_id)',
+    'CREATE INDEX IF NOT EXISTS player_tournament_score_end_date ON player_tournament_score (end_date)',
+]
+
+PLAYER_TOURNAMENT_SCORE_SELECT_SQL = """
+    SELECT tournament_player_performance.tournament_id, tournament_player_performance.tournament_player_id,
+    tournament_player_performance.age_group, tournament_player_performance.event_type, tournament_player_performance.standing_level,
+    tournament_player.usab_id, tournament_player.player_name,
+    tournament.tournament_name, tournament.description, tournament.tournament_type, tournament.end_date
+    FROM tournament_player_performance
+    JOIN tournament_player ON tournament_player_performance.tournament_id = tournament_player.tournament_id
+    AND tournament_player_performance.tournament_player_id = tournament_player.tournament_player_id
+    JOIN tournament ON tournament.tournament_id = tournament_player.tournament_id
+"""
+
+# Same as the shipped view, but scored with the latest score version only: joining every version
+# would repeat each result once per version
+USAB_PLAYER_TOURNAMENT_SCORE_VIEW_SQLS = [
+    'DROP VIEW IF EXISTS usab_player_tournament_score',
+    """
+    CREATE VIEW usab_player_tournament_score AS
+        SELECT usab_player.usab_id, usab_player.player_name, tournament.tournament_name, tournament.end_date, CAST(SUBSTR(tournament_player_performance.age_group, 2, 3) AS INT) AS event_u_age,
+        tournament_player_performance.event_type, tournament_player_performance.standing_level, score.ranking_points, (CAST(STRFTIME('%Y', 'now') AS INTEGER) - usab_player.birth_year) AS player_age
+        from tournament, tournament_player, tournament_player_performance, usab_player, score
+        where tournament.tournament_id=tournament_player.tournament_id
+        and tournament_player_performance.tournament_id=tournament_player.tournament_id
+        and tournament_player_performance.tournament_player_id=tournament_player.tournament_player_id
+        and tournament_player.usab_id=usab_player.usab_id
+        and tournament_player_performance.age_group=score.age_group
+        and tournament_player_performance.standing_level=score.standing_level
+        and tournament.tournament_type=score.tournament_type
+        and score.version = (SELECT MAX(version) FROM score)
+        and tournament.end_date >= Date('now', '-1 year')
+        and usab_player.usab_id != '0'
+    """,
+]
+
+INSERT_PLAYER_TOURNAMENT_SCORE_SQL = 'INSERT OR REPLACE INTO player_tournament_score ' + PLAYER_TOURNAMENT_SCORE_SELECT_SQL
+
+# Refresh the materialized rows of one tournament, run inside the transaction that changed it
+REFRESH_TOURNAMENT_SCORE_SQLS = [
+    'DELETE FROM player_tournament_score WHERE tournament_id = :tournament_id',
+    INSERT_PLAYER_TOURNAMENT_SCORE_SQL + ' WHERE tournament_player_performance.tournament_id = :tournament_id',
+]
+
+# Hot queries timed by --timings, before and after the migration
+TIMED_QUERIES = {
+    'player performance (join)': (PLAYER_TOURNAMENT_SCORE_SELECT_SQL + ' WHERE tournament_player.usab_id = :usab_id', False),
+    'player performance (materialized)': ('SELECT * FROM player_tournament_score WHERE usab_id = :usab_id', True),
+    'ranking results (join)': (PLAYER_TOURNAMENT_SCORE_SELECT_SQL + ' WHERE tournament.end_date >= :min_end_date', False),
+    'ranking results (materialized)': ('SELECT * FROM player_tournament_score WHERE end_date >= :min_end_date', True),
+}
+
+@contextmanager
+def database_write_lock(database_path):
+    # Exclusive lock of the processes writing a database (ingest in every worker, loader.py), held from the start
+    # of their transaction until it is committed and, for loader.py, the generation is bumped. SQLite's own lock ends at commit
+    with open(database_path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def has_player_tournament_score(connection):
+    return connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'player_tournament_score'").fetchone() is not None
+
+def refresh_tournament_scores(connection, tournament_ids):
+    for tournament_id in tournament_ids:
+        for sql in REFRESH_TOURNAMENT_SCORE_SQLS:
+            connection.execute(sql, {'tournament_id': tournament_id})
+
+def migrate(connection):
+    # Served databases are read by long transactions (streamed exports) while results are ingested:
+    # in WAL mode readers and the writer do not block each other. The mode is kept in the file
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute(CREATE_PLAYER_TOURNAMENT_SCORE_SQL)
+    connection.execute(CREATE_INGEST_LOG_SQL)
+    for sql in INDEX_SQLS:
+        connection.execute(sql)
+    for sql in USAB_PLAYER_TOURNAMENT_SCORE_VIEW_SQLS:
+        connection.execute(sql)
+    # Full rebuild, in case rows were written by something that does not refresh the table
+    connection.execute('DELETE FROM player_tournament_score')
+    connection.execute(INSERT_PLAYER_TOURNAMENT_SCORE_SQL)
+    connection.execute('ANALYZE')
+    connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+def ensure_migrated(database_path):
+    # Migrate a database unless it already is at SCHEMA_VERSION, returns whether it was migrated.
+    # Workers starting together wait on the write lock, so only the first one migrates
+    with database_write_lock(database_path):
+        connection = sqlite3.connect(database_path)
+        try:
+            if connection.execute('PRAGMA user_version').fetchone()[0] >= SCHEMA_VERSION:
+                return False
+            with connection:
+                migrate(connection)
+            return True
+        finally:
+            connection.close()
+
+def time_queries(connection, repeat=20):
+    usab_id = connection.execute('SELECT usab_id FROM tournament_player GROUP BY usab_id ORDER BY COUNT(*) DESC LIMIT 1').fetchone()[0]
+    min_end_date = connection.execute('SELECT MIN(end_date) FROM tournament').fetchone()[0]
+    params = {'usab_id': usab_id, 'min_end_date': min_end_date}
+    materialized = has_player_tournament_score(connection)
+
+    timings = {}
+    for name, (sql, needs_materialized) in TIMED_QUERIES.items():
+        if needs_materialized and not materialized:
+            continue
+        start = time.perf_counter()
+        for _ in range(repeat):
+            connection.execute(sql, params).fetchall()
+        timings[name] = (time.perf_counter() - start) / repeat * 1000
+    return timings
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Add indexes and (re)build the player_tournament_score table')
+    parser.add_argument('--db', default=DEFAULT_DATABASE_PATH, help='SQLite database to migrate')
+    parser.add_argument('--timings', action='store_true', help='time the hot queries before and after the migration')
+    args = parser.parse_args(argv)
+
+    connection = sqlite3.connect(args.db)
+    try:
+        before = time_queries(connection) if args.timings else {}
+        with connection:
+            migrate(connection)
+        after = time_queries(connection) if args.timings else {}
+    finally:
+        connection.close()
+
+    print(f'Migrated {args.db}')
+    for name in TIMED_QUERIES:
+        if name in after:
+            before_timing = f'{before[name]:8.2f} ms' if name in before else '       -   '
+            print(f'{name:35} before {before_timing}  after {after[name]:8.2f} ms')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
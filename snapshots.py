@@ -0,0 +1,297 @@
+# snapshots.py
+#
+# Versioned snapshots of tournament.db. A new database is built off to the side, migrated
+# (player_tournament_score, indexes) and verified, then published into the snapshot
+# directory and made current by atomically replacing the CURRENT pointer file. Workers
+# notice the new pointer, open and warm the new snapshot while still serving the old one,
+# then switch: requests that started on the old snapshot finish on it, and its connections
+# are closed once the last of them is done.
+#
+# Usage: python snapshots.py [--snapshot-dir snapshots] publish new.db
+#        python snapshots.py [--snapshot-dir snapshots] activate tournament-20240101T000000000000.db
+#        python snapshots.py [--snapshot-dir snapshots] list
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import threading
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine
+
+from schema import PLAYER_TOURNAMENT_SCORE_SELECT_SQL, migrate
+from sqlite_pool import ReadOnlyConnectionPool
+
+DEFAULT_SNAPSHOT_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'snapshots')
+POINTER_FILE = 'CURRENT'
+# Snapshots kept by publish, older ones are deleted (never the current one)
+DEFAULT_KEEP = 3
+
+# Tables that must exist and hold rows for a snapshot to be published
+REQUIRED_TABLES = ('score', 'usab_player', 'tournament', 'tournament_player', 'tournament_player_performance', 'player_tournament_score')
+
+logger = logging.getLogger(__name__)
+
+def read_pointer(snapshot_dir):
+    # File name of the current snapshot, None when nothing was published
+    try:
+        with open(os.path.join(snapshot_dir, POINTER_FILE)) as file:
+            return file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def write_pointer(snapshot_dir, name):
+    # Write to a temporary file and rename it, so readers never see a partial name
+    temporary_file = os.path.join(snapshot_dir, f'{POINTER_FILE}.{os.getpid()}.tmp')
+    with open(temporary_file, 'w') as file:
+        file.write(name)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_file, os.path.join(snapshot_dir, POINTER_FILE))
+
+def list_snapshots(snapshot_dir):
+    # Published snapshot file names, oldest first (names sort by publication time)
+    try:
+        names = os.listdir(snapshot_dir)
+    except FileNotFoundError:
+        return []
+    return sorted(name for name in names if name.startswith('tournament-') and name.endswith('.db'))
+
+def verify_snapshot(path):
+    # Problems found in a database file, an empty list when it can be served
+    connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        problems = []
+        integrity = connection.execute('PRAGMA integrity_check').fetchone()[0]
+        if integrity != 'ok':
+            problems.append(f'integrity check failed: {integrity}')
+        tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for table in REQUIRED_TABLES:
+            if table not in tables:
+                problems.append(f'missing table {table}')
+            elif connection.execute(f'SELECT 1 FROM {table} LIMIT 1').fetchone() is None:
+                problems.append(f'empty table {table}')
+        if not problems:
+            # The materialized results must match the tables they are built from
+            materialized = connection.execute('SELECT COUNT(*) FROM player_tournament_score').fetchone()[0]
+            expected = connection.execute(f'SELECT COUNT(*) FROM ({PLAYER_TOURNAMENT_SCORE_SELECT_SQL})').fetchone()[0]
+            if materialized != expected:
+                problems.append(f'player_tournament_score has {materialized} rows, expected {expected}')
+        return problems
+    finally:
+        connection.close()
+
+def remove_snapshot_files(path):
+    for suffix in ('', '-wal', '-shm', '.generation', '.lock'):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+def prune_snapshots(snapshot_dir, keep=DEFAULT_KEEP):
+    # Workers still draining a deleted snapshot keep reading it through their open connections
+    current = read_pointer(snapshot_dir)
+    removed = []
+    for name in list_snapshots(snapshot_dir)[:-keep or None]:
+        if name != current:
+            remove_snapshot_files(os.path.join(snapshot_dir, name))
+            removed.append(name)
+    return removed
+
+def publish_snapshot(source_path, snapshot_dir=DEFAULT_SNAPSHOT_DIR, keep=DEFAULT_KEEP):
+    # Copy, migrate and verify source_path as a new snapshot and make it current, returns its file name
+    os.makedirs(snapshot_dir, exist_ok=True)
+    name = f"tournament-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')}.db"
+    path = os.path.join(snapshot_dir, name)
+    temporary_path = path + '.tmp'
+
+    # The backup API gives a consistent copy even while the source is being written
+    source = sqlite3.connect(f'file:{source_path}?mode=ro', uri=True)
+    target = sqlite3.connect(temporary_path)
+    try:
+        source.backup(target)
+        # Also puts the snapshot in WAL mode, so its read-only connections and small ingests run side by side
+        with target:
+            migrate(target)
+    except sqlite3.Error as e:
+        target.close()
+        remove_snapshot_files(temporary_path)
+        raise ValueError(f'{source_path} cannot be published: {e}')
+    finally:
+        target.close()
+        source.close()
+
+    problems = verify_snapshot(temporary_path)
+    if problems:
+        remove_snapshot_files(temporary_path)
+        raise ValueError(f"{source_path} cannot be published: {'; '.join(problems)}")
+    os.replace(temporary_path, path)
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(temporary_path + suffix):
+            os.replace(temporary_path + suffix, path + suffix)
+    write_pointer(snapshot_dir, name)
+    prune_snapshots(snapshot_dir, keep)
+    return name
+
+def activate_snapshot(name, snapshot_dir=DEFAULT_SNAPSHOT_DIR):
+    # Make an already published snapshot current again, e.g. to roll back
+    if name not in list_snapshots(snapshot_dir):
+        raise ValueError(f'no snapshot {name} in {snapshot_dir}')
+    problems = verify_snapshot(os.path.join(snapshot_dir, name))
+    if problems:
+        raise ValueError(f"{name} cannot be activated: {'; '.join(problems)}")
+    write_pointer(snapshot_dir, name)
+
+class Snapshot:
+    """One database file being served, with its read pool and the number of requests using it.
+
+    Once retired (replaced by a newer snapshot) it is closed when its last request releases it.
+    """
+
+    def __init__(self, path, pool_size, version=None):
+        self.path = path
+        self.version = version
+        self.generation_file = path + '.generation'
+        self.read_pool = ReadOnlyConnectionPool(path, pool_size)
+        self._write_engine = None
+        self._users = 0
+        self._retired = False
+        self._lock = threading.Lock()
+
+    def get_write_engine(self):
+        # SQLAlchemy engine for the ingest endpoint, created on first use
+        with self._lock:
+            if self._write_engine is None:
+                self._write_engine = create_engine('sqlite:///' + self.path)
+            return self._write_engine
+
+    def acquire(self):
+        with self._lock:
+            self._users += 1
+
+    def release(self):
+        with self._lock:
+            self._users -= 1
+            drained = self._retired and self._users == 0
+        if drained:
+            self.close()
+
+    def retire(self):
+        with self._lock:
+            self._retired = True
+            drained = self._users == 0
+        if drained:
+            self.close()
+
+    def close(self):
+        logger.info('closing snapshot %s', self.path)
+        self.read_pool.close()
+        if self._write_engine is not None:
+            self._write_engine.dispose()
+
+class SnapshotManager:
+    """The snapshot new requests start on.
+
+    Without a published snapshot, database_path itself is served. When the pointer file of
+    snapshot_dir names another snapshot, it is opened and passed to warm (in a background
+    thread, requests keep being served from the current snapshot meanwhile). warm returns a
+    function run at the moment of the switch, to swap state built for the new snapshot in.
+    """
+
+    def __init__(self, database_path, snapshot_dir, pool_size, warm=None):
+        self.database_path = database_path
+        self.snapshot_dir = snapshot_dir
+        self.pool_size = pool_size
+        self.warm = warm
+        self._lock = threading.Lock()
+        self._pointer_mtime = self.get_pointer_mtime()
+        self._switching = False
+        self.current = self.open(read_pointer(snapshot_dir) if snapshot_dir else None)
+
+    def get_pointer_mtime(self):
+        if not self.snapshot_dir:
+            return None
+        try:
+            return os.stat(os.path.join(self.snapshot_dir, POINTER_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def open(self, name):
+        if name is None:
+            return Snapshot(self.database_path, self.pool_size)
+        return Snapshot(os.path.join(self.snapshot_dir, name), self.pool_size, version=name)
+
+    def acquire(self):
+        # The current snapshot, held until release() so it stays open for the whole request
+        self.check()
+        with self._lock:
+            snapshot = self.current
+            snapshot.acquire()
+        return snapshot
+
+    def check(self):
+        # Start switching when the pointer changed, one stat per call
+        pointer_mtime = self.get_pointer_mtime()
+        if pointer_mtime == self._pointer_mtime:
+            return
+        with self._lock:
+            if pointer_mtime == self._pointer_mtime or self._switching:
+                return
+            self._pointer_mtime = pointer_mtime
+            name = read_pointer(self.snapshot_dir)
+            if name == self.current.version:
+                return
+            self._switching = True
+        threading.Thread(target=self.switch_to, args=(name,), daemon=True).start()
+
+    def switch_to(self, name):
+        try:
+            snapshot = self.open(name)
+            activate = self.warm(snapshot) if self.warm is not None else None
+        except Exception:
+            logger.exception('could not open snapshot %s, still serving %s', name, self.current.path)
+            # Retried when the pointer changes again
+            with self._lock:
+                self._switching = False
+            return
+        with self._lock:
+            old_snapshot = self.current
+            self.current = snapshot
+            self._switching = False
+        if activate is not None:
+            activate()
+        old_snapshot.retire()
+        # The pointer may have moved again while this one was warming
+        self._pointer_mtime = None
+        self.check()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Publish and activate snapshots of tournament.db')
+    parser.add_argument('--snapshot-dir', default=os.environ.get('SNAPSHOT_DIR', DEFAULT_SNAPSHOT_DIR), help='directory of the snapshots')
+    commands = parser.add_subparsers(dest='command', required=True)
+    publish_parser = commands.add_parser('publish', help='copy, migrate and verify a database, then make it current')
+    publish_parser.add_argument('db', help='database built off to the side, e.g. with loader.py')
+    publish_parser.add_argument('--keep', type=int, default=DEFAULT_KEEP, help='snapshots to keep')
+    activate_parser = commands.add_parser('activate', help='make a published snapshot current again')
+    activate_parser.add_argument('name', help='snapshot file name, see list')
+    commands.add_parser('list', help='list the published snapshots')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'publish':
+            print(f'Published {publish_snapshot(args.db, args.snapshot_dir, args.keep)}')
+        elif args.command == 'activate':
+            activate_snapshot(args.name, args.snapshot_dir)
+            print(f'Activated {args.name}')
+        else:
+            current = read_pointer(args.snapshot_dir)
+            for name in list_snapshots(args.snapshot_dir):
+                print(f"{'*' if name == current else ' '} {name}")
+    except (ValueError, OSError, sqlite3.Error) as e:
+        print(f'{args.command} failed: {e}', file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+# sqlite_pool.py
+#
+# Pool of read-only SQLite connections shared by the threads of a worker, so read
+# endpoints run plain SQL without a SQLAlchemy session per request.
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+class ReadOnlyConnectionPool:
+    """At most ``max_size`` read-only connections to one database file.
+
+    Connections are opened lazily with ``mode=ro`` and ``PRAGMA query_only``, can be
+    used from any thread (one thread at a time) and are handed out most recently
+    used first to keep their page caches warm. ``immutable=True`` skips all locking
+    and must only be used for database files that are never written while open.
+    """
+
+    def __init__(self, database_path, max_size=8, immutable=False, timeout=30):
+        self.database_uri = f'file:{database_path}?mode=ro' + ('&immutable=1' if immutable else '')
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self):
+        connection = sqlite3.connect(self.database_uri, uri=True, check_same_thread=False, timeout=self.timeout)
+        connection.row_factory = sqlite3.Row
+        connection.execute('PRAGMA query_only = ON')
+        return connection
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._size < self.max_size:
+                self._size += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._size -= 1
+                    raise
+        # Every connection is in use, wait for one to be released
+        return self._idle.get(timeout=self.timeout)
+
+    def _release(self, connection):
+        if self._closed:
+            connection.close()
+        else:
+            self._idle.put(connection)
+
+    @contextmanager
+    def connection(self):
+        connection = self._acquire()
+        try:
+            yield connection
+        finally:
+            # End the read transaction so the next query sees newly committed data
+            if connection.in_transaction:
+                connection.rollback()
+            self._release(connection)
+
+    def execute(self, query, params=None):
+        with self.connection() as connection:
+            return connection.execute(query, params or {}).fetchall()
+
+    def close(self):
+        # Idle connections are closed now, connections in use when they are released
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
@@ -0,0 +1,64 @@
+# tests/conftest.py
+#
+# app.py opens the database named by TOURNAMENT_DB when it is imported, so the endpoint tests
+# serve a copy of the shipped tournament.db, migrated by warm_up like in a worker.
+import os
+import shutil
+import tempfile
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SHIPPED_DATABASE_PATH = os.path.join(REPO_DIR, 'tournament.db')
+INGEST_TOKEN = 'test-ingest-token'
+
+def pytest_configure(config):
+    config.database_dir = tempfile.mkdtemp()
+    database_path = os.path.join(config.database_dir, 'tournament.db')
+    shutil.copy(SHIPPED_DATABASE_PATH, database_path)
+    os.environ['TOURNAMENT_DB'] = database_path
+    os.environ['INGEST_TOKEN'] = INGEST_TOKEN
+    os.environ['CACHE_BACKEND'] = 'lru'
+
+def pytest_unconfigure(config):
+    shutil.rmtree(config.database_dir, ignore_errors=True)
+
+@pytest.fixture(scope='session')
+def app_module():
+    import app
+    app.warm_up()
+    return app
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+@pytest.fixture
+def shipped_database(tmp_path):
+    # Copy of the shipped (unmigrated) database
+    path = str(tmp_path / 'tournament.db')
+    shutil.copy(SHIPPED_DATABASE_PATH, path)
+    return path
+
+@pytest.fixture
+def tournament_results(app_module):
+    # Valid ingest body for a JN tournament: the given players (the first usab_ids by default) in U19 BS
+    def make(usab_ids=None, end_date='2024-01-10', player_count=3):
+        if usab_ids is None:
+            usab_ids = [row['usab_id'] for row in app_module.execute_sql_query(
+                'SELECT usab_id FROM usab_player WHERE usab_id != 0 ORDER BY usab_id LIMIT :count', {'count': player_count})]
+        return {
+            'tournament': {'tournament_name': 'Test Open', 'tournament_type': 'JN', 'description': 'TEST OPEN',
+                           'location': 'Test', 'start_date': end_date, 'end_date': end_date},
+            'players': [{'tournament_player_id': index, 'usab_id': usab_id, 'player_name': f'Player {usab_id}'}
+                        for index, usab_id in enumerate(usab_ids, start=1)],
+            'performances': [{'tournament_player_id': index, 'age_group': 'U19', 'event_type': 'BS', 'standing_level': str(index)}
+                             for index in range(1, len(usab_ids) + 1)],
+        }
+    return make
+
+@pytest.fixture
+def post_results(client):
+    def post(tournament_id, body, token=INGEST_TOKEN):
+        return client.post(f'/api/v1/tournament/{tournament_id}/results', json=body, headers={'X-Ingest-Token': token})
+    return post
@@ -0,0 +1,61 @@
+# tests/test_batch.py
+import pytest
+
+def get_usab_ids(app_module, count):
+    return [row['usab_id'] for row in app_module.execute_sql_query(
+        'SELECT DISTINCT usab_id FROM player_tournament_score WHERE usab_id != 0 ORDER BY usab_id DESC LIMIT :count', {'count': count})]
+
+@pytest.fixture
+def count_queries(app_module, monkeypatch):
+    # Queries of several players' results run through execute_sql_query
+    queries = []
+    execute_sql_query = app_module.execute_sql_query
+    def execute(query, params=None):
+        if 'usab_id IN' in query:
+            queries.append(params)
+        return execute_sql_query(query, params)
+    monkeypatch.setattr(app_module, 'execute_sql_query', execute)
+    return queries
+
+def test_performance_batch_matches_single_player(client, app_module, count_queries, monkeypatch):
+    monkeypatch.setattr(app_module, 'MAX_QUERY_IDS', 2)
+    usab_ids = get_usab_ids(app_module, 5)
+    with app_module.app.app_context():
+        app_module.cache.delete_many(*[f'usab_player_{usab_id}_performance_list' for usab_id in usab_ids])
+
+    # Cold: one query per chunk of 2 ids, unknown players have no results
+    response = client.post('/api/v1/performance:batch', json={'usab_ids': usab_ids + [1, usab_ids[0]], 'event_type': 'BS'})
+    assert response.status_code == 200
+    performances = response.get_json()['performances']
+    assert [performance['usab_id'] for performance in performances] == usab_ids + [1]
+    assert len(count_queries) == 3
+    assert performances[-1]['performances'] == []
+    for performance in performances[:-1]:
+        assert performance['performances'] == client.get(f"/api/v1/player/{performance['usab_id']}/performance?event_type=BS").get_json()
+
+    # Warm: every player is cached now
+    assert client.post('/api/v1/performance:batch', json={'usab_ids': usab_ids}).status_code == 200
+    assert len(count_queries) == 3
+
+def test_players_batch(client, app_module):
+    usab_ids = get_usab_ids(app_module, 3)
+    response = client.post('/api/v1/players:batch', json={'usab_ids': [str(usab_ids[0])] + usab_ids + [1]})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [player['usab_id'] for player in body['players']] == usab_ids
+    assert body['not_found'] == [1]
+
+@pytest.mark.parametrize('body', [
+    None,
+    {'usab_ids': 5},
+    {'usab_ids': [True]},
+    {'usab_ids': [2 ** 64]},
+    {'usab_ids': ['12a']},
+    {'usab_ids': list(range(1001))},
+    {'usab_ids': [1], 'min_date': 20240101},
+    {'usab_ids': [1], 'min_date': '2024-1-01'},
+    {'usab_ids': [1], 'event_type': 'XX'},
+])
+@pytest.mark.parametrize('url', ['/api/v1/players:batch', '/api/v1/performance:batch'])
+def test_invalid_batch_requests(client, url, body):
+    assert client.post(url, json=body).status_code == 400
@@ -0,0 +1,60 @@
+# tests/test_cache_backend.py
+from flask_caching.backends.filesystemcache import FileSystemCache
+
+import cache_backend
+from cache_backend import GenerationalCache, LRUCache, bump_generation, read_generation
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(threshold=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+
+def test_lru_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_backend, 'time', lambda: now[0])
+    cache = LRUCache(default_timeout=10)
+    cache.set('a', 1)
+    cache.set('b', 2, timeout=0)
+    assert not cache.add('a', 3)
+    now[0] += 11
+    assert cache.get('a') is None
+    # No timeout never expires
+    assert cache.get('b') == 2
+    assert cache.add('a', 3)
+    assert cache.get('a') == 3
+
+def test_generation_file(tmp_path):
+    generation_file = str(tmp_path / 'cache.generation')
+    assert read_generation(generation_file) == 0
+    assert bump_generation(generation_file) == 1
+    assert bump_generation(generation_file) == 2
+    assert read_generation(generation_file) == 2
+    with open(generation_file, 'w') as file:
+        file.write('garbage')
+    assert read_generation(generation_file) == 0
+
+def test_bumped_generation_misses_in_every_worker(tmp_path):
+    # Two workers sharing a filesystem cache and a generation file
+    generation_file = str(tmp_path / 'cache.generation')
+    workers = [GenerationalCache(FileSystemCache(str(tmp_path / 'cache')), generation_file) for _ in range(2)]
+    workers[0].set('players', [1, 2])
+    assert workers[1].get('players') == [1, 2]
+
+    bump_generation(generation_file)
+    assert workers[0].get('players') is None
+    assert workers[1].get('players') is None
+    workers[1].set('players', [3])
+    assert workers[0].get('players') == [3]
+    assert workers[0].generation == workers[1].generation == 1
+
+def test_namespace_prefixes_keys(tmp_path):
+    cache = GenerationalCache(LRUCache(), str(tmp_path / 'cache.generation'))
+    cache.set('players', 'current')
+    cache.get_namespace = lambda: ('next:', str(tmp_path / 'next.generation'))
+    assert cache.get('players') is None
+    cache.set('players', 'next')
+    assert cache.cache.get('next:g0:players') == 'next'
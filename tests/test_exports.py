@@ -0,0 +1,52 @@
+# tests/test_exports.py
+import gzip
+import json
+import sqlite3
+
+def test_performance_export_ndjson(client, app_module):
+    response = client.get('/api/v1/export/performances?event_type=BS&fields=usab_id,event_type,score')
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.get_data().splitlines()]
+    expected = app_module.execute_sql_query("SELECT COUNT(*) AS count FROM player_tournament_score WHERE usab_id != 0 AND event_type = 'BS'")
+    assert len(rows) == expected[0]['count']
+    assert all(set(row) == {'usab_id', 'event_type', 'score'} and row['event_type'] == 'BS' for row in rows)
+
+def test_rank_export_csv_gzip(client):
+    response = client.get('/api/v1/export/ranks?age_group=U13&format=csv', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    lines = gzip.decompress(response.get_data()).decode().splitlines()
+    assert lines[0] == 'event_type,age_group,rank,usab_id,player_name,scores'
+    assert all(',U13,' in line for line in lines[1:])
+
+def test_rank_export_ignores_date_filters(client):
+    assert client.get('/api/v1/export/ranks?min_date=bogus').status_code == 200
+    assert client.get('/api/v1/export/ranks?age_group=U99').status_code == 400
+
+def test_ingest_during_export(client, app_module, tournament_results, post_results):
+    # The export keeps its read transaction open until its last chunk, the database is in WAL mode so the
+    # ingest does not wait for it
+    connection = sqlite3.connect(app_module.DATABASE_PATH)
+    assert connection.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    connection.close()
+
+    response = client.get('/api/v1/export/performances')
+    chunks = iter(response.response)
+    assert next(chunks)
+    try:
+        assert post_results('EXPORT-TEST', tournament_results()).status_code == 200
+        assert next(chunks)
+    finally:
+        response.close()
+
+def test_busy_database_is_503(app_module, tournament_results, post_results):
+    # Another process holds the write lock for longer than the busy timeout
+    connection = sqlite3.connect(app_module.DATABASE_PATH, isolation_level=None)
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        response = post_results('BUSY-TEST', tournament_results())
+    finally:
+        connection.execute('ROLLBACK')
+        connection.close()
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(app_module.DATABASE_BUSY_RETRY_SECONDS)
@@ -0,0 +1,157 @@
+# tests/test_ingest.py
+import json
+import subprocess
+import sys
+from datetime import date, timedelta
+
+import pytest
+
+from tests.conftest import INGEST_TOKEN, REPO_DIR
+
+def test_ingest_replaces_results(client, tournament_results, post_results):
+    body = tournament_results()
+    usab_ids = [player['usab_id'] for player in body['players']]
+    response = post_results('INGEST-TEST', body)
+    assert response.status_code == 200
+    assert response.get_json()['changed_usab_ids'] == sorted(usab_ids)
+
+    # The same results again change nothing
+    assert post_results('INGEST-TEST', body).get_json()['changed_usab_ids'] == []
+
+    players = client.get('/api/v1/tournament/INGEST-TEST/players').get_json()
+    assert sorted(player['usab_id'] for player in players) == sorted(usab_ids)
+
+    body['performances'] = body['performances'][:1]
+    assert post_results('INGEST-TEST', body).get_json()['changed_usab_ids'] == sorted(usab_ids[1:])
+
+@pytest.mark.parametrize('token', ['', 'wrong-token', INGEST_TOKEN + 'x'])
+def test_ingest_requires_token(tournament_results, post_results, token):
+    assert post_results('INGEST-TEST', tournament_results(), token=token).status_code == 403
+
+def set_tournament(body, **fields):
+    body['tournament'].update(fields)
+
+def set_player(body, **fields):
+    body['players'][0].update(fields)
+
+def set_performance(body, **fields):
+    body['performances'][0].update(fields)
+
+def duplicate_entry_event(body):
+    body['performances'].append(dict(body['performances'][0]))
+
+def duplicate_player_event(body):
+    # A second entry of the same player in the same event
+    body['players'].append(dict(body['players'][0], tournament_player_id=99))
+    body['performances'].append(dict(body['performances'][0], tournament_player_id=99))
+
+@pytest.mark.parametrize('change', [
+    lambda body: set_tournament(body, tournament_name=['Test']),
+    lambda body: set_tournament(body, tournament_type=1),
+    lambda body: set_tournament(body, description={'a': 1}),
+    lambda body: set_tournament(body, tournament_type='XX'),
+    lambda body: set_tournament(body, end_date='2026-1-5'),
+    lambda body: set_tournament(body, start_date='2024-02-30'),
+    lambda body: set_tournament(body, end_date='20240110'),
+    lambda body: set_tournament(body, end_date=20240110),
+    lambda body: set_player(body, usab_id=2 ** 70),
+    lambda body: set_player(body, usab_id=True),
+    lambda body: set_player(body, usab_id=1.5),
+    lambda body: set_player(body, tournament_player_id=-2 ** 64),
+    lambda body: set_player(body, player_name=None),
+    lambda body: set_performance(body, standing_level=1),
+    lambda body: set_performance(body, event_type='XX'),
+    lambda body: set_performance(body, tournament_player_id=42),
+    duplicate_entry_event,
+    duplicate_player_event,
+    lambda body: body.update(players={}),
+    lambda body: body.update(performances=[None]),
+    lambda body: body.pop('tournament'),
+])
+def test_invalid_results_are_rejected(client, tournament_results, post_results, change):
+    body = tournament_results()
+    change(body)
+    response = post_results('INVALID-TEST', body)
+    assert response.status_code == 400
+    # Nothing was written
+    assert client.get('/api/v1/tournament/INVALID-TEST/players').get_json() in ([], None)
+
+def test_unknown_players_may_share_an_event(tournament_results, post_results):
+    assert post_results('UNKNOWN-TEST', tournament_results(usab_ids=[0, 0])).status_code == 200
+
+def test_invalid_json_is_rejected(client):
+    response = client.post('/api/v1/tournament/INGEST-TEST/results', data='{', content_type='application/json',
+                           headers={'X-Ingest-Token': INGEST_TOKEN})
+    assert response.status_code == 400
+
+OTHER_WORKER_SCRIPT = '''
+import json, os, sys
+import app
+response = app.app.test_client().post(f'/api/v1/tournament/{sys.argv[1]}/results', json=json.loads(sys.argv[2]),
+                                      headers={'X-Ingest-Token': os.environ['INGEST_TOKEN']})
+assert response.status_code == 200, response.get_data()
+'''
+
+def ingest_in_other_worker(tournament_id, body):
+    subprocess.run([sys.executable, '-c', OTHER_WORKER_SCRIPT, tournament_id, json.dumps(body)], cwd=REPO_DIR, check=True)
+
+def get_leaderboard_pages(engine):
+    return {key: engine.get_page(*key) for key in sorted(engine.leaderboards)}
+
+def test_ingest_keeps_other_cached_data(client, app_module, tournament_results, post_results):
+    body = tournament_results(player_count=2)
+    changed_usab_id = body['players'][0]['usab_id']
+    body['players'] = body['players'][:1]
+    body['performances'] = body['performances'][:1]
+    other_usab_id = app_module.execute_sql_query('SELECT usab_id FROM player_tournament_score WHERE usab_id NOT IN (0, :usab_id) LIMIT 1',
+                                                 {'usab_id': changed_usab_id})[0]['usab_id']
+    etags = {usab_id: client.get(f'/api/v1/player/{usab_id}/performance').headers['ETag'] for usab_id in (changed_usab_id, other_usab_id)}
+    with app_module.app.app_context():
+        generation = app_module.cache.cache.generation
+
+    assert post_results('CACHE-TEST', body).status_code == 200
+    with app_module.app.app_context():
+        assert app_module.cache.cache.generation == generation
+        assert app_module.cache.get(f'usab_player_{other_usab_id}_performance_list') is not None
+        assert app_module.cache.get(f'usab_player_{changed_usab_id}_performance_list') is None
+    assert client.get(f'/api/v1/player/{other_usab_id}/performance').headers['ETag'] == etags[other_usab_id]
+    response = client.get(f'/api/v1/player/{changed_usab_id}/performance')
+    assert response.headers['ETag'] != etags[changed_usab_id]
+    assert 'CACHE-TEST' in {performance['tournament_id'] for performance in response.get_json()}
+
+def test_ingest_of_another_worker(client, app_module, tournament_results):
+    # The leaderboards, past rankings and search index of this worker get the changes of the other worker's
+    # ingests without being rebuilt, and end up the same as when they are
+    usab_ids = [row['usab_id'] for row in app_module.execute_sql_query(
+        'SELECT usab_id FROM usab_player WHERE usab_id != 0 AND birth_year >= 2010 ORDER BY usab_id LIMIT 3')]
+    past_day = date(2024, 1, 15)
+    with app_module.app.app_context():
+        score_version = app_module.get_current_score_version()
+        engine = app_module.get_ranking_engine(score_version)
+        history = app_module.get_ranking_history()
+        history.get_engine(past_day, score_version)
+        generation = app_module.cache.cache.generation
+
+    # A new tournament in the past, then moved to this month with other results
+    body = tournament_results(usab_ids=usab_ids, end_date='2024-01-10')
+    for end_date in ('2024-01-10', str(date.today() - timedelta(days=3))):
+        body['tournament']['start_date'] = body['tournament']['end_date'] = end_date
+        body['performances'][0]['standing_level'] = '2' if end_date == '2024-01-10' else '1'
+        ingest_in_other_worker('WORKER-TEST', body)
+
+        assert client.get('/api/v1/tournaments').status_code == 200
+        with app_module.app.app_context():
+            assert app_module.cache.cache.generation == generation
+            assert app_module.get_ranking_engine(score_version) is engine
+            assert app_module.get_ranking_history() is history
+            assert get_leaderboard_pages(engine) == get_leaderboard_pages(app_module.load_ranking_engine(score_version))
+            assert (history.get_engine(past_day, score_version).leaderboards ==
+                    app_module.load_ranking_history().get_engine(past_day, score_version).leaderboards)
+        tournaments = client.get('/api/v1/tournaments?limit=1000').get_json()
+        assert {'tournament_id': 'WORKER-TEST', 'end_date': end_date}.items() <= next(
+            tournament for tournament in tournaments if tournament['tournament_id'] == 'WORKER-TEST').items()
+
+    assert any(engine.get_rank(usab_id, 'BS', 'U19') for usab_id in usab_ids)
+    # Players are also found under the names they were entered under
+    results = client.get(f'/api/v1/players/search?q=Player {usab_ids[0]}').get_json()
+    assert results[0]['usab_id'] == usab_ids[0]
@@ -0,0 +1,43 @@
+# tests/test_list_endpoints.py
+import pytest
+
+def test_pages_and_total_count(client):
+    everyone = client.get('/api/v1/players')
+    players = everyone.get_json()
+    assert everyone.headers['X-Total-Count'] == str(len(players))
+
+    page = client.get('/api/v1/players?offset=10&limit=5')
+    assert page.headers['X-Total-Count'] == str(len(players))
+    assert page.get_json() == players[10:15]
+    assert client.get(f'/api/v1/players?offset={len(players)}').get_json() == []
+
+def test_fields_projection(client):
+    players = client.get('/api/v1/players?limit=3&fields=usab_id,player_name').get_json()
+    assert len(players) == 3
+    assert all(set(player) == {'usab_id', 'player_name'} for player in players)
+
+@pytest.mark.parametrize('query', ['offset=-1', 'offset=a', 'limit=1.5', 'fields=usab_id,password', 'fields=,'])
+def test_invalid_list_parameters(client, query):
+    assert client.get(f'/api/v1/players?{query}').status_code == 400
+
+def test_etag_not_modified(client):
+    response = client.get('/api/v1/tournaments?limit=5')
+    etag = response.headers['ETag']
+    not_modified = client.get('/api/v1/tournaments?limit=5', headers={'If-None-Match': etag})
+    assert not_modified.status_code == 304
+    assert not_modified.get_data() == b''
+    assert not_modified.headers['ETag'] == etag
+
+    # Another page or encoding is another body
+    assert client.get('/api/v1/tournaments?limit=6', headers={'If-None-Match': etag}).status_code == 200
+    gzipped = client.get('/api/v1/tournaments', headers={'Accept-Encoding': 'gzip'})
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    assert gzipped.headers['ETag'] != client.get('/api/v1/tournaments').headers['ETag']
+    assert 'Accept-Encoding' in gzipped.headers['Vary']
+
+def test_etag_changes_with_ingest(client, tournament_results, post_results):
+    etag = client.get('/api/v1/tournaments').headers['ETag']
+    assert post_results('ETAG-TEST', tournament_results()).status_code == 200
+    response = client.get('/api/v1/tournaments', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert 'ETAG-TEST' in {tournament['tournament_id'] for tournament in response.get_json()}
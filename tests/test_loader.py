@@ -0,0 +1,61 @@
+# tests/test_loader.py
+import csv
+import json
+import sqlite3
+
+import pytest
+
+from loader import InvalidRowError, load_results
+
+ROW = {'tournament_id': 'LOADER-TEST', 'tournament_name': 'Loader Open', 'tournament_type': 'JN', 'description': 'LOADER OPEN',
+       'location': 'Test', 'start_date': '2024-01-06', 'end_date': '2024-01-07', 'tournament_player_id': 1, 'usab_id': 2441,
+       'player_name': 'Arden Lee', 'age_group': 'U19', 'event_type': 'BS', 'standing_level': '1'}
+
+# Rows rejected by a non-strict load, the valid row keeps tournament_player_id 1
+INVALID_ROWS = [
+    # Scored for U19 at the other tournament types, not at JN
+    dict(ROW, tournament_player_id=2, standing_level='9-16'),
+    dict(ROW, tournament_player_id=3, event_type='XX'),
+    dict(ROW, tournament_player_id=4, age_group='U21'),
+    dict(ROW, tournament_player_id=5, tournament_id='LOADER-DATE', end_date='2024-1-07'),
+    dict(ROW, tournament_player_id=6, tournament_id='LOADER-WEEK', end_date='2024-W01-7'),
+    dict(ROW, tournament_player_id=7, usab_id=2 ** 70),
+    dict(ROW, tournament_player_id=8, standing_level=1),
+    dict(ROW, tournament_player_id=9, tournament_id='LOADER-NAME', tournament_name=['Loader Open']),
+    {key: value for key, value in ROW.items() if key != 'event_type'},
+]
+
+def count_performances(database_path, tournament_id='LOADER-TEST'):
+    connection = sqlite3.connect(database_path)
+    try:
+        return connection.execute('SELECT COUNT(*) FROM tournament_player_performance WHERE tournament_id = ?', (tournament_id,)).fetchone()[0]
+    finally:
+        connection.close()
+
+def write_ndjson(path, lines):
+    path.write_text(''.join(line + '\n' for line in lines))
+    return str(path)
+
+def test_ndjson_rejects(tmp_path, shipped_database):
+    lines = [json.dumps(ROW), '{"tournament_id": "LOADER-TEST", ', '[1, 2]', ''] + [json.dumps(row) for row in INVALID_ROWS]
+    stats = load_results([write_ndjson(tmp_path / 'results.ndjson', lines)], shipped_database)
+    assert (stats['read'], stats['rejected'], stats['loaded']) == (len(INVALID_ROWS) + 3, len(INVALID_ROWS) + 2, 1)
+    assert count_performances(shipped_database) == 1
+
+@pytest.mark.parametrize('line', ['{"tournament_id": ', json.dumps(INVALID_ROWS[0])], ids=['malformed', 'unscored'])
+def test_strict_load_writes_nothing(tmp_path, shipped_database, line):
+    path = write_ndjson(tmp_path / 'results.ndjson', [json.dumps(ROW), line])
+    with pytest.raises(InvalidRowError, match='results.ndjson:2'):
+        load_results([path], shipped_database, strict=True)
+    assert count_performances(shipped_database) == 0
+
+def test_csv_rows(tmp_path, shipped_database):
+    path = tmp_path / 'results.csv'
+    with open(path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=list(ROW))
+        writer.writeheader()
+        writer.writerow(ROW)
+        writer.writerow(dict(ROW, tournament_player_id=2, standing_level='9-16'))
+    stats = load_results([str(path)], shipped_database)
+    assert (stats['rejected'], stats['loaded']) == (1, 1)
+    assert count_performances(shipped_database) == 1
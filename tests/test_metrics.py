@@ -0,0 +1,24 @@
+# tests/test_metrics.py
+import pytest
+
+from metrics import cache_key_family
+
+@pytest.mark.parametrize('key, family', [
+    ('usab_player_47188_performance_list', 'usab_player_{id}_performance_list'),
+    ('tournament_abc_players_list', 'tournament_{id}_players_list'),
+    ('tournament_ABC-DEF_2024_performance_list', 'tournament_{id}_performance_list'),
+    ('score_dict_v2', 'score_dict_v{version}'),
+    ('response_0123abcd', 'response_{etag}'),
+    ('tournament_dict', 'tournament_dict'),
+    ('usab_player_list', 'usab_player_list'),
+])
+def test_cache_key_family(key, family):
+    assert cache_key_family(key) == family
+
+def test_metrics_endpoint(client):
+    response = client.get('/api/v1/tournament/METRICS-TEST_abc/players')
+    assert 'Server-Timing' in response.headers
+    metrics = client.get('/metrics').get_data(as_text=True)
+    assert 'family="tournament_{id}_players_list"' in metrics
+    assert 'METRICS-TEST' not in metrics
+    assert 'route="/api/v1/tournament/<tournament_id>/players"' in metrics
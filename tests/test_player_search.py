@@ -0,0 +1,45 @@
+# tests/test_player_search.py
+import pytest
+
+from player_search import EXACT_MATCH, FUZZY_MATCH, PREFIX_MATCH, PlayerSearchIndex, normalize_name
+
+NAMES = [(1, 'Arden Lee'), (2, 'Ardena Leeson'), (3, 'José Álvarez'), (4, 'Lee Arden'), (5, 'Jordan Smith')]
+
+@pytest.fixture
+def index():
+    return PlayerSearchIndex().build(NAMES)
+
+def test_normalize_name():
+    assert normalize_name("  José  O'Brien-Álvarez ") == 'jose o brien alvarez'
+    assert normalize_name(None) == ''
+
+def test_exact_then_prefix_matches(index):
+    results = index.search('arden lee', 10)
+    assert results[0] == (1, 'Arden Lee', EXACT_MATCH, 1.0)
+    # Every query token starts a token of the name
+    assert {(usab_id, match) for usab_id, _, match, _ in results[1:]} == {(2, PREFIX_MATCH), (4, PREFIX_MATCH)}
+    # Names starting with the query come first
+    assert [usab_id for usab_id, _, _, _ in index.search('arden', 10)][-1] == 4
+
+def test_accents_and_case_are_ignored(index):
+    assert index.search('ALVAREZ', 10)[0][:3] == (3, 'José Álvarez', PREFIX_MATCH)
+
+def test_fuzzy_matches(index):
+    results = index.search('jordn smith', 10)
+    assert results[0][:3] == (5, 'Jordan Smith', FUZZY_MATCH)
+    # Short queries only match prefixes
+    assert index.search('jx', 10) == []
+
+def test_added_names_and_limit(index):
+    assert index.add(5, 'Jordie Smith')
+    assert not index.add(5, 'jordie  smith')
+    assert index.search('jordie', 10)[0][:2] == (5, 'Jordie Smith')
+    assert len(index.search('a', 2)) == 2
+    assert index.search('arden', 0) == []
+
+def test_search_endpoint(client):
+    results = client.get('/api/v1/players/search?q=arden lee&fields=usab_id,player_name,match').get_json()
+    assert results[0] == {'usab_id': 2441, 'player_name': 'Arden Lee', 'match': EXACT_MATCH}
+    assert client.get('/api/v1/players/search?q=ar&limit=3').status_code == 200
+    for query in ('', 'q=', 'q=ar&limit=1000', 'q=ar&limit=x'):
+        assert client.get(f'/api/v1/players/search?{query}').status_code == 400
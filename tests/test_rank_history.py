@@ -0,0 +1,51 @@
+# tests/test_rank_history.py
+from datetime import date, timedelta
+
+import pytest
+
+from ranking import RankingEngine
+
+DAYS = [date(2023, 9, 1), date(2024, 1, 15), date(2024, 3, 1)]
+
+def build_engine(app_module, as_of):
+    # Fresh leaderboards of a past day, from every result in the database
+    with app_module.app.app_context():
+        score_table = app_module.get_score_table()
+        score_version = app_module.get_current_score_version()
+        players = [(usab_id, player.player_name, player.birth_year) for usab_id, player in app_module.get_usab_players_dict().items()]
+        rows = app_module.execute_sql_query(app_module.RANKING_HISTORY_RESULTS_SQL)
+    engine = RankingEngine(score_table, score_version, app_module.ALL_AGE_GROUPS, app_module.ALL_EVENT_TYPES, as_of)
+    return engine.build(players, score_table.encode(rows))
+
+@pytest.mark.parametrize('as_of', DAYS)
+def test_as_of_ranks_match_fresh_build(client, app_module, as_of):
+    engine = build_engine(app_module, as_of)
+    assert any(engine.leaderboards.values())
+    for event_type, age_group in [('BS', 'U15'), ('GD', 'U13'), ('XD', 'U19')]:
+        response = client.get(f'/api/v1/ranks?event_type={event_type}&age_group={age_group}&as_of={as_of}')
+        assert response.get_json() == engine.get_page(event_type, age_group)
+
+def test_player_rank_history(client, app_module):
+    engines = {day: build_engine(app_module, day) for day in DAYS}
+    negative_total, usab_id = engines[DAYS[1]].leaderboards[('BS', 'U15')][0]
+    interval = (DAYS[1] - DAYS[0]).days
+    response = client.get(f'/api/v1/player/{usab_id}/ranks?event_type=BS&min_date={DAYS[0]}&max_date={DAYS[1]}&interval={interval}')
+    history = response.get_json()
+    expected = []
+    for day in DAYS[:2]:
+        for age_group in sorted(app_module.ALL_AGE_GROUPS):
+            rank = engines[day].get_rank(usab_id, 'BS', age_group)
+            if rank is not None:
+                expected.append({'as_of': str(day), 'event_type': 'BS', 'age_group': age_group, 'scores': rank[0], 'rank': rank[1]})
+    assert history == expected
+    assert {'as_of': str(DAYS[1]), 'event_type': 'BS', 'age_group': 'U15', 'scores': -negative_total, 'rank': 1} in history
+
+@pytest.mark.parametrize('url', [
+    '/api/v1/ranks?event_type=BS&age_group=U15&as_of=2024-13-01',
+    '/api/v1/ranks?event_type=BS&age_group=U15&as_of=1800-01-01',
+    '/api/v1/player/2441/ranks?min_date=2024-02-01&max_date=2024-01-01',
+    '/api/v1/player/2441/ranks?interval=0',
+    f'/api/v1/player/2441/ranks?min_date={date(2020, 1, 1)}&max_date={date(2020, 1, 1) + timedelta(days=400)}&interval=1',
+])
+def test_invalid_history_requests(client, url):
+    assert client.get(url).status_code == 400
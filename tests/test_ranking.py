@@ -0,0 +1,204 @@
+# tests/test_ranking.py
+#
+# The incrementally updated leaderboards (ingests, RankingHistory sliding its window) must
+# always equal the ones of a fresh build from the same results.
+import random
+import sqlite3
+from datetime import date, timedelta
+
+import pytest
+
+from columnar_ranking import ColumnarRankingEngine, numpy
+from ranking import MAX_INCREMENTAL_CHANGES, RankingEngine, RankingHistory, ScoreTable
+
+AGE_GROUPS = ['U11', 'U13', 'U15', 'U17', 'U19']
+EVENT_TYPES = ['BS', 'GS', 'BD', 'GD', 'XD']
+TOURNAMENT_TYPES = ['OLC', 'CRC', 'JN']
+STANDING_LEVELS = ['1', '2', '3/4', '5/8', '9/16']
+AS_OF = date(2024, 3, 15)
+
+ENGINES = [RankingEngine, pytest.param(ColumnarRankingEngine, marks=pytest.mark.skipif(numpy is None, reason='numpy is not installed'))]
+
+def make_score_table():
+    # Version 2 scores more and does not score 9/16 at JN tournaments
+    scores = {1: {}, 2: {}}
+    for tournament_type_index, tournament_type in enumerate(TOURNAMENT_TYPES):
+        for age_group in AGE_GROUPS:
+            for level_index, standing_level in enumerate(STANDING_LEVELS):
+                points = (tournament_type_index + 1) * 100 // (level_index + 1)
+                scores[1][(tournament_type, age_group, standing_level)] = points
+                if (tournament_type, standing_level) != ('JN', '9/16'):
+                    scores[2][(tournament_type, age_group, standing_level)] = points * 2 + level_index
+    return ScoreTable(scores)
+
+def make_players(rng, count=60):
+    # (usab_id, player_name, birth_year), a few without a birth year
+    return [(usab_id, f'Player {usab_id}', None if usab_id % 17 == 0 else rng.randint(2006, 2016)) for usab_id in range(1000, 1000 + count)]
+
+def make_tournaments(rng, count, first_day, last_day):
+    # tournament_id -> (tournament_type, end_date)
+    span = (last_day - first_day).days
+    return {f'T{index}': (rng.choice(TOURNAMENT_TYPES), str(first_day + timedelta(days=rng.randint(0, span)))) for index in range(count)}
+
+def make_performances(rng, players, tournaments, count):
+    # Rows as read from player_tournament_score, unique per (usab_id, tournament_id, age_group, event_type).
+    # Some unknown players and standing levels that no version scores
+    usab_ids = [player[0] for player in players] + [1]
+    performances = {}
+    for _ in range(count):
+        usab_id = rng.choice(usab_ids)
+        tournament_id = rng.choice(sorted(tournaments))
+        tournament_type, end_date = tournaments[tournament_id]
+        age_group = rng.choice(AGE_GROUPS)
+        event_type = rng.choice(EVENT_TYPES)
+        standing_level = rng.choice(STANDING_LEVELS + ['R32'])
+        performances[(usab_id, tournament_id, age_group, event_type)] = (
+            usab_id, tournament_id, end_date, tournament_type, age_group, event_type, standing_level)
+    return performances
+
+def build(engine_class, score_table, version, players, performances, as_of=AS_OF):
+    engine = engine_class(score_table, version, AGE_GROUPS, EVENT_TYPES, as_of)
+    return engine.build(players, score_table.encode(performances))
+
+def assert_same_leaderboards(engine, expected):
+    assert engine.leaderboards == expected.leaderboards
+    assert engine.totals == expected.totals
+
+@pytest.mark.parametrize('engine_class', ENGINES)
+@pytest.mark.parametrize('version', [1, 2])
+def test_build_matches_python_engine(engine_class, version):
+    rng = random.Random(1)
+    score_table = make_score_table()
+    players = make_players(rng)
+    tournaments = make_tournaments(rng, 30, AS_OF - timedelta(days=500), AS_OF + timedelta(days=30))
+    performances = list(make_performances(rng, players, tournaments, 1500).values())
+
+    engine = build(engine_class, score_table, version, players, performances)
+    assert any(engine.leaderboards.values())
+    assert_same_leaderboards(engine, build(RankingEngine, score_table, version, players, performances))
+
+def make_database(tournaments, performances):
+    # The tables ColumnarRankingEngine.load reads, with the rows of the performances
+    connection = sqlite3.connect(':memory:')
+    connection.execute('CREATE TABLE tournament (tournament_id VARCHAR(50) PRIMARY KEY, tournament_type VARCHAR(20), end_date DATE)')
+    connection.execute("""CREATE TABLE player_tournament_score (tournament_id VARCHAR(50), tournament_player_id INTEGER, age_group VARCHAR(10),
+                          event_type VARCHAR(20), standing_level VARCHAR(10), usab_id INTEGER)""")
+    connection.executemany('INSERT INTO tournament VALUES (?, ?, ?)', [(tournament_id,) + tournament for tournament_id, tournament in tournaments.items()])
+    rows = [(tournament_id, index, age_group, event_type, standing_level, usab_id)
+            for index, (usab_id, tournament_id, _, _, age_group, event_type, standing_level) in enumerate(performances)]
+    connection.executemany('INSERT INTO player_tournament_score VALUES (?, ?, ?, ?, ?, ?)', rows)
+    return connection
+
+@pytest.mark.skipif(numpy is None, reason='numpy is not installed')
+@pytest.mark.parametrize('as_of', [None, AS_OF])
+def test_load_matches_python_engine(as_of):
+    rng = random.Random(5)
+    score_table = make_score_table()
+    players = make_players(rng)
+    today = as_of or date.today()
+    tournaments = make_tournaments(rng, 30, today - timedelta(days=500), today + timedelta(days=30))
+    # A tournament type that no version scores
+    tournaments['T-OTHER'] = ('XX', str(today))
+    performances = list(make_performances(rng, players, tournaments, 1500).values())
+    connection = make_database(tournaments, performances)
+    try:
+        engine = ColumnarRankingEngine(score_table, 2, AGE_GROUPS, EVENT_TYPES, as_of).load(players, connection)
+    finally:
+        connection.close()
+
+    expected = RankingEngine(score_table, 2, AGE_GROUPS, EVENT_TYPES, as_of).build(players, score_table.encode(performances))
+    assert any(engine.leaderboards.values())
+    assert_same_leaderboards(engine, expected)
+    for event_type, age_group in expected.leaderboards:
+        assert engine.get_page_and_size(event_type, age_group, 3, 5) == expected.get_page_and_size(event_type, age_group, 3, 5)
+        for usab_id in [player[0] for player in players]:
+            assert engine.get_rank(usab_id, event_type, age_group) == expected.get_rank(usab_id, event_type, age_group)
+
+@pytest.mark.parametrize('engine_class', ENGINES)
+@pytest.mark.parametrize('changes', [5, MAX_INCREMENTAL_CHANGES * 40])
+def test_ingest_matches_fresh_build(engine_class, changes):
+    # Same steps as the ingest endpoint: remove the previous results of a tournament, add the new ones
+    # and reposition their players
+    rng = random.Random(changes)
+    score_table = make_score_table()
+    players = make_players(rng, 300)
+    tournaments = make_tournaments(rng, 30, AS_OF - timedelta(days=400), AS_OF)
+    performances = make_performances(rng, players, tournaments, 1500)
+    engine = build(engine_class, score_table, 2, players, performances.values())
+
+    for _ in range(5):
+        tournament_id = rng.choice(sorted(tournaments))
+        old_results = [key for key in performances if key[1] == tournament_id]
+        new_results = make_performances(rng, players, {tournament_id: tournaments[tournament_id]}, changes)
+        changed_usab_ids = {key[0] for key in old_results} | {key[0] for key in new_results}
+        for key in old_results:
+            del performances[key]
+        performances.update(new_results)
+
+        for usab_id in {key[0] for key in old_results}:
+            engine.remove_results(usab_id, tournament_id)
+        for performance in new_results.values():
+            engine.add_result(*performance)
+        engine.update_players(changed_usab_ids)
+        assert_same_leaderboards(engine, build(RankingEngine, score_table, 2, players, performances.values()))
+
+@pytest.mark.parametrize('engine_class', ENGINES)
+def test_update_players_keeps_previous_leaderboards(engine_class):
+    # Readers holding a leaderboard list keep the one they got
+    rng = random.Random(2)
+    score_table = make_score_table()
+    players = make_players(rng)
+    tournaments = make_tournaments(rng, 20, AS_OF - timedelta(days=300), AS_OF)
+    performances = make_performances(rng, players, tournaments, 1000)
+    engine = build(engine_class, score_table, 1, players, performances.values())
+    before = {key: list(leaderboard) for key, leaderboard in engine.leaderboards.items()}
+    held = dict(engine.leaderboards)
+
+    tournament_id = sorted(tournaments)[0]
+    for usab_id in {key[0] for key in performances if key[1] == tournament_id}:
+        engine.remove_results(usab_id, tournament_id)
+    engine.update_players([player[0] for player in players])
+    assert held == before
+    assert engine.leaderboards != before
+
+def test_history_matches_fresh_build():
+    rng = random.Random(3)
+    score_table = make_score_table()
+    players = make_players(rng)
+    first_day = date(2021, 1, 1)
+    tournaments = make_tournaments(rng, 80, first_day, date(2024, 6, 30))
+    performances = list(make_performances(rng, players, tournaments, 4000).values())
+    history = RankingHistory(score_table, AGE_GROUPS, EVENT_TYPES, max_snapshots=4).build(players, score_table.encode(performances))
+
+    # Back and forth across years (players change age groups) and leap days
+    days = [first_day + timedelta(days=rng.randint(0, 1300)) for _ in range(25)] + [date(2024, 2, 29), date(2024, 3, 1), date(2023, 3, 1)]
+    rng.shuffle(days)
+    # Then day by day over a new year, where players change age groups while few of their results do
+    days += [date(2022, 12, 29) + timedelta(days=index) for index in range(6)]
+    for day in days:
+        for version in (1, 2):
+            # Snapshots only carry the leaderboards
+            assert history.get_engine(day, version).leaderboards == build(RankingEngine, score_table, version, players, performances, day).leaderboards
+
+def test_player_history_matches_fresh_build():
+    rng = random.Random(4)
+    score_table = make_score_table()
+    players = make_players(rng, 30)
+    tournaments = make_tournaments(rng, 40, date(2022, 1, 1), date(2024, 3, 1))
+    performances = list(make_performances(rng, players, tournaments, 2000).values())
+    history = RankingHistory(score_table, AGE_GROUPS, EVENT_TYPES).build(players, score_table.encode(performances))
+    # The shared engine is somewhere else when the walk starts
+    history.get_engine(date(2022, 6, 1), 2)
+
+    days = [date(2023, 1, 1) + timedelta(days=30 * index) for index in range(15)]
+    keys = [(event_type, age_group) for event_type in EVENT_TYPES for age_group in AGE_GROUPS]
+    for usab_id in [player[0] for player in players[:10]]:
+        expected = []
+        for day in days:
+            engine = build(RankingEngine, score_table, 2, players, performances, day)
+            for event_type, age_group in keys:
+                rank = engine.get_rank(usab_id, event_type, age_group)
+                if rank is not None:
+                    expected.append((day, event_type, age_group) + rank)
+        assert history.get_player_history(usab_id, days, keys, 2) == expected
+    assert history.engines[2].as_of == date(2022, 6, 1)
@@ -0,0 +1,27 @@
+# tests/test_schema.py
+import sqlite3
+
+from schema import PLAYER_TOURNAMENT_SCORE_SELECT_SQL, SCHEMA_VERSION, ensure_migrated, has_player_tournament_score
+
+def test_ensure_migrated_runs_once(shipped_database):
+    connection = sqlite3.connect(shipped_database)
+    assert not has_player_tournament_score(connection)
+    connection.close()
+
+    assert ensure_migrated(shipped_database)
+    assert not ensure_migrated(shipped_database)
+
+    connection = sqlite3.connect(shipped_database)
+    assert connection.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION
+    materialized = connection.execute('SELECT COUNT(*) FROM player_tournament_score').fetchone()[0]
+    assert materialized > 0
+    assert materialized == connection.execute(f'SELECT COUNT(*) FROM ({PLAYER_TOURNAMENT_SCORE_SELECT_SQL})').fetchone()[0]
+    connection.close()
+
+def test_shipped_database_is_served(client, app_module):
+    # The copy served by the tests is the shipped, unmigrated, database: warm_up migrated it
+    usab_id = app_module.execute_sql_query('SELECT usab_id FROM player_tournament_score WHERE usab_id != 0 LIMIT 1')[0]['usab_id']
+    response = client.get(f'/api/v1/player/{usab_id}/performance')
+    assert response.status_code == 200
+    assert response.get_json()
+    assert client.get('/api/v1/ranks?event_type=BS&age_group=U13').status_code == 200
@@ -0,0 +1,33 @@
+# tests/test_score_versions.py
+from datetime import date
+
+import pytest
+
+from ranking import MISSING_POINTS, RankingEngine, ScoreTable
+
+def test_score_table_codes_every_version():
+    score_table = ScoreTable({1: {('JN', 'U15', '1'): 100, ('JN', 'U15', '2'): 50}, 2: {('JN', 'U15', '1'): 120, ('OLC', 'U13', '1'): 80}})
+    code = score_table.get_code('JN', 'U15', '1')
+    assert (score_table.points[1][code], score_table.points[2][code]) == (100, 120)
+    # Known values that a version does not score, and values no version knows
+    assert score_table.points[2][score_table.get_code('JN', 'U15', '2')] == MISSING_POINTS
+    assert score_table.points[1][score_table.get_code('OLC', 'U13', '1')] == MISSING_POINTS
+    assert score_table.get_code('JN', 'U15', '3/4') is None
+
+    rows = [(7, 'T1', '2024-01-01', 'JN', 'U15', 'BS', '1'), (7, 'T2', '2024-01-01', 'OLC', 'U13', 'BS', '1')]
+    # The same coded rows ranked under both versions
+    coded_rows = list(score_table.encode(rows))
+    totals = {version: RankingEngine(score_table, version, ['U13', 'U15'], ['BS'], date(2024, 2, 1)).build([(7, 'Player 7', 2012)], coded_rows).totals
+              for version in (1, 2)}
+    assert totals[1] == {(7, 'BS', 'U15'): 100}
+    assert totals[2] == {(7, 'BS', 'U13'): 80, (7, 'BS', 'U15'): 200}
+
+@pytest.mark.parametrize('url', ['/api/v1/ranks?event_type=BS&age_group=U15', '/api/v1/player/2441/performance',
+                                 '/api/v1/player/2441/ranks'])
+def test_score_version_parameter(client, app_module, url):
+    with app_module.app.app_context():
+        version = app_module.get_current_score_version()
+    separator = '&' if '?' in url else '?'
+    assert client.get(f'{url}{separator}score_version={version}').get_json() == client.get(url).get_json()
+    for invalid in (version + 1, 'x', -1):
+        assert client.get(f'{url}{separator}score_version={invalid}').status_code == 400
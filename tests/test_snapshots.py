@@ -0,0 +1,93 @@
+# tests/test_snapshots.py
+import os
+import sqlite3
+import time
+
+import pytest
+
+import snapshots
+from snapshots import SnapshotManager, activate_snapshot, list_snapshots, prune_snapshots, publish_snapshot, read_pointer, verify_snapshot
+
+def wait_for(condition, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+@pytest.fixture
+def snapshot_dir(tmp_path):
+    return str(tmp_path / 'snapshots')
+
+def test_publish_and_activate(shipped_database, snapshot_dir):
+    # The shipped database is not migrated yet: it cannot be served as is
+    assert 'missing table player_tournament_score' in verify_snapshot(shipped_database)
+    first = publish_snapshot(shipped_database, snapshot_dir)
+    assert read_pointer(snapshot_dir) == first
+    path = os.path.join(snapshot_dir, first)
+    assert verify_snapshot(path) == []
+    connection = sqlite3.connect(path)
+    assert connection.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    connection.close()
+
+    second = publish_snapshot(path, snapshot_dir)
+    assert list_snapshots(snapshot_dir) == [first, second]
+    assert read_pointer(snapshot_dir) == second
+    # Roll back
+    activate_snapshot(first, snapshot_dir)
+    assert read_pointer(snapshot_dir) == first
+    with pytest.raises(ValueError):
+        activate_snapshot('tournament-19700101T000000000000.db', snapshot_dir)
+
+def test_broken_databases_are_not_published(shipped_database, snapshot_dir, tmp_path):
+    name = publish_snapshot(shipped_database, snapshot_dir)
+    path = os.path.join(snapshot_dir, name)
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.execute('DELETE FROM player_tournament_score WHERE rowid IN (SELECT rowid FROM player_tournament_score LIMIT 1)')
+    connection.close()
+    assert verify_snapshot(path)[0].startswith('player_tournament_score has ')
+    with pytest.raises(ValueError):
+        activate_snapshot(name, snapshot_dir)
+
+    empty_database = str(tmp_path / 'empty.db')
+    sqlite3.connect(empty_database).close()
+    with pytest.raises(ValueError, match='cannot be published'):
+        publish_snapshot(empty_database, snapshot_dir)
+    # Nothing left behind, the pointer did not move
+    assert list_snapshots(snapshot_dir) == [name]
+    assert not [file_name for file_name in os.listdir(snapshot_dir) if '.tmp' in file_name]
+
+def test_prune_keeps_the_current_snapshot(snapshot_dir):
+    os.makedirs(snapshot_dir)
+    names = [f'tournament-2024010{day}T000000000000.db' for day in range(1, 6)]
+    for name in names:
+        open(os.path.join(snapshot_dir, name), 'w').close()
+    snapshots.write_pointer(snapshot_dir, names[0])
+    assert prune_snapshots(snapshot_dir, keep=2) == names[1:3]
+    assert list_snapshots(snapshot_dir) == [names[0]] + names[3:]
+
+def test_manager_switches_after_requests_drain(shipped_database, snapshot_dir, monkeypatch):
+    closed = []
+    close = snapshots.Snapshot.close
+    monkeypatch.setattr(snapshots.Snapshot, 'close', lambda snapshot: (closed.append(snapshot.version), close(snapshot)))
+    activated = []
+    manager = SnapshotManager(shipped_database, snapshot_dir, 2,
+                              warm=lambda snapshot: lambda: activated.append(snapshot.version))
+    # Nothing published: the database itself is served
+    old_snapshot = manager.acquire()
+    assert (old_snapshot.path, old_snapshot.version) == (shipped_database, None)
+
+    name = publish_snapshot(shipped_database, snapshot_dir)
+    manager.acquire().release()
+    wait_for(lambda: manager.current.version == name)
+    assert activated == [name]
+    # The request that started on the old snapshot finishes on it
+    assert old_snapshot.read_pool.execute('SELECT COUNT(*) AS count FROM tournament')[0]['count'] > 0
+    assert closed == []
+    old_snapshot.release()
+    assert closed == [None]
+
+    snapshot = manager.acquire()
+    assert snapshot.read_pool.execute('SELECT COUNT(*) AS count FROM player_tournament_score')[0]['count'] > 0
+    snapshot.release()
+    manager.current.retire()
@@ -0,0 +1,87 @@
+# tests/test_streams.py
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from datetime import date, timedelta
+
+import pytest
+
+from tests.conftest import REPO_DIR
+
+STREAM_URL = '/api/v1/ranks/stream?event_type=BS&age_group=U19'
+
+def test_stream_sends_leaderboard_then_changes(client, app_module, tournament_results, post_results):
+    usab_ids = [row['usab_id'] for row in app_module.execute_sql_query(
+        'SELECT usab_id FROM usab_player WHERE usab_id != 0 AND birth_year >= 2010 ORDER BY usab_id DESC LIMIT 2')]
+    response = client.get(STREAM_URL)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    chunks = iter(response.response)
+    try:
+        assert next(chunks).startswith(b'retry: ')
+        assert next(chunks).startswith(b'event: leaderboard\n')
+        assert post_results('STREAM-TEST', tournament_results(usab_ids=usab_ids, end_date=str(date.today() - timedelta(days=3)))).status_code == 200
+        delta = next(chunks).decode()
+        assert delta.startswith('event: delta\n')
+        assert all(f'"usab_id":{usab_id}' in delta for usab_id in usab_ids)
+    finally:
+        response.close()
+
+def test_streams_over_the_limit_are_503(client, app_module, monkeypatch):
+    monkeypatch.setattr(app_module.leaderboard_broadcaster, 'max_subscribers', 1)
+    first = client.get(STREAM_URL)
+    try:
+        assert first.status_code == 200
+        response = client.get(STREAM_URL)
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == str(app_module.BUSY_RETRY_SECONDS)
+    finally:
+        first.close()
+    # Closing a stream frees its place
+    response = client.get(STREAM_URL)
+    assert response.status_code == 200
+    response.close()
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def test_stream_server_holds_many_viewers():
+    pytest.importorskip('gevent')
+    port = get_free_port()
+    env = dict(os.environ, STREAM_BIND=f'127.0.0.1:{port}', STREAM_WORKERS='1')
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn_stream.conf.py', 'app:app'], cwd=REPO_DIR, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    viewers = []
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port)).close()
+                break
+            except ConnectionRefusedError:
+                assert time.monotonic() < deadline and server.poll() is None
+                time.sleep(0.2)
+
+        # Many more viewers than a gthread worker has threads, all on one worker
+        for _ in range(300):
+            viewer = socket.create_connection(('127.0.0.1', port), timeout=20)
+            viewer.sendall(f'GET {STREAM_URL} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+            viewers.append(viewer)
+        for viewer in viewers:
+            data = b''
+            while b'event: leaderboard' not in data:
+                chunk = viewer.recv(65536)
+                assert chunk, data
+                data += chunk
+            assert data.startswith(b'HTTP/1.1 200')
+    finally:
+        for viewer in viewers:
+            viewer.close()
+        # Quick shutdown, the streams would hold up a graceful one
+        server.send_signal(signal.SIGINT)
+        server.wait(timeout=30)
@@ -0,0 +1,34 @@
+# tests/test_warm_up.py
+import threading
+import time
+
+def test_warm_up_fills_the_caches(app_module):
+    # app_module ran warm_up, like post_worker_init does
+    with app_module.app.app_context():
+        assert app_module.cache.get(app_module.PLAYER_LIST_CACHE_KEY) is not None
+        assert app_module.cache.get(app_module.CURRENT_SCORES_DICT_CACHE_KEY) is not None
+        assert app_module.get_current_score_version() in app_module.ranking_engines
+        assert app_module.player_search_index is not None
+
+def test_concurrent_misses_load_once(app_module):
+    loads = []
+    results = []
+
+    def load():
+        loads.append(threading.get_ident())
+        # Slow enough for every other thread to miss meanwhile
+        time.sleep(0.2)
+        return ['loaded']
+
+    def request():
+        with app_module.app.app_context():
+            results.append(app_module.get_or_load('warm_up_test_list', load))
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(loads) == 1
+    assert results == [['loaded']] * 8
+    assert app_module.cache_load_locks == {}